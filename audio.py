@@ -0,0 +1,361 @@
+from __future__ import annotations
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from math import gcd
+import os
+from os import path
+import struct
+from typing import BinaryIO, Optional, Union
+
+from functions import WarningException, import_numpy, logger
+from profiler import get_profiler
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+KSDATAFORMAT_SUBTYPE_PCM = struct.pack("<IHH8s", WAVE_FORMAT_PCM, 0x0000, 0x0010, b"\x80\x00\x00\xaa\x00\x38\x9b\x71")
+
+# Format expected by DBTool
+NORMALIZED_SAMPLE_RATE = 44100
+NORMALIZED_SAMPWIDTH = 2
+NORMALIZED_CHANNELS = 1
+
+RESAMPLE_HALF_TAPS = 24  # Input samples on each side of an output sample
+RESAMPLE_ROLLOFF = 0.95  # Cutoff relative to the lower Nyquist frequency
+RESAMPLE_KAISER_BETA = 8.6
+NORMALIZE_CHUNK_FRAMES = 1 << 16  # Output frames converted at once
+PAGE_SIZE = 4096  # Bytes, one byte of each page is read to fault a memory-mapped wav in
+
+
+class WavData:
+    """PCM frames of a wav file.
+
+    With NumPy the data chunk is memory-mapped as an (nframes, frame_width) uint8 array,
+    otherwise it holds the raw bytes decoded by pydub."""
+    wav_file: str
+    nchannels: int
+    sampwidth: int
+    framerate: int
+    nframes: int
+    frames: Union["np.ndarray", bytes]
+
+    @property
+    def frame_width(self) -> int:
+        return self.nchannels * self.sampwidth
+
+    @property
+    def nbytes(self) -> int:
+        return self.nframes * self.frame_width
+
+
+def read_wav_chunks(wav_file: str) -> tuple[int, int, int, int, int]:
+    """Returns (nchannels, sampwidth, framerate, data_offset, data_size) of a PCM wav file."""
+    fmt = None
+    with open(wav_file, "rb") as f:
+        riff_header = f.read(12)
+        if len(riff_header) < 12 or riff_header[0:4] != b"RIFF" or riff_header[8:12] != b"WAVE":
+            raise WarningException(f"{wav_file} is not a RIFF wave file")
+
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+
+            if chunk_id == b"fmt ":
+                fmt_chunk = f.read(chunk_size)
+                format_tag, nchannels, framerate, _, block_align, bits = struct.unpack("<HHIIHH", fmt_chunk[:16])
+                if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt_chunk) >= 26:
+                    format_tag = struct.unpack("<H", fmt_chunk[24:26])[0]
+                if format_tag != WAVE_FORMAT_PCM:
+                    raise WarningException(f"{wav_file} is not a PCM wave file (format {format_tag})")
+                # The container of a sample can be wider than its bits, e.g. 24 bits in 4 bytes
+                if nchannels > 0 and block_align > 0 and block_align % nchannels == 0:
+                    sampwidth = block_align // nchannels
+                else:
+                    sampwidth = (bits + 7) // 8
+                fmt = (nchannels, sampwidth, framerate)
+                f.seek(chunk_size & 1, 1)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise WarningException(f"{wav_file} has no fmt chunk before the data chunk")
+                return fmt + (f.tell(), chunk_size)
+            else:
+                f.seek(chunk_size + (chunk_size & 1), 1)
+
+    raise WarningException(f"{wav_file} has no data chunk")
+
+
+def load_wav(wav_file: str) -> WavData:
+    wav_data = WavData()
+    wav_data.wav_file = wav_file
+
+    np = import_numpy()
+    if np is not None:
+        nchannels, sampwidth, framerate, data_offset, data_size = read_wav_chunks(wav_file)
+        wav_data.nchannels = nchannels
+        wav_data.sampwidth = sampwidth
+        wav_data.framerate = framerate
+
+        # Truncated files declare more data than they contain
+        file_size = path.getsize(wav_file)
+        data_size = min(data_size, file_size - data_offset)
+        wav_data.nframes = data_size // wav_data.frame_width
+
+        if wav_data.nframes > 0:
+            wav_data.frames = np.memmap(wav_file, dtype=np.uint8, mode="r", offset=data_offset,
+                                        shape=(wav_data.nframes, wav_data.frame_width))
+        else:
+            wav_data.frames = np.zeros((0, wav_data.frame_width), dtype=np.uint8)
+    else:  # Fall back to pydub
+        from pydub import AudioSegment
+
+        sound = AudioSegment.from_wav(wav_file)
+        wav_data.nchannels = sound.channels
+        wav_data.sampwidth = sound.sample_width
+        wav_data.framerate = sound.frame_rate
+        wav_data.nframes = int(sound.frame_count())
+        wav_data.frames = sound.raw_data
+
+    profiler = get_profiler()
+    profiler.count("wav_files_loaded")
+    profiler.count("wav_bytes_loaded", wav_data.nbytes)
+
+    return wav_data
+
+
+def crop_wav(wav_data: WavData, start_frame: int, end_frame: int) -> Union["np.ndarray", bytearray]:
+    """Cuts [start_frame, end_frame) from the wav, frames outside of the file are filled with silence."""
+    frame_width = wav_data.frame_width
+    n_frames = max(end_frame - start_frame, 0)
+    silence = 0x80 if wav_data.sampwidth == 1 else 0  # 8-bit PCM is unsigned
+
+    src_start = min(max(start_frame, 0), wav_data.nframes)
+    src_end = min(max(end_frame, 0), wav_data.nframes)
+    dst_start = src_start - start_frame
+
+    np = import_numpy()
+    if np is not None:
+        output = np.full((n_frames, frame_width), silence, dtype=np.uint8)
+        output[dst_start:dst_start + src_end - src_start] = wav_data.frames[src_start:src_end]
+    else:
+        output = bytearray([silence]) * (n_frames * frame_width)
+        output[dst_start * frame_width:(dst_start + src_end - src_start) * frame_width] = \
+            memoryview(wav_data.frames)[src_start * frame_width:src_end * frame_width]
+
+    return output
+
+
+def write_wav(output_file: str, wav_data: WavData, frames: Union["np.ndarray", bytearray]) -> int:
+    """Writes PCM frames with the format of wav_data, returns the file size."""
+    if path.lexists(output_file):
+        os.remove(output_file)  # Do not write through a hardlink shared with another segment
+
+    with open(output_file, "wb") as f:
+        return write_wav_to(f, wav_data, frames)
+
+
+def write_wav_to(f: BinaryIO, wav_data: WavData, frames: Union["np.ndarray", bytearray]) -> int:
+    """Writes a wav file with PCM frames to a binary stream, returns the number of bytes written.
+
+    Formats with more than 16 bits or 2 channels get a WAVE_FORMAT_EXTENSIBLE header."""
+    frame_data = memoryview(frames).cast("B")
+    data_size = len(frame_data)
+    pad = data_size & 1
+    bits = wav_data.sampwidth * 8
+    fmt_chunk = struct.pack("<HHIIHH", WAVE_FORMAT_PCM, wav_data.nchannels, wav_data.framerate,
+                            wav_data.framerate * wav_data.frame_width, wav_data.frame_width, bits)
+    if bits > 16 or wav_data.nchannels > 2:
+        # No speaker positions in the channel mask
+        fmt_chunk = struct.pack("<H", WAVE_FORMAT_EXTENSIBLE) + fmt_chunk[2:] + struct.pack("<HHI", 22, bits, 0) \
+            + KSDATAFORMAT_SUBTYPE_PCM
+    header = struct.pack("<4sI4s4sI", b"RIFF", 4 + 8 + len(fmt_chunk) + 8 + data_size + pad, b"WAVE", b"fmt ", len(fmt_chunk)) \
+        + fmt_chunk + struct.pack("<4sI", b"data", data_size)
+    f.write(header)
+    f.write(frame_data)
+    if pad:
+        f.write(b"\0")
+
+    return len(header) + data_size + pad
+
+
+def is_normalized(wav_data: WavData) -> bool:
+    return (wav_data.framerate == NORMALIZED_SAMPLE_RATE and wav_data.sampwidth == NORMALIZED_SAMPWIDTH
+            and wav_data.nchannels == NORMALIZED_CHANNELS)
+
+
+def decode_mono(frames: "np.ndarray", nchannels: int, sampwidth: int) -> "np.ndarray":
+    """Converts (n, frame_width) uint8 PCM frames to float32 mono samples in [-1, 1)."""
+    np = import_numpy()
+    samples = frames.reshape(len(frames), nchannels, sampwidth)
+
+    if sampwidth == 1:  # Unsigned
+        values = samples[:, :, 0].astype(np.float32) - 128
+    elif sampwidth == 3:
+        values = (samples[:, :, 0].astype(np.int32) | (samples[:, :, 1].astype(np.int32) << 8)
+                  | (samples[:, :, 2].astype(np.int8).astype(np.int32) << 16)).astype(np.float32)
+    else:
+        values = np.ascontiguousarray(samples).view("<i%d" % sampwidth)[:, :, 0].astype(np.float32)
+
+    return values.mean(axis=1) / (1 << (sampwidth * 8 - 1))
+
+
+@lru_cache(maxsize=None)
+def _get_resample_filter(up: int, down: int) -> "np.ndarray":
+    """Returns the Kaiser windowed sinc filter of each of the up phases, shape (up, 2 * RESAMPLE_HALF_TAPS)."""
+    np = import_numpy()
+    cutoff = min(1.0, up / down) * RESAMPLE_ROLLOFF
+    half_taps = RESAMPLE_HALF_TAPS
+
+    # Distance in input samples from each output position to the input samples around it
+    phase = np.arange(up)[:, None] / up
+    distance = phase + half_taps - 1 - np.arange(2 * half_taps)[None, :]
+
+    window = np.i0(RESAMPLE_KAISER_BETA * np.sqrt(np.clip(1 - (distance / half_taps) ** 2, 0, None))) / np.i0(RESAMPLE_KAISER_BETA)
+    taps = cutoff * np.sinc(cutoff * distance) * window
+    taps /= taps.sum(axis=1, keepdims=True)  # Unity gain at DC for every phase
+
+    return taps.astype(np.float32)
+
+
+def normalize_wav(wav_data: WavData) -> WavData:
+    """Converts a wav to 44.1 kHz, 16-bit mono.
+
+    Channels are averaged, the rate is changed with a polyphase windowed sinc filter and the
+    samples are requantized with TPDF dither. The source is read in chunks, so only the
+    output is held in memory."""
+    if is_normalized(wav_data):
+        return wav_data
+
+    np = import_numpy()
+    if np is None:
+        raise WarningException("Normalizing wav files needs NumPy")
+
+    factor = gcd(wav_data.framerate, NORMALIZED_SAMPLE_RATE)
+    up = NORMALIZED_SAMPLE_RATE // factor
+    down = wav_data.framerate // factor
+    taps = _get_resample_filter(up, down) if up != down else None
+    half_taps = RESAMPLE_HALF_TAPS
+
+    n_output = (wav_data.nframes * up + down - 1) // down
+    output = np.empty(n_output, dtype="<i2")
+    dither = np.random.default_rng(0)  # Same output on every run
+    full_scale = (1 << (NORMALIZED_SAMPWIDTH * 8 - 1)) - 1
+
+    for chunk_start in range(0, n_output, NORMALIZE_CHUNK_FRAMES):
+        chunk_end = min(chunk_start + NORMALIZE_CHUNK_FRAMES, n_output)
+        position = np.arange(chunk_start, chunk_end, dtype=np.int64) * down
+
+        if taps is None:
+            samples = decode_mono(wav_data.frames[chunk_start:chunk_end], wav_data.nchannels, wav_data.sampwidth)
+        else:
+            # Input samples read by this chunk, outside of the file is silence
+            input_index = position // up
+            read_start = int(input_index[0]) - half_taps + 1
+            read_end = int(input_index[-1]) + half_taps + 1
+            source = np.zeros(read_end - read_start, dtype=np.float32)
+            src_start = max(read_start, 0)
+            src_end = min(read_end, wav_data.nframes)
+            if src_end > src_start:
+                source[src_start - read_start:src_end - read_start] = decode_mono(
+                    wav_data.frames[src_start:src_end], wav_data.nchannels, wav_data.sampwidth)
+
+            window = (input_index - read_start)[:, None] - half_taps + 1 + np.arange(2 * half_taps)[None, :]
+            samples = np.einsum("ij,ij->i", source[window], taps[position % up])
+
+        noise = dither.random(len(samples), dtype=np.float32) - dither.random(len(samples), dtype=np.float32)
+        output[chunk_start:chunk_end] = np.clip(np.rint(samples * full_scale + noise), -full_scale - 1, full_scale)
+
+    normalized = WavData()
+    normalized.wav_file = wav_data.wav_file
+    normalized.nchannels = NORMALIZED_CHANNELS
+    normalized.sampwidth = NORMALIZED_SAMPWIDTH
+    normalized.framerate = NORMALIZED_SAMPLE_RATE
+    normalized.nframes = n_output
+    normalized.frames = output.view(np.uint8).reshape(n_output, normalized.frame_width)
+
+    get_profiler().count("wav_files_normalized")
+
+    return normalized
+
+
+class AudioCache:
+    """LRU cache of source WAVs, bounded by the size of their PCM buffers.
+
+    With normalize, each wav is converted to 44.1 kHz 16-bit mono once when it is loaded.
+    Wavs which are needed soon can be read ahead by a reader thread with prefetch."""
+
+    def __init__(self, max_bytes: int, normalize: bool = False) -> None:
+        self.max_bytes = max_bytes
+        self.normalize = normalize
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[str, WavData] = OrderedDict()
+        self._prefetched: dict[str, Future] = {}
+        self._reader: Optional[ThreadPoolExecutor] = None
+
+    def _load(self, wav_file: str) -> WavData:
+        wav_data = load_wav(wav_file)
+        if self.normalize:
+            wav_data = normalize_wav(wav_data)
+        return wav_data
+
+    def _read_ahead(self, wav_file: str) -> WavData:
+        wav_data = self._load(wav_file)
+        np = import_numpy()
+        if np is not None and isinstance(wav_data.frames, np.memmap):
+            # Fault the pages in here, they are read by the file system while the main thread renders
+            np.add.reduce(wav_data.frames.reshape(-1)[::PAGE_SIZE])
+        return wav_data
+
+    def prefetch(self, wav_file: str):
+        """Starts reading a wav in the reader thread, the next get of it waits for the result instead of reading it again."""
+        key = path.realpath(wav_file)
+        if key in self._items or key in self._prefetched:
+            return
+
+        if self._reader is None:
+            self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="oto2seg-reader")
+        self._prefetched[key] = self._reader.submit(self._read_ahead, wav_file)
+
+    def get(self, wav_file: str) -> WavData:
+        key = path.realpath(wav_file)
+
+        wav_data = self._items.get(key)
+        if wav_data is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            get_profiler().count("audio_cache_hits")
+            return wav_data
+
+        self.misses += 1
+        get_profiler().count("audio_cache_misses")
+        future = self._prefetched.pop(key, None)
+        if future is not None:
+            get_profiler().count("wav_files_prefetched")
+            wav_data = future.result()
+        else:
+            wav_data = self._load(wav_file)
+        wav_size = wav_data.nbytes
+
+        if wav_size > self.max_bytes:
+            # Larger than the whole cache, use it once and drop it
+            logger.debug(f"{wav_file} is larger than the audio cache, it will not be cached.")
+            return wav_data
+
+        while self._items and self.used_bytes + wav_size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.used_bytes -= evicted.nbytes
+
+        self._items[key] = wav_data
+        self.used_bytes += wav_size
+
+        return wav_data
+
+    def clear(self) -> None:
+        self._items.clear()
+        self.used_bytes = 0
+        for future in self._prefetched.values():
+            future.cancel()
+        self._prefetched.clear()
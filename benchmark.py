@@ -0,0 +1,262 @@
+from __future__ import annotations
+from argparse import ArgumentParser
+from datetime import datetime
+import json
+import logging
+import os
+from os import path
+import platform
+import random
+import shutil
+import tempfile
+import time
+from typing import TypedDict
+import wave
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import functions
+from functions import TOOL_VERSION, WarningException, logger, read_oto
+from audio import AudioCache, crop_wav
+from lang.jpn_common import JapaneseLanguageTool, hiragana_map
+from oto2seg import generate_articulation_from_oto, get_segment_window, plan_wav_group, render_segment_texts
+
+DEFAULT_SIZES = [100, 1000, 10000]
+SAMPLE_RATES = [44100, 48000, 22050]
+SYLLABLE_LENGTH = 450  # ms
+VOWELS = ["a", "i", "u", "e", "o"]
+
+
+class StageResult(TypedDict):
+    seconds: float
+    items: int
+    items_per_second: float
+
+
+class BenchmarkResult(TypedDict):
+    entries: int
+    wav_files: int
+    sample_rates: list[int]
+    segments: int
+    stages: dict[str, StageResult]
+
+
+def write_synthetic_wav(wav_file: str, sample_rate: int, length: float, rng: random.Random):
+    """Writes a 16-bit mono wav of a sine tone with noise."""
+    n_frames = int(length / 1000 * sample_rate)
+    frequency = rng.uniform(110, 440)
+
+    if np is not None:
+        t = np.arange(n_frames) / sample_rate
+        noise = np.random.default_rng(rng.randrange(1 << 32)).uniform(-2000, 2000, n_frames)
+        samples = (8000 * np.sin(2 * np.pi * frequency * t) + noise).astype("<i2")
+        frame_data = samples.tobytes()
+    else:
+        from array import array
+        import math
+
+        samples = array("h", (int(8000 * math.sin(2 * math.pi * frequency * i / sample_rate) + rng.uniform(-2000, 2000))
+                              for i in range(n_frames)))
+        frame_data = samples.tobytes()  # Little-endian hosts only
+
+    with wave.open(wav_file, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(frame_data)
+
+
+def make_voicebank(bank_dir: str, n_entries: int, sample_rates: list[int], seed: int = 0) -> str:
+    """Writes a voicebank of synthetic wavs with R-C-V, C-V, V-C-V, V-V and V-R aliases, returns the oto.ini path.
+
+    Each wav holds 4 syllables like a recorded VCV take and has 10 oto entries."""
+    rng = random.Random(seed)
+    cv_items = [item for item in hiragana_map if len(item["phoneme"]) == 2 and item["romaji"][-1] in VOWELS]
+
+    oto_lines: list[str] = []
+    wav_index = 0
+    while len(oto_lines) < n_entries:
+        sample_rate = sample_rates[wav_index % len(sample_rates)]
+        syllables = [rng.choice(cv_items) for _ in range(4)]
+        wav_name = "_" + "".join(item["romaji"] for item in syllables) + "_%d.wav" % wav_index
+        wav_length = SYLLABLE_LENGTH * (len(syllables) + 1) + rng.uniform(0, 200)
+
+        write_synthetic_wav(path.join(bank_dir, wav_name), sample_rate, wav_length, rng)
+
+        prev_vowel = None
+        for i, item in enumerate(syllables):
+            start = i * SYLLABLE_LENGTH + rng.uniform(0, 30)
+            kana = item["kana"]
+            if prev_vowel is None:
+                oto_lines.append("%s=- %s,%.1f,120,-300,80,20" % (wav_name, kana, start + 50))
+            else:
+                oto_lines.append("%s=%s %s,%.1f,220,-450,200,80" % (wav_name, prev_vowel, kana, start - 100))
+            oto_lines.append("%s=%s,%.1f,140,-350,90,30" % (wav_name, kana, start + 60))
+            prev_vowel = item["romaji"][-1]
+
+        end = len(syllables) * SYLLABLE_LENGTH
+        oto_lines.append("%s=%s %s,%.1f,100,-250,60,20" % (wav_name, prev_vowel, rng.choice(VOWELS), end - 150))
+        oto_lines.append("%s=%s -,%.1f,100,-300,60,20" % (wav_name, prev_vowel, end - 100))
+
+        wav_index += 1
+
+    oto_file = path.join(bank_dir, "oto.ini")
+    with open(oto_file, "w", encoding="shift-jis") as f:
+        f.write("\n".join(oto_lines[:n_entries]) + "\n")
+
+    return oto_file
+
+
+class StageTimer:
+    def __init__(self) -> None:
+        self.stages: dict[str, StageResult] = {}
+
+    def run(self, stage_name: str, func, *args):
+        """Runs func and records its duration, func returns the number of processed items."""
+        start_time = time.perf_counter()
+        items = func(*args)
+        seconds = time.perf_counter() - start_time
+        self.stages[stage_name] = {
+            "seconds": seconds,
+            "items": items,
+            "items_per_second": items / seconds if seconds > 0 else 0.0,
+        }
+
+
+def benchmark_voicebank(oto_file: str, work_dir: str) -> BenchmarkResult:
+    timer = StageTimer()
+    oto_dict = {}
+    oto_groups = []
+    seg_info_groups = []
+    lang_tool = JapaneseLanguageTool()
+    audio_cache = AudioCache(512 * 1024 * 1024)
+
+    def read_stage():
+        functions._wav_info_cache.clear()
+        oto_dict.update(read_oto(oto_file))
+        oto_groups.extend(oto_list for oto_list in oto_dict.values() if len(oto_list) > 0)
+        return sum(len(oto_list) for oto_list in oto_groups)
+
+    def parse_stage():
+        items = 0
+        for oto_list in oto_groups:
+            for oto_info in oto_list:
+                try:
+                    lang_tool.get_oto_entry_phoneme_info(oto_info)
+                except WarningException:
+                    pass
+                items += 1
+        return items
+
+    def plan_stage():
+        seg_info_groups.extend(plan_wav_group(oto_list, lang_tool, False) for oto_list in oto_groups)
+        return sum(len(seg_info_list) for seg_info_list in seg_info_groups)
+
+    def crop_stage():
+        items = 0
+        for oto_list, seg_info_list in zip(oto_groups, seg_info_groups):
+            wav_data = audio_cache.get(oto_list[0].wav_file)
+            for seg_info in seg_info_list:
+                start_frame, end_frame = get_segment_window(seg_info, wav_data.framerate)
+                crop_wav(wav_data, start_frame, end_frame)
+                items += 1
+        return items
+
+    def text_stage():
+        items = 0
+        for oto_list, seg_info_list in zip(oto_groups, seg_info_groups):
+            sample_rate = oto_list[0].wav_info.framerate
+            for seg_info in seg_info_list:
+                start_frame, end_frame = get_segment_window(seg_info, sample_rate)
+                render_segment_texts(seg_info, start_frame, end_frame, sample_rate, lang_tool)
+                items += 1
+        return items
+
+    def alternative_stage():
+        art_keys = {" ".join(seg_info.art_seg.phonemes) for seg_info_list in seg_info_groups for seg_info in seg_info_list}
+        missing_list = lang_tool.get_missing_list(art_keys)
+        lang_tool.resolve_alternatives(missing_list, art_keys)
+        return len(missing_list)
+
+    def write_stage():
+        output_dir = path.join(work_dir, "output")
+        os.makedirs(output_dir, exist_ok=True)
+        generate_articulation_from_oto(oto_dict, JapaneseLanguageTool(), False, output_dir, AudioCache(512 * 1024 * 1024))
+        return len(os.listdir(output_dir))
+
+    timer.run("read_oto", read_stage)
+    timer.run("parse_alias", parse_stage)
+    timer.run("plan", plan_stage)
+    timer.run("crop", crop_stage)
+    timer.run("render_text", text_stage)
+    timer.run("alternatives", alternative_stage)
+    timer.run("write_all", write_stage)
+
+    return {
+        "entries": timer.stages["read_oto"]["items"],
+        "wav_files": len(oto_groups),
+        "sample_rates": sorted({oto_list[0].wav_info.framerate for oto_list in oto_groups}),
+        "segments": timer.stages["plan"]["items"],
+        "stages": timer.stages,
+    }
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(description="Times each conversion stage on synthetic voicebanks.")
+
+    arg_parser.add_argument("--sizes", help="oto entries of each voicebank. default: %s" % ",".join(map(str, DEFAULT_SIZES)),
+                            default=",".join(map(str, DEFAULT_SIZES)))
+    arg_parser.add_argument("--output", help="result json file. default: bench_output.json", default="bench_output.json")
+    arg_parser.add_argument("--work-dir", help="keep the voicebanks and outputs in this dir instead of a temporary dir", default=None)
+    arg_parser.add_argument("--seed", help="random seed of the voicebanks. default: 0", type=int, default=0)
+
+    args = arg_parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    output_file: str = args.output
+    seed: int = args.seed
+
+    work_root = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix="oto2seg_bench_")
+
+    # Per segment logs would take a large part of the timings
+    log_level = logger.level
+    results: list[BenchmarkResult] = []
+    try:
+        for size in sizes:
+            work_dir = path.join(work_root, "bank_%d" % size)
+            bank_dir = path.join(work_dir, "bank")
+            os.makedirs(bank_dir, exist_ok=True)
+
+            logger.info("Writing voicebank with %d entries..." % size)
+            oto_file = make_voicebank(bank_dir, size, SAMPLE_RATES, seed)
+
+            logger.info("Benchmarking %d entries..." % size)
+            logger.setLevel(logging.WARNING)
+            try:
+                result = benchmark_voicebank(oto_file, work_dir)
+            finally:
+                logger.setLevel(log_level)
+            results.append(result)
+
+            for stage_name, stage in result["stages"].items():
+                logger.info("  %-14s %9.3f s %8d items %12.1f items/s" % (
+                    stage_name, stage["seconds"], stage["items"], stage["items_per_second"]))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    report = {
+        "tool_version": TOOL_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__ if np is not None else None,
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    logger.info("Results written to %s" % output_file)
@@ -0,0 +1,24 @@
+from __future__ import annotations
+from argparse import ArgumentParser
+
+from functions import logger
+from output import extract_archive
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(description="Unpack an archive written by oto2seg.py --output-archive, "
+                                "only the files which differ from the output dir are written.")
+
+    arg_parser.add_argument("archive_file", help="archive written by oto2seg.py")
+    arg_parser.add_argument("output_dir", help="output articulation dir")
+
+    arg_parser.add_argument("--only", help="extract only these segments, e.g. cv_k_a", nargs="+", default=None,
+                            metavar="SEGMENT")
+
+    args = arg_parser.parse_args()
+
+    archive_file: str = args.archive_file
+    output_dir: str = args.output_dir
+    segment_names: list[str] = args.only
+
+    extracted, unchanged = extract_archive(archive_file, output_dir, segment_names)
+    logger.info("%d files extracted, %d files unchanged." % (extracted, unchanged))
@@ -0,0 +1,176 @@
+from __future__ import annotations
+from argparse import ArgumentParser
+from hashlib import sha1
+import json
+import os
+from os import path
+from typing import Optional
+
+from audio import load_wav
+from functions import WavInfo, import_numpy, logger
+from profiler import get_profiler
+from refine import FEATURE_PARAMS, WavFeatures, compute_wav_features
+
+FEATURE_ROWS = ("energy", "zcr", "flux", "peak", "dc", "f0", "voicing")  # Rows of the .npy file of an entry
+
+
+class FeatureCache:
+    """Features of the source wavs, stored as one .npy file per wav and memory-mapped on load.
+
+    An entry is keyed by the absolute wav path, next to the array a json file keeps the size and mtime
+    of the wav and the feature parameters. The entry is computed again when any of them changes."""
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+        if not path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_entry_file(self, wav_file: str) -> str:
+        """Returns the entry file without extension."""
+        return path.join(self.cache_dir, sha1(path.abspath(wav_file).encode("utf-8")).hexdigest())
+
+    @staticmethod
+    def _get_key(wav_info: WavInfo) -> dict:
+        return {"wav_file": path.abspath(wav_info.wav_file), "size": wav_info.size, "mtime": wav_info.mtime,
+                "params": FEATURE_PARAMS}
+
+    def load(self, wav_info: WavInfo) -> Optional[WavFeatures]:
+        """Returns the cached features of a wav, or None if they are missing or stale.
+
+        The size and mtime are compared with the header probed by read_oto, the wav is not opened."""
+        np = import_numpy()
+        if np is None:
+            return None
+
+        entry_file = self._get_entry_file(wav_info.wav_file)
+        try:
+            with open(entry_file + ".json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["key"] != self._get_key(wav_info):
+                return None
+
+            data = np.load(entry_file + ".npy", mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            return None
+        if data.shape != (len(FEATURE_ROWS), meta["frames"]):
+            return None
+
+        features = WavFeatures()
+        features.hop = meta["hop"]
+        features.frame_length = meta["frame_length"]
+        features.noise_floor = meta["noise_floor"]
+        for i, name in enumerate(FEATURE_ROWS):
+            setattr(features, name, data[i])
+
+        return features
+
+    def store(self, wav_info: WavInfo, features: WavFeatures):
+        np = import_numpy()
+        entry_file = self._get_entry_file(wav_info.wav_file)
+        meta = {
+            "key": self._get_key(wav_info),
+            "frames": len(features),
+            "hop": features.hop,
+            "frame_length": features.frame_length,
+            "noise_floor": features.noise_floor,
+        }
+
+        # The array is replaced before its json, a new array next to the old json is rejected by the frame count
+        # or by the key of the old json
+        suffix = ".%d.tmp" % os.getpid()
+        try:
+            with open(entry_file + ".npy" + suffix, "wb") as f:
+                np.save(f, np.stack([getattr(features, name) for name in FEATURE_ROWS]).astype(np.float32))
+            with open(entry_file + ".json" + suffix, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(entry_file + ".npy" + suffix, entry_file + ".npy")
+            os.replace(entry_file + ".json" + suffix, entry_file + ".json")
+        except OSError as e:
+            logger.debug(f"Could not write the features of {wav_info.wav_file}: {e}")
+            for temp_file in (entry_file + ".npy" + suffix, entry_file + ".json" + suffix):
+                if path.exists(temp_file):
+                    os.remove(temp_file)
+
+    def get(self, wav_info: WavInfo) -> WavFeatures:
+        profiler = get_profiler()
+        features = self.load(wav_info)
+        if features is not None:
+            profiler.count("feature_cache_hits")
+            return features
+
+        profiler.count("feature_cache_misses")
+        features = compute_wav_features(load_wav(wav_info.wav_file))
+        self.store(wav_info, features)
+        return features
+
+    def prune(self, dry_run: bool = False) -> tuple[int, int]:
+        """Removes the entries of wavs which no longer exist or changed, and entries of other feature parameters.
+
+        Returns the number of removed and kept entries."""
+        removed = 0
+        kept = 0
+        entry_names: set[str] = set()
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".json") or file_name.endswith(".npy"):
+                entry_names.add(path.splitext(file_name)[0])
+            elif file_name.endswith(".tmp") and not dry_run:
+                os.remove(path.join(self.cache_dir, file_name))  # Left by an interrupted run
+
+        for entry_name in sorted(entry_names):
+            entry_file = path.join(self.cache_dir, entry_name)
+            try:
+                with open(entry_file + ".json", "r", encoding="utf-8") as f:
+                    key = json.load(f)["key"]
+                stat = os.stat(key["wav_file"])
+                is_valid = (stat.st_size == key["size"] and stat.st_mtime == key["mtime"] and key["params"] == FEATURE_PARAMS
+                            and path.exists(entry_file + ".npy"))
+            except (OSError, ValueError, KeyError):
+                is_valid = False
+
+            if is_valid:
+                kept += 1
+                continue
+
+            removed += 1
+            if not dry_run:
+                for extension in (".npy", ".json"):
+                    if path.exists(entry_file + extension):
+                        os.remove(entry_file + extension)
+
+        return removed, kept
+
+
+_feature_cache: Optional[FeatureCache] = None
+
+
+def get_feature_cache() -> Optional[FeatureCache]:
+    return _feature_cache
+
+
+def set_feature_cache(feature_cache: Optional[FeatureCache]):
+    global _feature_cache
+    _feature_cache = feature_cache
+
+
+def get_wav_features(wav_info: WavInfo) -> WavFeatures:
+    """Returns the features of a source wav, from the feature cache if one is set."""
+    if _feature_cache is None:
+        return compute_wav_features(load_wav(wav_info.wav_file))
+    return _feature_cache.get(wav_info)
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(description="Manage the feature cache written by oto2seg.py --feature-cache.")
+
+    arg_parser.add_argument("command", help="prune: remove the entries of wav files which were deleted or changed",
+                            choices=["prune"])
+    arg_parser.add_argument("cache_dir", help="feature cache dir")
+    arg_parser.add_argument("--dry-run", help="only count the entries which would be removed", default=False, action="store_true")
+
+    args = arg_parser.parse_args()
+
+    if not path.isdir(args.cache_dir):
+        arg_parser.error(f"{args.cache_dir} is not a dir")
+
+    removed, kept = FeatureCache(args.cache_dir).prune(args.dry_run)
+    logger.info("%d entries %s, %d entries kept." % (removed, "to remove" if args.dry_run else "removed", kept))
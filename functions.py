@@ -1,16 +1,36 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import errno
 import json
 import logging
+import os
+import pickle
 import re
+import shutil
+import sys
 from os import path
+from stat import S_ISREG
+import threading
 import traceback
-from typing import Optional, TypedDict
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, TypedDict, TypeVar
 from wave import open as open_wave
 
 from phoneme import *
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+FICLONE = 0x40049409  # Linux reflink ioctl
+# Errors of FICLONE meaning the file system or platform cannot make reflinks
+REFLINK_UNSUPPORTED_ERRORS = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV}
+_reflink_supported = fcntl is not None
+
+TOOL_VERSION = "1.2.0"
+
 class WarningException(Exception):
     pass
 
@@ -45,8 +65,24 @@ ch.setFormatter(LoggerFormatter())
 logger.addHandler(ch)
 
 
+class WavInfo:
+    wav_file: str
+    size: int
+    mtime: float
+    nchannels: int
+    sampwidth: int
+    framerate: int
+    nframes: int
+    length: float  # ms
+
+
 class OtoInfo:
+    __slots__ = ("line", "index", "wav_file", "wav_info", "alias", "offset", "consonant", "cutoff", "preutterance", "overlap")
+
+    line: str
+    index: int  # Line number in the oto.ini file, from 0
     wav_file: str
+    wav_info: WavInfo
     alias: str
     offset: float
     consonant: float
@@ -63,11 +99,36 @@ class JPhonemeMapItem(TypedDict):
 
 
 class OtoEntryPhonemeInfo:
+    __slots__ = ("type", "phoneme_group", "phoneme_list", "is_alternative", "_frozen")
+
     type: str
     phoneme_group: list[list[str]]
     phoneme_list: list[str]
     is_alternative: bool
 
+    _frozen: bool
+
+    def __init__(self) -> None:
+        object.__setattr__(self, "_frozen", False)
+        self.is_alternative = False
+
+    def freeze(self) -> OtoEntryPhonemeInfo:
+        """Makes the phoneme lists immutable and interns the names, so a cached result cannot be changed by its users."""
+        self.phoneme_group = tuple(tuple(sys.intern(phoneme) for phoneme in group) for group in self.phoneme_group)
+        self.phoneme_list = tuple(sys.intern(phoneme) for phoneme in self.phoneme_list)
+        self._frozen = True
+        return self
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise AttributeError(f"{type(self).__name__} is frozen")
+        super().__setattr__(name, value)
+
+    def __setstate__(self, state):
+        # Unpickling must not go through the frozen __setattr__
+        for name, value in state[1].items():
+            object.__setattr__(self, name, value)
+
 
 class SmartFormatter(argparse.HelpFormatter):
     def _split_lines(self, text, width):
@@ -77,12 +138,113 @@ class SmartFormatter(argparse.HelpFormatter):
         return argparse.HelpFormatter._split_lines(self, text, width)
 
 
+WAV_PROBE_WORKERS = 8
+
+_wav_info_cache: dict[tuple[str, int], WavInfo] = {}
+_wav_info_cache_lock = threading.Lock()
+
+
+def probe_wav(wav_file: str) -> Optional[WavInfo]:
+    """Reads the header of a wav file, returns None if the file does not exist.
+
+    Headers are cached by path and mtime, so each file is only opened once."""
+    try:
+        stat = os.stat(wav_file)
+    except OSError:
+        return None
+    if not S_ISREG(stat.st_mode):
+        return None
+
+    cache_key = (wav_file, stat.st_mtime_ns)
+    with _wav_info_cache_lock:
+        wav_info = _wav_info_cache.get(cache_key)
+    if wav_info is not None:
+        return wav_info
+
+    with open_wave(wav_file, "rb") as wav:
+        wav_params = wav.getparams()
+
+    wav_info = WavInfo()
+    wav_info.wav_file = wav_file
+    wav_info.size = stat.st_size
+    wav_info.mtime = stat.st_mtime
+    wav_info.nchannels = wav_params.nchannels
+    wav_info.sampwidth = wav_params.sampwidth
+    wav_info.framerate = wav_params.framerate
+    wav_info.nframes = wav_params.nframes
+    wav_info.length = wav_params.nframes / wav_params.framerate * 1000
+
+    with _wav_info_cache_lock:
+        _wav_info_cache[cache_key] = wav_info
+
+    return wav_info
+
+
+def probe_wav_files(wav_files: list[str], max_workers: int = WAV_PROBE_WORKERS) -> dict[str, WavInfo | Exception | None]:
+    """Probes the headers of distinct wav files concurrently.
+
+    The result holds the exception instead of the header if a file could not be read."""
+    wav_files = list(dict.fromkeys(wav_files))
+    result: dict[str, WavInfo | Exception | None] = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(wav_files)))) as executor:
+        futures = {wav_file: executor.submit(probe_wav, wav_file) for wav_file in wav_files}
+        for wav_file, future in futures.items():
+            exception = future.exception()
+            result[wav_file] = exception if exception is not None else future.result()
+
+    return result
+
+
+def parse_oto_params(line: str, line_index: int, wav_file_resolved: str, wav_info: WavInfo, oto_params: str) -> Optional[OtoInfo]:
+    """Parses the parameters of an oto line, returns None if they are invalid."""
+    wav_length = wav_info.length
+
+    alias, offset, consonant, cutoff, preutterance, overlap = oto_params.split(
+        ","
+    )
+
+    try:
+        offset = float(offset)
+        consonant = float(consonant)
+        cutoff = float(cutoff)
+        preutterance = float(preutterance)
+        overlap = float(overlap)
+    except ValueError:
+        logger.warning(f"Invalid oto parameters for {wav_file_resolved}, skip this line.")
+        return None
+    # Make all of the values absolute
+    consonant = max(offset + consonant, 0)
+    preutterance = max(offset + preutterance, 0)
+    overlap = max(offset + overlap, 0)
+
+    if cutoff > 0:
+        cutoff = max(consonant + 0.1, wav_length - offset)
+    else:
+        cutoff = min(wav_length, offset + (-1 * cutoff))
+
+    oto_info = OtoInfo()
+    oto_info.line = line
+    oto_info.index = line_index
+    oto_info.wav_file = wav_file_resolved
+    oto_info.wav_info = wav_info
+    oto_info.alias = alias
+    oto_info.offset = offset
+    oto_info.consonant = consonant
+    oto_info.cutoff = cutoff
+    oto_info.preutterance = preutterance
+    oto_info.overlap = overlap
+
+    return oto_info
+
+
 def read_oto(oto_file: str, encoding: str = "shift-jis") -> dict[str, list[OtoInfo]]:
     """Reads an oto.ini file and returns a dictionary of lists of OtoInfo objects."""
     oto_dict: dict[str, list[OtoInfo]] = {}
     oto_path = path.dirname(oto_file)
+    oto_lines: list[tuple[str, int, str, str, str]] = []
     with open(oto_file, "r", encoding=encoding) as f:
-        for line in f:
+        for line_index, line in enumerate(f):
             try:
                 line = line.strip()
                 if line == "" or line.startswith("#") or line.startswith(";"):
@@ -94,52 +256,31 @@ def read_oto(oto_file: str, encoding: str = "shift-jis") -> dict[str, list[OtoIn
                     oto_dict[wav_file] = []
 
                 wav_file_resolved = path.join(oto_path, wav_file)
-                if not path.isfile(wav_file_resolved):
-                    logger.warning(f"Could not find wav file {wav_file_resolved}, skip this line.")
-                    
-                    continue
-
-                with open_wave(wav_file_resolved, "rb") as wav:
-                    wav_params = wav.getparams()
-                    wav_length = wav_params.nframes / wav_params.framerate * 1000
-
-                alias, offset, consonant, cutoff, preutterance, overlap = oto_params.split(
-                    ","
-                )
-
-                try:
-                    offset = float(offset)
-                    consonant = float(consonant)
-                    cutoff = float(cutoff)
-                    preutterance = float(preutterance)
-                    overlap = float(overlap)
-                except ValueError:
-                    logger.warning(f"Invalid oto parameters for {wav_file}, skip this line.")
-                    continue
-                # Make all of the values absolute
-                consonant = max(offset + consonant, 0)
-                preutterance = max(offset + preutterance, 0)
-                overlap = max(offset + overlap, 0)
-
-                if cutoff > 0:
-                    cutoff = max(consonant + 0.1, wav_length - offset)
-                else:
-                    cutoff = min(wav_length, offset + (-1 * cutoff))
-
-                oto_info = OtoInfo()
-                oto_info.wav_file = wav_file_resolved
-                oto_info.alias = alias
-                oto_info.offset = offset
-                oto_info.consonant = consonant
-                oto_info.cutoff = cutoff
-                oto_info.preutterance = preutterance
-                oto_info.overlap = overlap
-
-                oto_dict[wav_file].append(oto_info)
+                oto_lines.append((line, line_index, wav_file, wav_file_resolved, oto_params))
             except Exception as e:
                 logger.warning(f"Failed to parse line {line}: {e}")
                 traceback.print_exc()
 
+    # Each wav file usually has many aliases, read every header only once
+    wav_info_map = probe_wav_files([item[3] for item in oto_lines])
+
+    for line, line_index, wav_file, wav_file_resolved, oto_params in oto_lines:
+        try:
+            wav_info = wav_info_map[wav_file_resolved]
+            if wav_info is None:
+                logger.warning(f"Could not find wav file {wav_file_resolved}, skip this line.")
+
+                continue
+            elif isinstance(wav_info, Exception):
+                raise wav_info
+
+            oto_info = parse_oto_params(line, line_index, wav_file_resolved, wav_info, oto_params)
+            if oto_info is not None:
+                oto_dict[wav_file].append(oto_info)
+        except Exception as e:
+            logger.warning(f"Failed to parse line {line}: {e}")
+            traceback.print_exc()
+
     # Sort the oto list by preutterance
     for oto_list in oto_dict.values():
         oto_list.sort(key=lambda x: x.preutterance)
@@ -147,6 +288,158 @@ def read_oto(oto_file: str, encoding: str = "shift-jis") -> dict[str, list[OtoIn
     return oto_dict
 
 
+def _read_oto_group(wav_file_resolved: str, group_lines: list[tuple[str, int, str]]) -> list[OtoInfo]:
+    oto_list: list[OtoInfo] = []
+    try:
+        wav_info = probe_wav(wav_file_resolved)
+    except Exception as e:
+        logger.warning(f"Failed to read {wav_file_resolved}: {e}")
+        traceback.print_exc()
+        return oto_list
+
+    if wav_info is None:
+        logger.warning(f"Could not find wav file {wav_file_resolved}, skip {len(group_lines)} lines.")
+        return oto_list
+
+    for line, line_index, oto_params in group_lines:
+        try:
+            oto_info = parse_oto_params(line, line_index, wav_file_resolved, wav_info, oto_params)
+            if oto_info is not None:
+                oto_list.append(oto_info)
+        except Exception as e:
+            logger.warning(f"Failed to parse line {line}: {e}")
+            traceback.print_exc()
+
+    oto_list.sort(key=lambda x: x.preutterance)
+    return oto_list
+
+
+def iter_oto_groups(oto_file: str, encoding: str = "shift-jis") -> Iterator[list[OtoInfo]]:
+    """Reads an oto.ini file and yields the sorted OtoInfo list of each wav file as soon as its lines are read.
+
+    The lines of a wav file are expected to be consecutive, a wav file which appears again later is yielded as another group."""
+    oto_path = path.dirname(oto_file)
+    seen_wav_files: set[str] = set()
+    group_wav_file: Optional[str] = None
+    group_lines: list[tuple[str, int, str]] = []
+
+    with open(oto_file, "r", encoding=encoding) as f:
+        for line_index, line in enumerate(f):
+            line = line.strip()
+            if line == "" or line.startswith("#") or line.startswith(";"):
+                continue
+
+            try:
+                wav_file, oto_params = line.split("=")
+            except Exception as e:
+                logger.warning(f"Failed to parse line {line}: {e}")
+                continue
+
+            if wav_file != group_wav_file:
+                if len(group_lines) > 0:
+                    oto_list = _read_oto_group(path.join(oto_path, group_wav_file), group_lines)
+                    if len(oto_list) > 0:
+                        yield oto_list
+
+                if wav_file in seen_wav_files:
+                    logger.warning(f"Lines of {wav_file} are not consecutive, they are processed as another group.")
+                seen_wav_files.add(wav_file)
+                group_wav_file = wav_file
+                group_lines = []
+
+            group_lines.append((line, line_index, oto_params))
+
+    if len(group_lines) > 0:
+        oto_list = _read_oto_group(path.join(oto_path, group_wav_file), group_lines)
+        if len(oto_list) > 0:
+            yield oto_list
+
+
+def link_or_copy_file(src_file: str, dst_file: str) -> str:
+    """Makes dst_file a reflink of src_file where the file system allows it, then tries a hardlink,
+    and copies the file otherwise. Returns the method used."""
+    global _reflink_supported
+
+    if path.lexists(dst_file):
+        os.remove(dst_file)
+
+    if _reflink_supported:
+        try:
+            with open(src_file, "rb") as src, open(dst_file, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return "reflink"
+        except OSError as e:
+            if path.lexists(dst_file):
+                os.remove(dst_file)
+            if e.errno not in REFLINK_UNSUPPORTED_ERRORS:
+                raise
+            _reflink_supported = False  # Not supported by this file system, do not try again
+
+    try:
+        os.link(src_file, dst_file)
+        return "hardlink"
+    except OSError:
+        shutil.copyfile(src_file, dst_file)
+        return "copy"
+
+
+_numpy = False  # Not imported yet
+
+
+def import_numpy():
+    """Imports NumPy on first use, returns None if it is not installed.
+
+    The import takes longer than the rest of the startup, --help and planning do not need it."""
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy = numpy
+    return _numpy
+
+
+LANGUAGE_PACK_VERSION = 1
+
+_T = TypeVar("_T")
+
+
+def load_language_pack(pack_file: str, source_files: list[str], build: Callable[[], _T]) -> _T:
+    """Returns the tables built by build, cached as a pickle in pack_file.
+
+    The pack is built again when the pack version, the tool version, the Python version or
+    the size or mtime of a source file changes. It is only a cache, if it cannot be written
+    the tables are built on every start."""
+    source_key = []
+    for source_file in source_files + [__file__]:
+        stat = os.stat(source_file)
+        source_key.append((path.basename(source_file), stat.st_size, stat.st_mtime_ns))
+    pack_key = (LANGUAGE_PACK_VERSION, TOOL_VERSION, sys.version_info[:2], tuple(source_key))
+
+    try:
+        with open(pack_file, "rb") as f:
+            if pickle.load(f) == pack_key:
+                return pickle.load(f)
+    except Exception:  # Missing, outdated or broken, build it again
+        pass
+
+    tables = build()
+
+    temp_file = "%s.%d.tmp" % (pack_file, os.getpid())
+    try:
+        with open(temp_file, "wb") as f:
+            pickle.dump(pack_key, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(tables, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, pack_file)
+    except OSError as e:
+        logger.debug(f"Could not write language pack {pack_file}: {e}")
+        if path.exists(temp_file):
+            os.remove(temp_file)
+
+    return tables
+
+
 def escape_xsampa(xsampa: str) -> str:
     """Escapes xsampa to file name."""
     xsampa = xsampa.replace("Sil", "sil")  # Sil is a special case
@@ -176,53 +469,56 @@ def unescape_xsampa(xsampa: str) -> str:
     return xsampa
 
 
-class ArticulationSegmentInfo(TypedDict):
+class PhonemeSpan(NamedTuple):
+    name: str
+    start: float  # ms
+    end: float
+
+
+class ArticulationSegmentInfo(NamedTuple):
     type: str
-    phonemes: list[str, str]
-    boundaries: list[list[str, float, float]]
+    phonemes: tuple[str, ...]
+    boundaries: tuple[int, ...]  # Frames of the source wav, or of the segment wav when rendered
 
 
 class SegmentInfo:
+    """A planned segment, it is not modified after planning so derived segments can share its spans."""
+    __slots__ = ("source_line", "wav_offset", "wav_cutoff", "auto_item", "phoneme_list", "art_seg")
+
+    source_line: str
     wav_offset: float
     wav_cutoff: float
     auto_item: bool
-    phoneme_list: list[list[str, float]]
+    phoneme_list: tuple[PhonemeSpan, ...]
     art_seg: ArticulationSegmentInfo
 
-    def copy(self):
-        new_seg_info = SegmentInfo()
-        new_seg_info.wav_offset = self.wav_offset
-        new_seg_info.wav_cutoff = self.wav_cutoff
-        new_seg_info.auto_item = self.auto_item
-        new_seg_info.phoneme_list = [phoneme.copy() for phoneme in self.phoneme_list]
-        new_seg_info.art_seg = {
-            "type": self.art_seg["type"],
-            "phonemes": self.art_seg["phonemes"].copy(),
-            "boundaries": self.art_seg["boundaries"].copy(),
-        }
-
-        return new_seg_info
-
-    def set_phonemes(self, new_phonemes: list[str]):
+    def __init__(self, source_line: str, wav_offset: float, wav_cutoff: float, auto_item: bool,
+                 phoneme_list: tuple[PhonemeSpan, ...], art_seg: ArticulationSegmentInfo) -> None:
+        self.source_line = source_line
+        self.wav_offset = wav_offset
+        self.wav_cutoff = wav_cutoff
+        self.auto_item = auto_item
+        self.phoneme_list = phoneme_list
+        self.art_seg = art_seg
+
+    def set_phonemes(self, new_phonemes: list[str]) -> SegmentInfo:
+        """Returns a segment with the same timing and other phoneme names."""
         if len(new_phonemes) != len(self.phoneme_list):
             raise ValueError("Phoneme list length mismatch.")
 
-        new_seg_info = self.copy()
-
-        new_seg_info.art_seg["phonemes"] = new_phonemes.copy()
-
-        for i in range(0, len(new_seg_info.phoneme_list)):
-            new_seg_info.phoneme_list[i][0] = new_phonemes[i]
+        new_phonemes = tuple(sys.intern(phoneme) for phoneme in new_phonemes)
+        phoneme_list = tuple(span._replace(name=phoneme) for span, phoneme in zip(self.phoneme_list, new_phonemes))
 
-        return new_seg_info
+        return SegmentInfo(self.source_line, self.wav_offset, self.wav_cutoff, self.auto_item, phoneme_list,
+                           self.art_seg._replace(phonemes=new_phonemes))
 
 
 def generate_articulation_seg_file(
-    phoneme_list: list[list], cutoff_pos: int, wav_length: int
+    phoneme_list: list[PhonemeSpan], cutoff_pos: int, wav_length: int, stationary: bool = False
 ) -> str:
     content = [
         "nPhonemes %d" % (len(phoneme_list) + 2,),  # Add 2 Sil
-        "articulationsAreStationaries = 0",
+        "articulationsAreStationaries = %d" % stationary,
         "phoneme		BeginTime		EndTime",
         "===================================================",
     ]
@@ -245,7 +541,7 @@ def generate_articulation_seg_file(
     return "\n".join(content) + "\n"
 
 
-def generate_articulation_trans_file(seg_info: list[list]) -> str:
+def generate_articulation_trans_file(seg_info: list[PhonemeSpan]) -> str:
     content = []
 
     phoneme_list = []
@@ -261,34 +557,30 @@ def generate_articulation_trans_file(seg_info: list[list]) -> str:
 
 
 def generate_articulation_as_files(
-    art_seg_list: list[ArticulationSegmentInfo], wav_samples: int
+    art_seg_list: list[ArticulationSegmentInfo], wav_samples: int, sample_rate: int, lang_tool: BaseLanguageTool
 ) -> str:
     as_content_list = []
     for art_seg_info in art_seg_list:
         content = [
             "nphone art segmentation",
             "{",
-            '\tphns: ["' + ('", "'.join(art_seg_info["phonemes"])) + '"];',
+            '\tphns: ["' + ('", "'.join(art_seg_info.phonemes)) + '"];',
             "\tcut offset: 0;",
             "\tcut length: %d;" % wav_samples,
         ]
 
         boundaries_str = [
-            ("%.9f" % (item / 1000)) for item in art_seg_info["boundaries"]
+            ("%.9f" % (item / sample_rate)) for item in art_seg_info.boundaries
         ]
         content.append("\tboundaries: [" + ", ".join(boundaries_str) + "];")
 
         content.append("\trevised: false;")
 
         voiced_str = []
-        is_triphoneme = len(art_seg_info["phonemes"]) == 3
-        for i in range(0, len(art_seg_info["phonemes"])):
-            phoneme = art_seg_info["phonemes"][i]
-            is_unvoiced = phoneme in unvoiced_consonant_list or phoneme in [
-                "Sil",
-                "Asp",
-                "?",
-            ]
+        is_triphoneme = len(art_seg_info.phonemes) == 3
+        for i in range(0, len(art_seg_info.phonemes)):
+            phoneme = art_seg_info.phonemes[i]
+            is_unvoiced = phoneme in unvoiced_marker_set or lang_tool.is_unvoiced_consonant(phoneme)
             voiced_str.append(str(not is_unvoiced).lower())
             if is_triphoneme and i == 1:  # Triphoneme needs 2 flags for center phoneme
                 voiced_str.append(str(not is_unvoiced).lower())
@@ -303,6 +595,14 @@ def generate_articulation_as_files(
     return as_content_list
 
 
+# Phoneme class flags
+PHONEME_VOWEL = 1
+PHONEME_CONSONANT = 2
+PHONEME_SYLLABIC = 4
+PHONEME_PLOSIVE = 8
+PHONEME_UNVOICED = 16
+
+
 class BaseLanguageTool(ABC):
     def __init__(self) -> None:
         self.vowel_list: list[str] = []
@@ -321,46 +621,130 @@ class BaseLanguageTool(ABC):
 
         self.cvvc_list: list[str] = []
 
-    def is_vowel(self, phoneme: str, use_xsampa: bool) -> bool:
+        self.freeze_inventory()
+
+    def freeze_inventory(self):
+        """Builds the phoneme flag tables and the articulation ids from the inventory lists.
+
+        Must be called again by subclasses after the lists are filled."""
+        self.phoneme_flags: dict[str, int] = {}
+        self.alias_phoneme_flags: dict[str, int] = {}
+
+        def set_flag(flag_table: dict[str, int], phoneme_list: list[str], flag: int):
+            for phoneme in phoneme_list:
+                phoneme = sys.intern(phoneme)
+                flag_table[phoneme] = flag_table.get(phoneme, 0) | flag
+
+        set_flag(self.phoneme_flags, self.vowel_list, PHONEME_VOWEL)
+        set_flag(self.phoneme_flags, self.consonant_list, PHONEME_CONSONANT)
+        set_flag(self.phoneme_flags, self.syllabic_consonant_list, PHONEME_SYLLABIC)
+        set_flag(self.phoneme_flags, self.plosive_consonant_list, PHONEME_PLOSIVE)
+        set_flag(self.phoneme_flags, self.unvoiced_consonant_list, PHONEME_UNVOICED)
+
+        set_flag(self.alias_phoneme_flags, self.alias_vowel_list, PHONEME_VOWEL)
+        set_flag(self.alias_phoneme_flags, self.alias_consonant_list, PHONEME_CONSONANT)
+        set_flag(self.alias_phoneme_flags, self.alias_syllabic_consonant_list, PHONEME_SYLLABIC)
+
+        # Each articulation of the inventory has an id, coverage is a bitset of these ids
+        self.cvvc_list = [sys.intern(articulation) for articulation in self.cvvc_list]
+        self.cvvc_index: dict[str, int] = {articulation: i for i, articulation in enumerate(self.cvvc_list)}
+        self.cvvc_mask = (1 << len(self.cvvc_list)) - 1
+
+        # Variant graph: each phoneme followed by its variants, in the order of the variant lists
+        def get_variants(variant_list: list[list[str]]) -> dict[str, tuple[str, ...]]:
+            variants: dict[str, list[str]] = {}
+            for group in variant_list:
+                for phoneme in group:
+                    phoneme_variants = variants.setdefault(phoneme, [phoneme])
+                    for item in group:
+                        if item not in phoneme_variants:
+                            phoneme_variants.append(item)
+            return {phoneme: tuple(items) for phoneme, items in variants.items()}
+
+        self.consonant_variants = get_variants(self.consonant_variant_list)
+        self.vowel_variants = get_variants(self.vowel_variant_list)
+
+        # Substitute candidates of every articulation which can be missing
+        self.alternative_graph: dict[str, tuple[str, ...]] = {
+            articulation: tuple(self.get_alternative_candidates(articulation)) for articulation in self.cvvc_list
+        }
+
+    def get_phoneme_flags(self, phoneme: str, use_xsampa: bool = True) -> int:
         if use_xsampa:
-            return phoneme in self.vowel_list
+            return self.phoneme_flags.get(phoneme, 0)
         else:
-            return phoneme in self.alias_vowel_list
+            return self.alias_phoneme_flags.get(phoneme, 0)
+
+    def is_vowel(self, phoneme: str, use_xsampa: bool) -> bool:
+        return (self.get_phoneme_flags(phoneme, use_xsampa) & PHONEME_VOWEL) != 0
 
     def is_syllabic_consonant(self, phoneme: str, use_xsampa: bool) -> bool:
-        if use_xsampa:
-            return phoneme in self.syllabic_consonant_list
-        else:
-            return phoneme in self.alias_syllabic_consonant_list
+        return (self.get_phoneme_flags(phoneme, use_xsampa) & PHONEME_SYLLABIC) != 0
 
     def is_consonant(self, phoneme: str, use_xsampa: bool) -> bool:
         if use_xsampa:
-            return phoneme in self.consonant_list
+            return (self.phoneme_flags.get(phoneme, 0) & PHONEME_CONSONANT) != 0
         else:
             return False  # TODO: Implement this
 
     def is_plosive_consonant(self, phoneme: str) -> bool:
-        return phoneme in self.plosive_consonant_list
+        return (self.phoneme_flags.get(phoneme, 0) & PHONEME_PLOSIVE) != 0
 
-    def get_missing_list(self, phoneme_list: list[str]) -> list[str]:
-        missing_list = []
+    def is_unvoiced_consonant(self, phoneme: str) -> bool:
+        return (self.phoneme_flags.get(phoneme, 0) & PHONEME_UNVOICED) != 0
+
+    def get_coverage(self, phoneme_list: Iterable[str]) -> int:
+        """Returns the bitset of the inventory articulations in phoneme_list."""
+        coverage = 0
+        for phoneme in phoneme_list:
+            articulation_id = self.cvvc_index.get(phoneme)
+            if articulation_id is not None:
+                coverage |= 1 << articulation_id
 
-        for phoneme in self.cvvc_list:
-            if phoneme not in phoneme_list:
-                missing_list.append(phoneme)
+        return coverage
+
+    def get_missing_list(self, phoneme_list: Iterable[str]) -> list[str]:
+        missing = self.cvvc_mask & ~self.get_coverage(phoneme_list)
+
+        missing_list = []
+        while missing:
+            articulation_id = (missing & -missing).bit_length() - 1
+            missing_list.append(self.cvvc_list[articulation_id])
+            missing &= missing - 1
 
         return missing_list
     
     def get_consonant_center_pos(self, consonant: str, consonant_length: int):
-        if consonant in self.plosive_consonant_list:
+        if self.is_plosive_consonant(consonant):
             return 20
         else:
             return consonant_length / 2
 
-    @abstractmethod
+    def get_cache_stats(self) -> dict[str, dict[str, float]]:
+        """Returns the size, hits, misses and hit rate of each cache of the tool."""
+        return {}
+
     def get_alternative_phoneme(
-        self, articulation: str, phoneme_list: list[str]
+        self, articulation: str, phoneme_list: Iterable[str]
     ) -> Optional[str]:
+        """Returns the first substitute of articulation which is in phoneme_list."""
+        candidates = self.alternative_graph.get(articulation)
+        if candidates is None:
+            candidates = self.get_alternative_candidates(articulation)
+
+        for candidate in candidates:
+            if candidate in phoneme_list:
+                return candidate
+
+        return None
+
+    def resolve_alternatives(self, missing_list: list[str], phoneme_list: Iterable[str]) -> dict[str, Optional[str]]:
+        """Resolves the substitute of every missing articulation in one pass."""
+        return {missing: self.get_alternative_phoneme(missing, phoneme_list) for missing in missing_list}
+
+    @abstractmethod
+    def get_alternative_candidates(self, articulation: str) -> list[str]:
+        """Returns the substitutes of an articulation, in order of preference."""
         raise NotImplementedError()
 
     @abstractmethod
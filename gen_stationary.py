@@ -1,3 +1,11 @@
+from __future__ import annotations
+from typing import Optional, TypedDict
+
+from functions import BaseLanguageTool, OtoInfo, SegmentInfo, import_numpy
+from profiler import get_profiler
+from refine import F0_MIN, FEATURE_PARAMS, WavFeatures
+
+# Stationary phoneme -> recorded sound it is cut from, the nasals share the recordings of ん
 vowel_map = {
     "a": "a",
     "i": "i",
@@ -10,4 +18,127 @@ vowel_map = {
     "m": "n",
     "n": "n",
     "J": "n"
-}
\ No newline at end of file
+}
+
+STATIONARY_TYPE = "stationary"
+STATIONARY_SOURCE_TYPES = ("cv", "vv", "rv")  # Segments whose last span is a sustained vowel or syllabic nasal
+STATIONARY_LENGTH = 150  # ms, length of the cut steady region
+
+# Instability which costs one point of the score
+ENERGY_TOLERANCE = 1.5  # dB standard deviation
+PITCH_TOLERANCE = 0.3  # Semitones standard deviation
+VOICING_TOLERANCE = 0.1  # Mean of 1 - autocorrelation peak
+STATIONARY_VERSION = 2  # Increase when the regions are scored differently
+# Stored with the regions in the build manifest, the wavs are analyzed again when any of them changes
+STATIONARY_PARAMS = {"version": STATIONARY_VERSION, "length": STATIONARY_LENGTH, "energy_tolerance": ENERGY_TOLERANCE,
+                     "pitch_tolerance": PITCH_TOLERANCE, "voicing_tolerance": VOICING_TOLERANCE, "features": FEATURE_PARAMS}
+
+
+class StationaryCandidate(TypedDict):
+    sound: str  # Value of vowel_map
+    source_line: str
+    start: float  # ms, stretchable region of the oto entry
+    end: float
+
+
+class StationaryRegion(TypedDict):
+    sound: str
+    wav_file: str
+    source_line: str
+    start: float  # ms, steadiest STATIONARY_LENGTH of the candidate
+    end: float
+    score: float  # Lower is steadier
+
+
+def get_stationary_candidates(oto_list: list[OtoInfo], seg_info_list: list[SegmentInfo]) -> list[StationaryCandidate]:
+    """Returns the stretchable regions (fixed end to cutoff) of the C-V, V-V and R-V entries of a wav
+    which are long enough to cut a stationary from."""
+    oto_map = {oto_item.line: oto_item for oto_item in oto_list}
+    candidates: list[StationaryCandidate] = []
+    for seg_info in seg_info_list:
+        if seg_info.art_seg.type not in STATIONARY_SOURCE_TYPES:
+            continue
+
+        span = seg_info.phoneme_list[-1]
+        sound = vowel_map.get(span.name)
+        oto_item = oto_map.get(seg_info.source_line)
+        if sound is None or oto_item is None:
+            continue
+
+        start = max(span.start, oto_item.consonant)
+        if oto_item.cutoff - start >= STATIONARY_LENGTH:
+            candidates.append({"sound": sound, "source_line": seg_info.source_line, "start": start, "end": oto_item.cutoff})
+
+    return candidates
+
+
+def get_stationary_phonemes(lang_tool: BaseLanguageTool) -> list[str]:
+    """Returns the phonemes of vowel_map which the language tool knows."""
+    return [phoneme for phoneme in vowel_map
+            if lang_tool.is_vowel(phoneme, True) or lang_tool.is_syllabic_consonant(phoneme, True)]
+
+
+def _get_window_std(values: "np.ndarray", window: int) -> "np.ndarray":
+    """Standard deviation of every run of window values, from prefix sums."""
+    np = import_numpy()
+    values = values.astype(np.float64)
+    value_sum = np.concatenate([[0], np.cumsum(values)])
+    square_sum = np.concatenate([[0], np.cumsum(values * values)])
+    mean = (value_sum[window:] - value_sum[:-window]) / window
+    return np.sqrt(np.maximum((square_sum[window:] - square_sum[:-window]) / window - mean * mean, 0))
+
+
+def find_steady_regions(features: WavFeatures, wav_file: str, candidates: list[StationaryCandidate]) -> list[StationaryRegion]:
+    """Finds the STATIONARY_LENGTH of each candidate with the most stable energy and F0 and the strongest voicing,
+    from the frame features of the wav."""
+    np = import_numpy()
+    regions: list[StationaryRegion] = []
+    if np is None:
+        return regions
+
+    window = int(STATIONARY_LENGTH / features.hop)  # Frames centered inside the stationary
+    # Frames without F0 count as the lowest pitch, a steady region has none of them
+    pitch = 12 * np.log2(np.maximum(features.f0, F0_MIN))
+    for candidate in candidates:
+        first = max(int(np.ceil((candidate["start"] + features.hop / 2 - features.frame_length / 2) / features.hop)), 0)
+        last = min(int((candidate["end"] - features.hop / 2 - features.frame_length / 2) / features.hop) + 1, len(features))
+        if window < 2 or last - first < window:
+            continue
+
+        voicing_loss = 1 - (np.convolve(features.voicing[first:last], np.ones(window), "valid") / window)
+        score = (_get_window_std(features.energy[first:last], window) / ENERGY_TOLERANCE
+                 + _get_window_std(pitch[first:last], window) / PITCH_TOLERANCE + voicing_loss / VOICING_TOLERANCE)
+        best = int(np.argmin(score))
+
+        start = min(max(features.get_time(first + best) - features.hop / 2, candidate["start"]),
+                    candidate["end"] - STATIONARY_LENGTH)
+        regions.append({
+            "sound": candidate["sound"],
+            "wav_file": wav_file,
+            "source_line": candidate["source_line"],
+            "start": start,
+            "end": start + STATIONARY_LENGTH,
+            "score": float(score[best]),
+        })
+
+    get_profiler().count("stationary_candidates", len(regions))
+    return regions
+
+
+class StationarySelector:
+    """Keeps the steadiest region of each recorded sound, independent of the order the wav files are analyzed in."""
+
+    def __init__(self) -> None:
+        self.best: dict[str, StationaryRegion] = {}
+
+    def add(self, regions: list[StationaryRegion]):
+        for region in regions:
+            current = self.best.get(region["sound"])
+            if current is None or (region["score"], region["wav_file"], region["start"]) < (
+                    current["score"], current["wav_file"], current["start"]):
+                self.best[region["sound"]] = region
+
+    def get_regions(self, lang_tool: BaseLanguageTool) -> list[tuple[str, StationaryRegion]]:
+        """Returns each stationary phoneme with the region it is cut from."""
+        return [(phoneme, self.best[vowel_map[phoneme]]) for phoneme in get_stationary_phonemes(lang_tool)
+                if vowel_map[phoneme] in self.best]
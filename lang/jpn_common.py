@@ -1,31 +1,62 @@
 from functions import *
 
-global hiragana_map
-with open("./data/hiragana.json", "r", encoding="utf-8") as f:
-    hiragana_map = json.load(f)
+DATA_DIR = path.join(path.dirname(path.dirname(path.abspath(__file__))), "data")
+HIRAGANA_FILE = path.join(DATA_DIR, "hiragana.json")
+LANGUAGE_PACK_FILE = path.join(DATA_DIR, "jpn_common.pack")
 
-    for item in hiragana_map:
-        item["phoneme"] = item["phoneme"].split(" ")
 
+def load_hiragana_map() -> tuple[list[JPhonemeMapItem], dict[str, JPhonemeMapItem], dict[str, JPhonemeMapItem]]:
+    """Reads the kana table, returns it with its lookup indexes by kana and by romaji."""
+    with open(HIRAGANA_FILE, "r", encoding="utf-8") as f:
+        hiragana_map = json.load(f)
 
-def get_hiragana_info(hiragana: str) -> Optional[JPhonemeMapItem]:
-    global hiragana_map
+    for item in hiragana_map:
+        item["phoneme"] = item["phoneme"].split(" ")
 
+    # Lookup indexes, the first item wins like the linear scan did
+    hiragana_index: dict[str, JPhonemeMapItem] = {}
+    romaji_index: dict[str, JPhonemeMapItem] = {}
     for item in hiragana_map:
-        if item["kana"] == hiragana:
-            return item
+        hiragana_index.setdefault(item["kana"], item)
+        romaji_index.setdefault(item["romaji"], item)
 
-    return None
+    return hiragana_map, hiragana_index, romaji_index
 
 
-def get_romaji_info(romaji: str) -> Optional[JPhonemeMapItem]:
-    global hiragana_map
+def get_hiragana_info(hiragana: str) -> Optional[JPhonemeMapItem]:
+    return hiragana_index.get(hiragana)
 
-    for item in hiragana_map:
-        if item["romaji"] == romaji:
-            return item
 
-    return None
+def get_romaji_info(romaji: str) -> Optional[JPhonemeMapItem]:
+    return romaji_index.get(romaji)
+
+
+# Alias grammar, one alternative for each alias type in the order they are tested.
+# The outer group of each alternative closes last, so match.lastgroup is the alias type.
+ALIAS_PATTERN = re.compile(
+    r"""
+    -\s*(?P<rcv_kana>[ぁ-んァ-ンヴ]+)\s*$                                        # R-C-V (kana)
+    | -(?P<rcv_romaji>.*)$                                                      # R-C-V (romaji)
+    | \s*(?P<vr>[aiueonNm])\s*-$                                               # V-R
+    | (?P<vr_invalid>.*)-$
+    | (?P<vv>(?P<vv1>[aiueoN])\ (?P<vv2>[aiueoN]|[あいうえおんアイウエオン]))$     # V-V
+    | n\ (?P<nv>[あいうえおんアイウエオン])$                                       # N-V
+    | (?P<vcv>(?P<vcv1>[aiueonN])\ (?P<vcv2>[a-zA-Z]+[aiueo]|[ぁ-んァ-ンヴ]+))$  # V-C-V
+    | (?!n\ [aiueo]$)(?P<vc>(?P<vc1>[aiueonN])\ (?P<vc2>[a-zA-Z]+))$           # V-C
+    | (?P<cv_romaji>[a-zA-Z\ ]+\ ?[aiueonN])$                                    # C-V
+    | (?P<cv_kana>[ぁ-んァ-ンヴ]+)$
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+ALTERNATE_ALIAS_PATTERN = re.compile(r"[0-9]+$")
+ROMAJI_VOWEL_PATTERN = re.compile(r"[aiueoN]")
+
+
+class AliasColumns(TypedDict):
+    alias: list[str]
+    type: list[Optional[str]]
+    phonemes: list[tuple[str, ...]]
+    error: list[Optional[str]]
 
 
 class JapaneseLanguageTool(BaseLanguageTool):
@@ -159,12 +190,17 @@ class JapaneseLanguageTool(BaseLanguageTool):
             for vowel in self.syllabic_consonant_list:
                 self.cvvc_list.append(f"{vowel} {consonant}")
 
-        # Deduplicate
-        self.cvvc_list = list(set(self.cvvc_list))
+        # Deduplicate, keeping the order stable between processes
+        self.cvvc_list = list(dict.fromkeys(self.cvvc_list))
+
+        self.freeze_inventory()
 
-    def get_alternative_phoneme(
-        self, articulation: str, phoneme_list: list[str]
-    ) -> Optional[str]:
+        # Parsed aliases, the same aliases repeat in every pitch
+        self.alias_cache: dict[str, OtoEntryPhonemeInfo | str] = {}
+        self.alias_cache_hits = 0
+        self.alias_cache_misses = 0
+
+    def get_alternative_candidates(self, articulation: str) -> list[str]:
         phonemes = articulation.split(" ")
         if (
             self.is_vowel(phonemes[0], True)
@@ -186,34 +222,17 @@ class JapaneseLanguageTool(BaseLanguageTool):
             consonant = phonemes[1]
             art_type = "vc"
         else:
-            return None
-
-        alt_consonant_list = [consonant]
-        alt_vowel_list = [vowel]
-
-        for consonant_list in self.consonant_variant_list:
-            if consonant in consonant_list:
-                for item in consonant_list:
-                    if item not in alt_consonant_list:
-                        alt_consonant_list.append(item)
+            return []
 
-        for vowel_list in self.vowel_variant_list:
-            if vowel in vowel_list:
-                for item in vowel_list:
-                    if item not in alt_vowel_list:
-                        alt_vowel_list.append(item)
-
-        for alt_consonant in alt_consonant_list:
-            for alt_vowel in alt_vowel_list:
+        candidates = []
+        for alt_consonant in self.consonant_variants.get(consonant, (consonant,)):
+            for alt_vowel in self.vowel_variants.get(vowel, (vowel,)):
                 if art_type == "vc":
-                    alt_articulation = f"{alt_vowel} {alt_consonant}"
+                    candidates.append(f"{alt_vowel} {alt_consonant}")
                 else:
-                    alt_articulation = f"{alt_consonant} {alt_vowel}"
-
-                if alt_articulation in phoneme_list:
-                    return alt_articulation
+                    candidates.append(f"{alt_consonant} {alt_vowel}")
 
-        return None
+        return candidates
 
     def get_phonemes_types(self, phonemes: list[str]) -> list[str]:
         phoneme_types: list[str] = []
@@ -241,18 +260,72 @@ class JapaneseLanguageTool(BaseLanguageTool):
         return phoneme_types
 
     def get_oto_entry_phoneme_info(self, oto_entry: OtoInfo) -> OtoEntryPhonemeInfo:
-        """Returns phoneme info from an OtoInfo object."""
-        item_alias = oto_entry.alias
+        """Returns phoneme info from an OtoInfo object.
+
+        Results are cached by alias, the returned object is frozen and shared between callers."""
+        return self.get_alias_phoneme_info(oto_entry.alias)
+
+    def get_cache_stats(self) -> dict[str, dict[str, float]]:
+        lookups = self.alias_cache_hits + self.alias_cache_misses
+        return {
+            "alias": {
+                "size": len(self.alias_cache),
+                "hits": self.alias_cache_hits,
+                "misses": self.alias_cache_misses,
+                "hit_rate": self.alias_cache_hits / lookups if lookups > 0 else 0.0,
+            }
+        }
+
+    def get_alias_phoneme_info(self, alias: str) -> OtoEntryPhonemeInfo:
+        """Same as get_oto_entry_phoneme_info, for a bare alias."""
+        cached = self.alias_cache.get(alias)
+        if cached is not None:
+            self.alias_cache_hits += 1
+            if isinstance(cached, str):  # Cached warning
+                raise WarningException(cached)
+            return cached
+
+        self.alias_cache_misses += 1
+        try:
+            ret = self.parse_alias(alias).freeze()
+        except WarningException as e:
+            self.alias_cache[alias] = str(e)
+            raise
+
+        self.alias_cache[alias] = ret
+        return ret
 
+    def classify_many(self, aliases: list[str]) -> AliasColumns:
+        """Classifies the aliases of a whole oto file, returns one column per field.
+
+        Aliases that could not be classified have None as type and the warning in error."""
+        columns: AliasColumns = {"alias": list(aliases), "type": [], "phonemes": [], "error": []}
+        for alias in aliases:
+            try:
+                info = self.get_alias_phoneme_info(alias)
+                columns["type"].append(info.type)
+                columns["phonemes"].append(info.phoneme_list)
+                columns["error"].append(None)
+            except WarningException as e:
+                columns["type"].append(None)
+                columns["phonemes"].append(())
+                columns["error"].append(str(e))
+
+        return columns
+
+    def parse_alias(self, item_alias: str) -> OtoEntryPhonemeInfo:
         ret = OtoEntryPhonemeInfo()
 
-        if re.match(r"[0-9]+$", item_alias):  # Alternate phoneme
+        if ALTERNATE_ALIAS_PATTERN.match(item_alias):  # Alternate phoneme
             ret.is_alternative = True
-            item_alias = re.sub(r"[0-9]+$", "", item_alias)
+            item_alias = ALTERNATE_ALIAS_PATTERN.sub("", item_alias)
+
+        matches = ALIAS_PATTERN.match(item_alias)
+        alias_type = matches.lastgroup if matches is not None else None
 
-        if item_alias[0] == "-":  # R-C-V?
+        if alias_type == "rcv_kana" or alias_type == "rcv_romaji":  # R-C-V?
             item_alias = item_alias[1:].strip()
-            if re.match(r"^([ぁ-んァ-ンヴ]+)$", item_alias):  # Hiragana R-C-V:
+            if alias_type == "rcv_kana":  # Hiragana R-C-V:
                 hiragana = item_alias.replace(" ", "")
 
                 phoneme_info = get_hiragana_info(hiragana)
@@ -294,9 +367,9 @@ class JapaneseLanguageTool(BaseLanguageTool):
 
                 ret.phoneme_group = [phoneme_info["phoneme"]]
                 ret.phoneme_list = phoneme_info["phoneme"]
-        elif item_alias[-1] == "-":  # V-R
+        elif alias_type == "vr" or alias_type == "vr_invalid":  # V-R
             item_alias = item_alias[:-1].strip()
-            if re.match(r"^([aiueonNm])$", item_alias):  # Romaji V-R
+            if alias_type == "vr":  # Romaji V-R
                 romaji = item_alias.replace(" ", "")
 
                 phoneme_info = get_romaji_info(romaji)
@@ -315,14 +388,13 @@ class JapaneseLanguageTool(BaseLanguageTool):
                     raise WarningException(f"[Romaji VR] Invalid phoneme info for {romaji}")
             else:
                 raise WarningException(f"[Romaji VR] Invalid phoneme info for {item_alias}")
-        elif re.match(r"^([aiueoN]) ([aiueoN]|[あいうえおんアイウエオン])$", item_alias):  # V-V
-            matches = re.match(r"^([aiueoN]) ([aiueoN]|[あいうえおんアイウエオン])$", item_alias)
-            first_vowel = matches.group(1)
-            second_vowel = matches.group(2)
+        elif alias_type == "vv":  # V-V
+            first_vowel = matches.group("vv1")
+            second_vowel = matches.group("vv2")
 
             first_vowel_info = get_romaji_info(first_vowel)
 
-            if re.match(r"[aiueoN]", second_vowel):
+            if ROMAJI_VOWEL_PATTERN.match(second_vowel):
                 second_vowel_info = get_romaji_info(second_vowel)
             else:
                 second_vowel_info = get_hiragana_info(second_vowel)
@@ -340,10 +412,8 @@ class JapaneseLanguageTool(BaseLanguageTool):
             ret.phoneme_list = (
                 first_vowel_info["phoneme"] + second_vowel_info["phoneme"]
             )
-        elif re.match(r"^n ([あいうえおんアイウエオン])$", item_alias):  # N-V
-            matches = re.match(r"^n ([あいうえおんアイウエオン])$", item_alias)
-
-            vowel = matches.group(1)
+        elif alias_type == "nv":  # N-V
+            vowel = matches.group("nv")
 
             n_info = get_hiragana_info("ん")
             vowel_info = get_hiragana_info(vowel)
@@ -356,13 +426,12 @@ class JapaneseLanguageTool(BaseLanguageTool):
             ret.type = "vv"  # N-V is the same as V-V
             ret.phoneme_group = [n_info["phoneme"], vowel_info["phoneme"]]
             ret.phoneme_list = n_info["phoneme"] + vowel_info["phoneme"]
-        elif re.match(r"^([aiueonN]) ([a-zA-Z]+[aiueo]|[ぁ-んァ-ンヴ]+)$", item_alias):  # V-C-V
-            matches = re.match(r"^([aiueonN]) ([a-zA-Z]+[aiueo]|[ぁ-んァ-ンヴ]+)$", item_alias)
-            prev_vowel = matches.group(1)
-            second_syllable = matches.group(2)
+        elif alias_type == "vcv":  # V-C-V
+            prev_vowel = matches.group("vcv1")
+            second_syllable = matches.group("vcv2")
 
             prev_vowel = get_romaji_info(prev_vowel)
-            if re.match(r"[aiueoN]", second_syllable):
+            if ROMAJI_VOWEL_PATTERN.match(second_syllable):
                 second_syllable_info = get_romaji_info(second_syllable)
             else:
                 second_syllable_info = get_hiragana_info(second_syllable)
@@ -411,12 +480,9 @@ class JapaneseLanguageTool(BaseLanguageTool):
             ret.phoneme_list = (
                 prev_vowel_info["phoneme"] + second_syllable_info["phoneme"]
             )
-        elif re.match(r"^([aiueonN]) ([a-zA-Z]+)$", item_alias) and not re.match(
-            r"^n ([aiueo])$", item_alias
-        ):  # V-C
-            matches = re.match(r"^([aiueonN]) ([a-zA-Z]+)$", item_alias)
-            vowel = matches.group(1)
-            consonant = matches.group(2)
+        elif alias_type == "vc":  # V-C
+            vowel = matches.group("vc1")
+            consonant = matches.group("vc2")
 
             vowel_info = get_romaji_info(vowel)
             consonant_info = get_romaji_info(consonant)
@@ -460,8 +526,8 @@ class JapaneseLanguageTool(BaseLanguageTool):
             ret.type = "vc"
             ret.phoneme_group = [vowel_info["phoneme"], consonant_info["phoneme"]]
             ret.phoneme_list = vowel_info["phoneme"] + consonant_info["phoneme"]
-        elif re.match(r"(^[a-zA-Z ]+ ?[aiueonN]|[ぁ-んァ-ンヴ]+)$", item_alias):  # C-V
-            if re.match(r"^[a-zA-Z ]+$", item_alias):
+        elif alias_type == "cv_romaji" or alias_type == "cv_kana":  # C-V
+            if alias_type == "cv_romaji":
                 romaji = item_alias.replace(" ", "")
                 phoneme_info = get_romaji_info(romaji)
             else:
@@ -484,10 +550,15 @@ class JapaneseLanguageTool(BaseLanguageTool):
     def get_consonant_center_pos(self, consonant: str, consonant_length: int):
         if consonant in ["ts", "tS", "dz", "dZ"]:
             return consonant_length / 3 * 2
-        if consonant in self.plosive_consonant_list:
+        if self.is_plosive_consonant(consonant):
             return 20
         else:
             return consonant_length / 2
 
-# Exported instance
-lang_tool = JapaneseLanguageTool()
\ No newline at end of file
+def build_language_pack():
+    return load_hiragana_map() + (JapaneseLanguageTool(),)
+
+
+# Exported instance, built once and then loaded from the pack
+hiragana_map, hiragana_index, romaji_index, lang_tool = load_language_pack(LANGUAGE_PACK_FILE, [HIRAGANA_FILE, __file__],
+                                                                           build_language_pack)
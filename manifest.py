@@ -0,0 +1,146 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+from os import path
+from typing import Optional, TypedDict
+
+from functions import TOOL_VERSION, SegmentInfo, WavInfo, logger
+
+MANIFEST_FILE_NAME = ".oto2seg_manifest.json"
+JOURNAL_FILE_NAME = ".oto2seg_manifest.journal"
+
+
+class ManifestEntry(TypedDict):
+    hash: str
+    files: list[str]
+
+
+class StationaryEntry(TypedDict):
+    hash: str
+    regions: list[dict]  # StationaryRegion of each analyzed candidate
+
+
+class BuildManifest:
+    """Records the inputs of every segment in the output dir, so unchanged segments are not generated again.
+
+    Rendered segments are appended to a journal first, an interrupted run resumes from it.
+    The steady regions found for --stationary are kept per source wav, they are saved with the manifest."""
+
+    def __init__(self, output_dir: str, settings: dict, force: bool = False) -> None:
+        self.output_dir = output_dir
+        self.force = force
+        self.settings_key = json.dumps([TOOL_VERSION, settings], sort_keys=True)
+        self.entries: dict[str, ManifestEntry] = {}
+        self.stationary_entries: dict[str, StationaryEntry] = {}
+        self._stationary_used: set[str] = set()
+        self.produced: set[str] = set()
+        self.skipped = 0
+        self._journal = None
+
+        self.load()
+
+    @property
+    def manifest_file(self) -> str:
+        return path.join(self.output_dir, MANIFEST_FILE_NAME)
+
+    @property
+    def journal_file(self) -> str:
+        return path.join(self.output_dir, JOURNAL_FILE_NAME)
+
+    def load(self):
+        if path.isfile(self.manifest_file):
+            try:
+                with open(self.manifest_file, "r", encoding="utf-8") as f:
+                    manifest_data = json.load(f)
+                self.entries = manifest_data.get("segments", {})
+                self.stationary_entries = manifest_data.get("stationary", {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read build manifest, all segments will be generated: {e}")
+                self.entries = {}
+                self.stationary_entries = {}
+
+        if path.isfile(self.journal_file):
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        file_name, entry = json.loads(line)
+                        self.entries[file_name] = entry
+                    except ValueError:
+                        break  # The last line of an interrupted run may be incomplete
+
+    def get_segment_hash(self, seg_info: SegmentInfo, wav_info: WavInfo, extra: str = "") -> str:
+        hash_source = json.dumps([self.settings_key, seg_info.source_line, wav_info.size, wav_info.mtime, extra])
+        return hashlib.sha1(hash_source.encode("utf-8")).hexdigest()
+
+    def is_up_to_date(self, file_name: str, segment_hash: str) -> bool:
+        self.produced.add(file_name)
+
+        entry = self.entries.get(file_name)
+        if self.force or entry is None or entry["hash"] != segment_hash:
+            return False
+
+        for output_file in entry["files"]:
+            if not path.isfile(path.join(self.output_dir, output_file)):
+                return False
+
+        self.skipped += 1
+        return True
+
+    def get_stationary_hash(self, wav_info: WavInfo, extra) -> str:
+        hash_source = json.dumps([TOOL_VERSION, wav_info.size, wav_info.mtime, extra], sort_keys=True)
+        return hashlib.sha1(hash_source.encode("utf-8")).hexdigest()
+
+    def get_stationary_regions(self, wav_file: str, stationary_hash: str) -> Optional[list[dict]]:
+        """Returns the steady regions found in a wav by an earlier run, or None if its candidates or the wav changed."""
+        self._stationary_used.add(wav_file)
+        entry = self.stationary_entries.get(wav_file)
+        if self.force or entry is None or entry["hash"] != stationary_hash:
+            return None
+        return entry["regions"]
+
+    def record_stationary_regions(self, wav_file: str, stationary_hash: str, regions: list[dict]):
+        self._stationary_used.add(wav_file)
+        self.stationary_entries[wav_file] = {"hash": stationary_hash, "regions": regions}
+
+    def record(self, file_name: str, segment_hash: str, files: list[str]):
+        entry: ManifestEntry = {"hash": segment_hash, "files": files}
+        self.entries[file_name] = entry
+
+        if self._journal is None:
+            self._journal = open(self.journal_file, "a", encoding="utf-8")
+        self._journal.write(json.dumps([file_name, entry], ensure_ascii=False) + "\n")
+
+    def flush(self):
+        if self._journal is not None:
+            self._journal.flush()
+
+    def remove_stale(self):
+        """Deletes the outputs of segments which are no longer produced."""
+        for file_name in list(self.entries.keys()):
+            if file_name in self.produced:
+                continue
+
+            logger.info(f"Removing {file_name}, it is no longer produced.")
+            for output_file in self.entries[file_name]["files"]:
+                output_file = path.join(self.output_dir, output_file)
+                if path.isfile(output_file):
+                    os.remove(output_file)
+            del self.entries[file_name]
+
+    def save(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            # Regions of wavs which were not analyzed in this run are dropped
+            stationary_entries = {wav_file: entry for wav_file, entry in self.stationary_entries.items()
+                                  if wav_file in self._stationary_used}
+            json.dump({"version": TOOL_VERSION, "segments": self.entries, "stationary": stationary_entries}, f,
+                      ensure_ascii=False)
+        os.replace(tmp_file, self.manifest_file)
+
+        if path.isfile(self.journal_file):
+            os.remove(self.journal_file)
@@ -1,40 +1,81 @@
 from __future__ import annotations
 from argparse import ArgumentParser
+from collections import Counter, deque
+from concurrent.futures import Future, as_completed
+from functools import lru_cache
+from itertools import chain, repeat
 import math
 import os
 import re
+import sys
 from os import path
-from typing import TypedDict
+from typing import TYPE_CHECKING, Callable, Collection, Iterator, Sequence, TypedDict, Union
 from wave import open as open_wave
-from pydub import AudioSegment
 
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor  # Imports multiprocessing, only needed with -j
+
+from audio import NORMALIZED_SAMPLE_RATE, AudioCache, crop_wav, load_wav
+from feature_cache import FeatureCache, get_feature_cache, get_wav_features, set_feature_cache
 from functions import *
+from gen_stationary import (STATIONARY_PARAMS, STATIONARY_TYPE, StationaryCandidate, StationaryRegion, StationarySelector,
+                            find_steady_regions, get_stationary_candidates)
+from manifest import BuildManifest
+from output import ArchiveOutput, DirectoryOutput, MemoryOutput, OutputWriter, QueuedOutput, replay_operations
 from phoneme import *
+from profiler import RunProfiler, get_profiler, set_profiler
+from qc import (DEFAULT_MIN_LENGTH, QC_SORT_KEYS, QcIssue, check_audio, check_oto_params, check_segments, format_qc_summary,
+                make_issue, sort_issues, write_qc_report)
+from refine import REFINE_PARAMS, SegmentRefiner
+from segment_plan import (PLAN_VERSION, PlannedSegment, SegmentPlan, WarningCollector, read_plan, segment_from_dict,
+                          segment_to_dict, wav_info_from_dict, wav_info_to_dict, write_plan)
 
 def get_segment_file_name(seg_info: SegmentInfo):
-    prefix = seg_info.art_seg["type"] + "_"
+    prefix = seg_info.art_seg.type + "_"
 
     phonemes = [escape_xsampa(item[0]) for item in seg_info.phoneme_list]
     return prefix + "_".join(phonemes)
 
-def quantize_boundary(boundaries: list[float]) -> list[float]:
-    sample_rate = 44100
-    n_boundary = len(boundaries)
-    for i in range(0, n_boundary):
-        if i == 0:
-            boundaries[i] = math.floor(boundaries[i] / 1000 * sample_rate) * 1000 / sample_rate
-        elif i == n_boundary - 1:
-            boundaries[i] = math.ceil(boundaries[i] / 1000 * sample_rate) * 1000 / sample_rate
-        else:
-            boundaries[i] = math.floor(boundaries[i] / 1000 * sample_rate) * 1000 / sample_rate
-
-    min_length = 10
-    for i in range(1, n_boundary):
-        if boundaries[i] - boundaries[i - 1] < min_length:
-            boundaries[i - 1] = boundaries[i] - min_length
-
-    return boundaries
-
+BOUNDARY_MIN_LENGTH = 10  # ms
+QUANTIZE_NUMPY_MIN_SEGMENTS = 32  # Below this the loop is faster than converting to arrays
+
+def quantize_boundaries(boundary_lists: list[Sequence[float]], sample_rate: int) -> list[tuple[int, ...]]:
+    """Converts the boundaries (ms) of many segments to frame indices.
+
+    The last boundary of each segment is rounded up and the others down, then a boundary which is
+    closer than BOUNDARY_MIN_LENGTH to the next one is moved back from it."""
+    min_frames = math.ceil(BOUNDARY_MIN_LENGTH * sample_rate / 1000)
+
+    np = import_numpy() if len(boundary_lists) >= QUANTIZE_NUMPY_MIN_SEGMENTS else None
+    if np is None:
+        result = []
+        for boundaries in boundary_lists:
+            frames = [math.floor(boundary / 1000 * sample_rate) for boundary in boundaries]
+            frames[-1] = math.ceil(boundaries[-1] / 1000 * sample_rate)
+            # Each boundary is compared with the next one before it is moved
+            for i in range(1, len(frames)):
+                if frames[i] - frames[i - 1] < min_frames:
+                    frames[i - 1] = frames[i] - min_frames
+            result.append(tuple(frames))
+        return result
+
+    lengths = np.fromiter(map(len, boundary_lists), dtype=np.int64, count=len(boundary_lists))
+    ends = np.cumsum(lengths)
+    last = ends - 1
+
+    scaled = np.fromiter(chain.from_iterable(boundary_lists), dtype=np.float64, count=int(ends[-1])) / 1000 * sample_rate
+    frames = np.floor(scaled)
+    frames[last] = np.ceil(scaled[last])
+    frames = frames.astype(np.int64)
+
+    too_close = frames[1:] - frames[:-1] < min_frames
+    too_close[last[:-1]] = False  # The last boundary of a segment and the first one of the next
+    frames[:-1] = np.where(too_close, frames[1:] - min_frames, frames[:-1])
+
+    frame_list = frames.tolist()
+    return [tuple(frame_list[end - length:end]) for end, length in zip(ends.tolist(), lengths.tolist())]
+
+@lru_cache(maxsize=None)
 def get_lang_list() -> list[str]:
     lang_list = []
     for file_name in os.listdir(path.join(path.dirname(__file__), "lang")):
@@ -42,6 +83,7 @@ def get_lang_list() -> list[str]:
             lang_list.append(file_name[:-3])
     return lang_list
 
+@lru_cache(maxsize=None)
 def get_lang_tool(language_name: str) -> BaseLanguageTool:
     script_file = path.join(path.dirname(__file__), "lang", language_name + ".py")
     if path.exists(script_file):
@@ -57,157 +99,138 @@ def get_lang_tool(language_name: str) -> BaseLanguageTool:
     
     raise WarningException("Language %s not found." % language_name)
 
-def generate_articulation_segment_info(oto_list: list[OtoInfo], lang_tool: BaseLanguageTool, ignore_vcv: bool, wav_length: float) -> list[SegmentInfo]:
-    seg_info_list: list[SegmentInfo] = []
+class DedupStats(TypedDict):
+    duplicate_items: int
+    replaced_auto_items: int
+
+def generate_articulation_segment_info(oto_list: list[OtoInfo], lang_tool: BaseLanguageTool, ignore_vcv: bool,
+                                       wav_length: float, sample_rate: int = 44100,
+                                       refiner: Optional[SegmentRefiner] = None) -> tuple[list[SegmentInfo], DedupStats]:
+    """Plans the segments of a wav file.
+
+    Segments with the same phonemes are kept once, a non-auto item is preferred over auto items.
+    With a refiner, consonant centers, plosive bursts and Sil edges are moved to the acoustic events of the wav.
+    The articulation boundaries of all segments are quantized to frames of the wav at once."""
     dist_seg_list: list[SegmentInfo] = []
-    
+    dist_seg_index: dict[tuple[str, ...], int] = {}
+    dedup_stats: DedupStats = {"duplicate_items": 0, "replaced_auto_items": 0}
+
+    def add_segment(seg_info: SegmentInfo):
+        key = seg_info.art_seg.phonemes
+        index = dist_seg_index.get(key)
+        if index is None:
+            dist_seg_index[key] = len(dist_seg_list)
+            dist_seg_list.append(seg_info)
+            return
+
+        dedup_stats["duplicate_items"] += 1
+        if dist_seg_list[index].auto_item and not seg_info.auto_item:
+            dist_seg_list[index] = seg_info
+            dedup_stats["replaced_auto_items"] += 1
+
+    def make_segment(art_type: str, wav_offset: float, wav_cutoff: float, auto_item: bool,
+                     phoneme_list: tuple[PhonemeSpan, ...], boundaries: list[float]) -> SegmentInfo:
+        # Boundaries stay in ms until the whole group is quantized
+        art_seg = ArticulationSegmentInfo(art_type, tuple(span.name for span in phoneme_list), boundaries)
+        return SegmentInfo(oto_item.line, wav_offset, wav_cutoff, auto_item, phoneme_list, art_seg)
+
     for oto_item in oto_list:
         try:
             entry_phoneme_info = lang_tool.get_oto_entry_phoneme_info(oto_item)
-            
-            seg_info = SegmentInfo()
-            seg_info.wav_offset = oto_item.offset
-            seg_info.wav_cutoff = oto_item.cutoff
-            seg_info.auto_item = False
+            phonemes = entry_phoneme_info.phoneme_list
+
             if entry_phoneme_info.type == "rcv":
-                consonant_center = oto_item.offset + lang_tool.get_consonant_center_pos(entry_phoneme_info.phoneme_list[0],
+                consonant_center = oto_item.offset + lang_tool.get_consonant_center_pos(phonemes[0],
                                                                                         oto_item.preutterance - oto_item.offset)
+                consonant_start = oto_item.offset
+                if refiner is not None:
+                    consonant_center = refiner.consonant_center(phonemes[0], consonant_center, oto_item.offset,
+                                                                oto_item.preutterance)
+                    # The closure of a plosive is silent, its Sil edge stays at the offset
+                    if not lang_tool.is_plosive_consonant(phonemes[0]):
+                        consonant_start = refiner.sound_onset(oto_item.offset, upper=consonant_center)
+
                 # Add R-C segment
-                seg_info.auto_item = True
-                seg_info.wav_offset = oto_item.offset
-                seg_info.wav_cutoff = oto_item.preutterance
-
-                seg_info.phoneme_list = [
-                    ["Sil", oto_item.offset - 20, oto_item.offset],
-                    [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.preutterance],
-                ]
-                seg_info.art_seg = {
-                    "type": "rc",
-                    "phonemes": ["Sil", entry_phoneme_info.phoneme_list[0]],
-                    "boundaries": quantize_boundary([oto_item.offset - 20, oto_item.offset, consonant_center]),
-                }
-                seg_info_list.append(seg_info)
+                add_segment(make_segment("rc", oto_item.offset, oto_item.preutterance, True, (
+                    PhonemeSpan("Sil", consonant_start - 20, consonant_start),
+                    PhonemeSpan(phonemes[0], consonant_start, oto_item.preutterance),
+                ), [consonant_start - 20, consonant_start, consonant_center]))
 
                 # Add R-C-V segment
                 if not ignore_vcv:
-                    seg_info = seg_info.copy()
-                    seg_info.auto_item = False
-                    seg_info.wav_cutoff = oto_item.preutterance
-
+                    rest_end = consonant_start
                     if oto_item.offset > oto_item.overlap:
-                        oto_item.offset = oto_item.overlap - 20
-
-                    seg_info.phoneme_list = [
-                        ["Sil", oto_item.offset - 20, oto_item.offset],
-                        [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.preutterance],
-                        [entry_phoneme_info.phoneme_list[1], oto_item.preutterance, oto_item.cutoff],
-                    ]
-                    seg_info.art_seg = {
-                        "type": "rcv",
-                        "phonemes": ["Sil", entry_phoneme_info.phoneme_list[0], entry_phoneme_info.phoneme_list[1]],
-                        "boundaries": quantize_boundary([oto_item.offset - 20, oto_item.offset, consonant_center, oto_item.preutterance, oto_item.consonant]),
-                    }
-                    seg_info_list.append(seg_info)
+                        rest_end = oto_item.overlap - 20
+                        if refiner is not None and not lang_tool.is_plosive_consonant(phonemes[0]):
+                            rest_end = refiner.sound_onset(rest_end, upper=consonant_center)
+
+                    add_segment(make_segment("rcv", oto_item.offset, oto_item.preutterance, False, (
+                        PhonemeSpan("Sil", rest_end - 20, rest_end),
+                        PhonemeSpan(phonemes[0], rest_end, oto_item.preutterance),
+                        PhonemeSpan(phonemes[1], oto_item.preutterance, oto_item.cutoff),
+                    ), [rest_end - 20, rest_end, consonant_center, oto_item.preutterance, oto_item.consonant]))
             elif entry_phoneme_info.type == "vcv":
-                consonant_center = oto_item.overlap + lang_tool.get_consonant_center_pos(entry_phoneme_info.phoneme_list[1],
+                consonant_center = oto_item.overlap + lang_tool.get_consonant_center_pos(phonemes[1],
                                                                                         oto_item.preutterance - oto_item.overlap)
+                if refiner is not None:
+                    consonant_center = refiner.consonant_center(phonemes[1], consonant_center, oto_item.overlap,
+                                                                oto_item.preutterance)
+                # The spans are shared by the V-C, C-V and V-C-V segments
+                vowel1_span = PhonemeSpan(phonemes[0], oto_item.offset, oto_item.overlap)
+                consonant_span = PhonemeSpan(phonemes[1], oto_item.overlap, oto_item.preutterance)
+
                 # Add V-C segment
-                seg_info.auto_item = True
-                seg_info.wav_offset = oto_item.offset
-                seg_info.wav_cutoff = oto_item.preutterance
-
-                seg_info.phoneme_list = [
-                    [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.overlap],
-                    [entry_phoneme_info.phoneme_list[1], oto_item.overlap, oto_item.preutterance],
-                ]
-                seg_info.art_seg = {
-                    "type": "vc",
-                    "phonemes": [entry_phoneme_info.phoneme_list[0], entry_phoneme_info.phoneme_list[1]],
-                    "boundaries": quantize_boundary([oto_item.offset, oto_item.overlap, consonant_center]),
-                }
-                seg_info_list.append(seg_info)
+                add_segment(make_segment("vc", oto_item.offset, oto_item.preutterance, True, (vowel1_span, consonant_span),
+                                         [oto_item.offset, oto_item.overlap, consonant_center]))
 
                 # Add C-V segment
                 # For most languages, get C-V from V-C-V sounds more natural
-                seg_info = seg_info.copy()
-                seg_info.auto_item = True
-                seg_info.wav_offset = oto_item.offset
-                seg_info.wav_cutoff = oto_item.cutoff
-
-                seg_info.phoneme_list = [
-                    [entry_phoneme_info.phoneme_list[1], oto_item.overlap, oto_item.preutterance],
-                    [entry_phoneme_info.phoneme_list[2], oto_item.preutterance, oto_item.cutoff],
-                ]
-                seg_info.art_seg = {
-                    "type": "cv",
-                    "phonemes": [entry_phoneme_info.phoneme_list[1], entry_phoneme_info.phoneme_list[2]],
-                    "boundaries": quantize_boundary([consonant_center, oto_item.preutterance, oto_item.consonant]),
-                }
-                seg_info_list.append(seg_info)
+                add_segment(make_segment("cv", oto_item.offset, oto_item.cutoff, True, (
+                    consonant_span,
+                    PhonemeSpan(phonemes[2], oto_item.preutterance, oto_item.cutoff),
+                ), [consonant_center, oto_item.preutterance, oto_item.consonant]))
 
                 # Add V-C-V segment
                 if not ignore_vcv:
-                    seg_info = seg_info.copy()
-                    seg_info.auto_item = False
-                    seg_info.wav_offset = oto_item.offset
-                    seg_info.wav_cutoff = oto_item.consonant
-                    seg_info.phoneme_list = [
-                        [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.overlap], # Vowel
-                        [entry_phoneme_info.phoneme_list[1], oto_item.overlap, oto_item.preutterance], # Consonant
-                        [entry_phoneme_info.phoneme_list[2], oto_item.preutterance, oto_item.consonant], # Vowel
-                    ]
-
-                    seg_info.art_seg = {
-                        "type": "vcv",
-                        "phonemes": entry_phoneme_info.phoneme_list,
-                        "boundaries": quantize_boundary([oto_item.offset, oto_item.overlap, consonant_center, oto_item.preutterance, oto_item.consonant]),
-                    }
-                    seg_info_list.append(seg_info)
+                    add_segment(make_segment("vcv", oto_item.offset, oto_item.consonant, False, (
+                        vowel1_span,  # Vowel
+                        consonant_span,  # Consonant
+                        PhonemeSpan(phonemes[2], oto_item.preutterance, oto_item.consonant),  # Vowel
+                    ), [oto_item.offset, oto_item.overlap, consonant_center, oto_item.preutterance, oto_item.consonant]))
             elif entry_phoneme_info.type == "rv":
-                seg_info.wav_cutoff = oto_item.consonant
-                seg_info.phoneme_list = [
-                    ["Sil", oto_item.preutterance - 20, oto_item.preutterance],
-                    [entry_phoneme_info.phoneme_list[0], oto_item.preutterance, oto_item.consonant],
-                ]
-                seg_info.art_seg ={
-                    "type": "rv",
-                    "phonemes": ["Sil", entry_phoneme_info.phoneme_list[0]],
-                    "boundaries": quantize_boundary([oto_item.preutterance - 20, oto_item.preutterance, oto_item.consonant]),
-                }
-                seg_info_list.append(seg_info)
+                vowel_start = oto_item.preutterance
+                if refiner is not None:
+                    vowel_start = refiner.sound_onset(vowel_start, oto_item.offset, oto_item.consonant)
+
+                add_segment(make_segment("rv", oto_item.offset, oto_item.consonant, False, (
+                    PhonemeSpan("Sil", vowel_start - 20, vowel_start),
+                    PhonemeSpan(phonemes[0], vowel_start, oto_item.consonant),
+                ), [vowel_start - 20, vowel_start, oto_item.consonant]))
             elif entry_phoneme_info.type == "rc":
-                if entry_phoneme_info.phoneme_list[0] in plosive_consonant_list:
+                if lang_tool.is_plosive_consonant(phonemes[0]):
                     consonant_start = oto_item.consonant
+                    if refiner is not None:
+                        consonant_start = refiner.burst_onset(consonant_start, oto_item.offset, oto_item.cutoff)
                 else:
                     consonant_start = oto_item.offset
+                    if refiner is not None:
+                        consonant_start = refiner.sound_onset(consonant_start, upper=oto_item.cutoff)
 
-                seg_info.phoneme_list = [
-                    ["Sil", consonant_start - 20, consonant_start],
-                    [entry_phoneme_info.phoneme_list[0], consonant_start, oto_item.cutoff],
-                ]
-                seg_info.art_seg = {
-                    "type": "rc",
-                    "phonemes": ["Sil", entry_phoneme_info.phoneme_list[0]],
-                    "boundaries": quantize_boundary([consonant_start - 20, consonant_start, oto_item.cutoff]),
-                }
-                seg_info_list.append(seg_info)
+                add_segment(make_segment("rc", oto_item.offset, oto_item.cutoff, False, (
+                    PhonemeSpan("Sil", consonant_start - 20, consonant_start),
+                    PhonemeSpan(phonemes[0], consonant_start, oto_item.cutoff),
+                ), [consonant_start - 20, consonant_start, oto_item.cutoff]))
             elif entry_phoneme_info.type == "vv":
-                seg_info.wav_cutoff = oto_item.consonant
-                seg_info.phoneme_list = [
-                    [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.preutterance],
-                    [entry_phoneme_info.phoneme_list[1], oto_item.preutterance, oto_item.consonant],
-                ]
-
-                seg_info.art_seg = {
-                    "type": "vv",
-                    "phonemes": [entry_phoneme_info.phoneme_list[0], entry_phoneme_info.phoneme_list[1]],
-                    "boundaries": quantize_boundary([oto_item.offset, oto_item.preutterance, oto_item.consonant]),
-                }
-                seg_info_list.append(seg_info)
+                add_segment(make_segment("vv", oto_item.offset, oto_item.consonant, False, (
+                    PhonemeSpan(phonemes[0], oto_item.offset, oto_item.preutterance),
+                    PhonemeSpan(phonemes[1], oto_item.preutterance, oto_item.consonant),
+                ), [oto_item.offset, oto_item.preutterance, oto_item.consonant]))
             elif entry_phoneme_info.type == "cc":
-                consonant1 = entry_phoneme_info.phoneme_list[0]
-                if consonant1 in plosive_consonant_list:
+                consonant1 = phonemes[0]
+                if lang_tool.is_plosive_consonant(consonant1):
                     consonant1_start = oto_item.overlap
+                    if refiner is not None:
+                        consonant1_start = refiner.burst_onset(consonant1_start, oto_item.offset, oto_item.preutterance)
                 elif oto_item.overlap > oto_item.offset:
                     consonant1_start = oto_item.offset + ((oto_item.overlap - oto_item.offset) / 2)
                 else:
@@ -215,66 +238,41 @@ def generate_articulation_segment_info(oto_list: list[OtoInfo], lang_tool: BaseL
 
                 consonant2_end = oto_item.consonant + ((oto_item.cutoff - oto_item.consonant) / 2)
 
-                seg_info.phoneme_list = [
-                    [entry_phoneme_info.phoneme_list[0], consonant1_start, oto_item.preutterance],
-                    [entry_phoneme_info.phoneme_list[1], oto_item.preutterance, consonant2_end],
-                ]
-
-                seg_info.art_seg = {
-                    "type": "cc",
-                    "phonemes": [entry_phoneme_info.phoneme_list[0], entry_phoneme_info.phoneme_list[1]],
-                    "boundaries": quantize_boundary([consonant1_start, oto_item.preutterance, consonant2_end]),
-                }
-                seg_info_list.append(seg_info)
+                add_segment(make_segment("cc", oto_item.offset, oto_item.cutoff, False, (
+                    PhonemeSpan(phonemes[0], consonant1_start, oto_item.preutterance),
+                    PhonemeSpan(phonemes[1], oto_item.preutterance, consonant2_end),
+                ), [consonant1_start, oto_item.preutterance, consonant2_end]))
             elif entry_phoneme_info.type == "cv":
-                seg_info.wav_cutoff = oto_item.consonant
-                
-                consonant = entry_phoneme_info.phoneme_list[0]
-                if consonant in plosive_consonant_list:
+                consonant = phonemes[0]
+                if lang_tool.is_plosive_consonant(consonant):
                     consonant_start = oto_item.overlap
+                    if refiner is not None:
+                        consonant_start = refiner.burst_onset(consonant_start, oto_item.offset, oto_item.preutterance)
                 elif oto_item.overlap > oto_item.offset:
                     consonant_start = oto_item.offset + ((oto_item.overlap - oto_item.offset) / 2)
                 else:
                     consonant_start = oto_item.offset
 
-                seg_info.phoneme_list = [
-                    [entry_phoneme_info.phoneme_list[0], consonant_start, oto_item.preutterance],
-                    [entry_phoneme_info.phoneme_list[1], oto_item.preutterance, oto_item.consonant],
-                ]
-
-                seg_info.art_seg = {
-                    "type": "cv",
-                    "phonemes": [entry_phoneme_info.phoneme_list[0], entry_phoneme_info.phoneme_list[1]],
-                    "boundaries": quantize_boundary([consonant_start, oto_item.preutterance, oto_item.consonant]),
-                }
-                seg_info_list.append(seg_info)
+                add_segment(make_segment("cv", oto_item.offset, oto_item.consonant, False, (
+                    PhonemeSpan(phonemes[0], consonant_start, oto_item.preutterance),
+                    PhonemeSpan(phonemes[1], oto_item.preutterance, oto_item.consonant),
+                ), [consonant_start, oto_item.preutterance, oto_item.consonant]))
             elif entry_phoneme_info.type == "vc":
-                consonant = entry_phoneme_info.phoneme_list[1]
                 consonant_end = oto_item.consonant + ((oto_item.cutoff - oto_item.consonant) / 2)
-                
-                seg_info.phoneme_list = [
-                    [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.preutterance],
-                    [entry_phoneme_info.phoneme_list[1], oto_item.preutterance, consonant_end],
-                ]
-
-                seg_info.art_seg = {
-                    "type": "vc",
-                    "phonemes": [entry_phoneme_info.phoneme_list[0], entry_phoneme_info.phoneme_list[1]],
-                    "boundaries": quantize_boundary([oto_item.offset, oto_item.preutterance, consonant_end]),
-                }
-                seg_info_list.append(seg_info)
+
+                add_segment(make_segment("vc", oto_item.offset, oto_item.cutoff, False, (
+                    PhonemeSpan(phonemes[0], oto_item.offset, oto_item.preutterance),
+                    PhonemeSpan(phonemes[1], oto_item.preutterance, consonant_end),
+                ), [oto_item.offset, oto_item.preutterance, consonant_end]))
             elif entry_phoneme_info.type == "vr" or entry_phoneme_info.type == "cr":
-                seg_info.phoneme_list = [
-                    [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.preutterance],
-                    ["Sil", oto_item.preutterance, oto_item.preutterance + 20],
-                ]
-
-                seg_info.art_seg = {
-                    "type":  entry_phoneme_info.type,
-                    "phonemes": [entry_phoneme_info.phoneme_list[0], "Sil"],
-                    "boundaries": quantize_boundary([oto_item.overlap, oto_item.preutterance, oto_item.preutterance + 20]),
-                }
-                seg_info_list.append(seg_info)
+                sound_end = oto_item.preutterance
+                if refiner is not None:
+                    sound_end = refiner.sound_offset(sound_end, oto_item.overlap, oto_item.cutoff)
+
+                add_segment(make_segment(entry_phoneme_info.type, oto_item.offset, oto_item.cutoff, False, (
+                    PhonemeSpan(phonemes[0], oto_item.offset, sound_end),
+                    PhonemeSpan("Sil", sound_end, sound_end + 20),
+                ), [oto_item.overlap, sound_end, sound_end + 20]))
             else:
                 raise WarningException(f"Unknown phoneme type: {entry_phoneme_info.type}")
         except WarningException as e:
@@ -283,171 +281,1063 @@ def generate_articulation_segment_info(oto_list: list[OtoInfo], lang_tool: BaseL
             logger.error(f"Failed to parse {oto_item.alias}: {e}")
             traceback.print_exc()
 
-        # Remove duplicate auto items
-        seg_info_map: dict[str, list[SegmentInfo]] = {}
-        for seg_info in seg_info_list:
-            phonemes_str = " ".join(seg_info.art_seg["phonemes"])
-            if phonemes_str not in seg_info_map:
-                seg_info_map[phonemes_str] = []
-
-            seg_info_map[phonemes_str].append(seg_info)
-
-        for key, seg_list in seg_info_map.items():
-            if len(seg_list) > 1:
-                dist_seg_info = None
-                for seg_info in seg_list:
-                    if not seg_info.auto_item:
-                        dist_seg_info = seg_info
-                        break
-                if dist_seg_info is None: # Use the first one
-                    dist_seg_info = seg_list[0]
-
-                dist_seg_list.append(dist_seg_info)
-            elif len(seg_list) == 1:
-                dist_seg_list.append(seg_list[0])
-    
-    return dist_seg_list
-
+    frame_boundaries = quantize_boundaries([seg_info.art_seg.boundaries for seg_info in dist_seg_list], sample_rate)
+    for seg_info, boundaries in zip(dist_seg_list, frame_boundaries):
+        seg_info.art_seg = seg_info.art_seg._replace(boundaries=boundaries)
 
-def generate_articulation_files(wav_file: str, seg_info: SegmentInfo, output_dir: str) -> str:
-    bleed_time = 100
+    return dist_seg_list, dedup_stats
 
-    file_name = get_segment_file_name(seg_info)
-    logger.info(f"Generating {file_name}...")
 
-    append_silent_start = 0
-    append_silent_end = 0
-    seg_wav_length = seg_info.wav_cutoff - seg_info.wav_offset + bleed_time * 2
+SEGMENT_BLEED_TIME = 100  # ms
 
-    time_delta = 0
+def get_output_rate(wav_info: WavInfo, normalize: bool) -> int:
+    """Returns the sample rate of the segments cut from a source wav, their boundaries are planned in its frames."""
+    return NORMALIZED_SAMPLE_RATE if normalize else wav_info.framerate
 
-    if seg_info.wav_offset < bleed_time:
-        append_silent_start = bleed_time - seg_info.wav_offset
-        time_delta += append_silent_start
-    else:
-        time_delta = -1 * (seg_info.wav_offset - bleed_time)
+def get_segment_window(seg_info: SegmentInfo, sample_rate: int) -> tuple[int, int]:
+    """Returns the crop window of a segment in frames, the part outside of the source wav is filled with silence."""
+    start_frame = round((seg_info.wav_offset - SEGMENT_BLEED_TIME) / 1000 * sample_rate)
+    end_frame = round((seg_info.wav_cutoff + SEGMENT_BLEED_TIME) / 1000 * sample_rate)
+    return start_frame, end_frame
 
+def render_segment_texts(seg_info: SegmentInfo, start_frame: int, end_frame: int, sample_rate: int,
+                         lang_tool: BaseLanguageTool) -> tuple[str, str, list[str]]:
+    """Returns the trans, seg and as file contents of a segment cut at [start_frame, end_frame)."""
+    time_delta = -1 * start_frame / sample_rate * 1000
 
     # Relative data
-    relative_wav_offset = seg_info.wav_offset + time_delta
     relative_wav_cutoff = seg_info.wav_cutoff + time_delta
 
-    phoneme_list = []
-    for phoneme in seg_info.phoneme_list:
-        phoneme_list.append([
-            phoneme[0],
-            phoneme[1] + time_delta,
-            phoneme[2] + time_delta,
-        ])
+    phoneme_list = [
+        PhonemeSpan(phoneme.name, phoneme.start + time_delta, phoneme.end + time_delta) for phoneme in seg_info.phoneme_list
+    ]
     
     art_seg_list = [
-        {
-            "type": seg_info.art_seg["type"],
-            "phonemes": seg_info.art_seg["phonemes"],
-            "boundaries": [boundary + time_delta for boundary in seg_info.art_seg["boundaries"]],
-        }
+        seg_info.art_seg._replace(boundaries=tuple(boundary - start_frame for boundary in seg_info.art_seg.boundaries))
     ]
 
-    with open_wave(wav_file, 'rb') as wav:
-        wav_length = wav.getnframes() / wav.getframerate() * 1000
-
-    if seg_info.wav_cutoff + bleed_time > wav_length:
-        append_silent_end = seg_info.wav_cutoff + bleed_time - wav_length
+    output_wav_frames = end_frame - start_frame
+    output_wav_length = output_wav_frames / sample_rate * 1000
 
-    # Generate trans file
     trans_content = generate_articulation_trans_file(phoneme_list)
-    output_trans_file = path.join(output_dir, file_name + ".trans")
-    with open(output_trans_file, "w", encoding="utf-8") as f:
-        f.write(trans_content)
-        
-    # Generate wav file
-    input_sound = AudioSegment.from_wav(wav_file)
-    wav_start_time = max(0, seg_info.wav_offset - bleed_time)
-    wav_end_time = min(wav_length, seg_info.wav_cutoff + bleed_time)
-    output_sound: AudioSegment = input_sound[wav_start_time:wav_end_time]
+    seg_content = generate_articulation_seg_file(phoneme_list, relative_wav_cutoff, output_wav_length,
+                                                 seg_info.art_seg.type == STATIONARY_TYPE)
+    as_content_list = generate_articulation_as_files(art_seg_list, output_wav_frames, sample_rate, lang_tool)
+
+    return trans_content, seg_content, as_content_list
+
+def generate_articulation_files(wav_file: str, seg_info: SegmentInfo, output: Union[OutputWriter, str], lang_tool: BaseLanguageTool,
+                                audio_cache: Optional[AudioCache] = None, wav_source_name: Optional[str] = None) -> list[str]:
+    """Writes the wav, trans, seg and as files of a segment, returns the written file names.
+
+    output is an OutputWriter or an output dir. If wav_source_name is given, it is an already written
+    segment wav with the same crop window, it is linked or copied instead of cutting the source wav again."""
+    if isinstance(output, str):
+        output = DirectoryOutput(output)
+
+    file_name = get_segment_file_name(seg_info)
+    logger.info(f"Generating {file_name}...")
 
-    if append_silent_start > 0:
-        output_sound = AudioSegment.silent(duration=append_silent_start) + output_sound
-    if append_silent_end > 0:
-        output_sound = output_sound + AudioSegment.silent(duration=append_silent_end)
+    if wav_source_name is not None:
+        wav_data = None
+        sample_rate = get_output_rate(probe_wav(wav_file), audio_cache is not None and audio_cache.normalize)
+    else:
+        if audio_cache is not None:
+            wav_data = audio_cache.get(wav_file)
+        else:
+            wav_data = load_wav(wav_file)
+        sample_rate = wav_data.framerate
 
-    output_wav_file = path.join(output_dir, file_name + ".wav")
-    output_sound.export(output_wav_file, format="wav")
+    start_frame, end_frame = get_segment_window(seg_info, sample_rate)
+    trans_content, seg_content, as_content_list = render_segment_texts(seg_info, start_frame, end_frame, sample_rate, lang_tool)
 
-    output_wav_length = output_sound.duration_seconds * 1000
-    output_wav_frames = output_sound.frame_count()
+    # Generate trans file
+    output.write_text(file_name + ".trans", trans_content)
+        
+    # Generate wav file
+    if wav_source_name is not None:
+        output.link_file(wav_source_name, file_name + ".wav")
+    else:
+        output_frames = crop_wav(wav_data, start_frame, end_frame)
+        output.write_wav(file_name + ".wav", wav_data, output_frames)
 
     # Generate seg file
-    seg_content = generate_articulation_seg_file(phoneme_list, relative_wav_cutoff, output_wav_length)
-    output_seg_file = path.join(output_dir, file_name + ".seg")
-    with open(output_seg_file, "w", encoding="utf-8") as f:
-        f.write(seg_content)
+    output.write_text(file_name + ".seg", seg_content)
         
     # Generate as file
-    as_content_list = generate_articulation_as_files(art_seg_list, output_wav_frames)
     for i in range(0, len(as_content_list)):
-        output_as_file = path.join(output_dir, file_name + ".as%d" % i)
-        with open(output_as_file, "w", encoding="utf-8") as f:
-            f.write(as_content_list[i])
+        output.write_text(file_name + ".as%d" % i, as_content_list[i])
+
+    return [file_name + ".trans", file_name + ".wav", file_name + ".seg"] + \
+        [file_name + ".as%d" % i for i in range(0, len(as_content_list))]
+
+DEFAULT_AUDIO_CACHE_SIZE = 512  # MiB
+DEFAULT_PROFILE_REPORT = "oto2seg_profile.json"
+DEFAULT_QC_REPORT = "oto2seg_qc.csv"
+WRITER_THREADS = 4  # Threads writing the segment files of the main process
+WRITE_QUEUE_SIZE = 64  # Queued file writes before rendering waits for the writers
+READ_AHEAD_WAVS = 2  # Source wavs read by the reader thread before they are rendered
 
 class ArticulationMapItem(TypedDict):
     seg_info: SegmentInfo
     wav_file: str
 
-def generate_articulation_from_oto(oto_dict: dict[str, list[OtoInfo]], lang_tool: BaseLanguageTool, ignore_vcv: bool, output_dir: str) -> str:
-    """Converts an oto.ini dictionary to a .seg file."""
-    art_map: dict[str, ArticulationMapItem] = {}
-    
-    for wav_file, oto_list in oto_dict.items():
-        if len(oto_list) == 0:
-            continue
-
-        base_name = path.splitext(path.basename(wav_file))[0]
-        wav_file_resolved = oto_list[0].wav_file
-        with open_wave(wav_file_resolved, 'rb') as wav:
-            wav_params = wav.getparams()
-            wav_length = wav_params.nframes / wav_params.framerate * 1000
-
-        seg_info_list: list[SegmentInfo] = generate_articulation_segment_info(oto_list, lang_tool, ignore_vcv, wav_length)
-        
+class RenderTask(TypedDict):
+    wav_info: WavInfo
+    seg_info_list: list[SegmentInfo]
+    wav_source_names: Optional[list[Optional[str]]]  # Written wav to reuse for each segment
+    stationary_candidates: Optional[list[StationaryCandidate]]  # Analyzed with the frame features of the wav
+
+# Per-process state of the render workers
+_worker_lang_tool: Optional[BaseLanguageTool] = None
+_worker_audio_cache: Optional[AudioCache] = None
+
+def init_worker(lang_tool: BaseLanguageTool, audio_cache_size: int, profile: bool = False, normalize: bool = False,
+                feature_cache_dir: Optional[str] = None):
+    global _worker_lang_tool, _worker_audio_cache
+    _worker_lang_tool = lang_tool
+    _worker_audio_cache = AudioCache(audio_cache_size, normalize)
+    if profile:
+        set_profiler(RunProfiler())
+    if feature_cache_dir is not None:
+        set_feature_cache(FeatureCache(feature_cache_dir))
+
+def create_executor(jobs: int, lang_tool: BaseLanguageTool, audio_cache: AudioCache) -> Optional[ProcessPoolExecutor]:
+    if jobs <= 1:
+        return None
+
+    from concurrent.futures import ProcessPoolExecutor
+    feature_cache = get_feature_cache()
+    return ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                               initargs=(lang_tool, audio_cache.max_bytes, get_profiler().enabled, audio_cache.normalize,
+                                         feature_cache.cache_dir if feature_cache is not None else None))
+
+def get_segment_refiner(wav_info: WavInfo, lang_tool: BaseLanguageTool) -> Optional[SegmentRefiner]:
+    """Analyzes a source wav for --refine, or loads its features from the feature cache.
+
+    The oto positions are kept if the wav cannot be analyzed."""
+    try:
+        return SegmentRefiner(get_wav_features(wav_info), lang_tool)
+    except (WarningException, OSError) as e:
+        logger.warning(f"Failed to analyze {wav_info.wav_file}, its boundaries are not refined: {e}")
+        return None
+
+def plan_wav_group(oto_list: list[OtoInfo], lang_tool: BaseLanguageTool, ignore_vcv: bool, normalize: bool = False,
+                   refine: bool = False) -> list[SegmentInfo]:
+    profiler = get_profiler()
+    if profiler.enabled:
+        cache_stats = lang_tool.get_cache_stats()
+
+    wav_info = oto_list[0].wav_info
+    refiner = get_segment_refiner(wav_info, lang_tool) if refine else None
+    seg_info_list, dedup_stats = generate_articulation_segment_info(oto_list, lang_tool, ignore_vcv, wav_info.length,
+                                                                    get_output_rate(wav_info, normalize), refiner)
+    if dedup_stats["duplicate_items"] > 0:
+        logger.debug("%s: %d duplicate segments, %d auto items replaced" % (
+            oto_list[0].wav_file, dedup_stats["duplicate_items"], dedup_stats["replaced_auto_items"]))
+
+    if profiler.enabled:
+        profiler.count("oto_entries", len(oto_list))
+        profiler.count("duplicate_segments", dedup_stats["duplicate_items"])
         for seg_info in seg_info_list:
-            generate_articulation_files(wav_file_resolved, seg_info, output_dir)
-
-            art_map[" ".join(seg_info.art_seg["phonemes"])] = {
-                "seg_info": seg_info,
-                "wav_file": wav_file_resolved
-            }
-
-    missing_phoneme_list = lang_tool.get_missing_list(art_map.keys())
-    
-    logger.info("Missing Articulations: " + ", ".join(missing_phoneme_list))
-
-    # Generate missing phoneme files
-    for missing_phoneme in missing_phoneme_list:
-        alt_phoneme = lang_tool.get_alternative_phoneme(missing_phoneme, art_map.keys())
+            profiler.count("segments_" + seg_info.art_seg.type)
+        for cache_name, stats in lang_tool.get_cache_stats().items():
+            profiler.count(cache_name + "_cache_hits", stats["hits"] - cache_stats[cache_name]["hits"])
+            profiler.count(cache_name + "_cache_misses", stats["misses"] - cache_stats[cache_name]["misses"])
+
+    return seg_info_list
+
+def render_wav_group(render_task: RenderTask, output: OutputWriter, audio_cache: AudioCache,
+                     lang_tool: BaseLanguageTool) -> tuple[dict[str, list[str]], list[StationaryRegion]]:
+    """Renders the segments of a wav, and finds the steady regions of its stationary candidates in its frame features."""
+    wav_file = render_task["wav_info"].wav_file
+    wav_source_names = render_task["wav_source_names"]
+
+    rendered_files: dict[str, list[str]] = {}
+    for i, seg_info in enumerate(render_task["seg_info_list"]):
+        wav_source_name = wav_source_names[i] if wav_source_names is not None else None
+        rendered_files[get_segment_file_name(seg_info)] = generate_articulation_files(wav_file, seg_info, output, lang_tool, audio_cache,
+                                                                                      wav_source_name)
+
+    stationary_regions: list[StationaryRegion] = []
+    if render_task["stationary_candidates"]:
+        try:
+            features = get_wav_features(render_task["wav_info"])
+        except (WarningException, OSError) as e:
+            logger.warning(f"Failed to analyze {wav_file}, no stationary is cut from it: {e}")
+        else:
+            stationary_regions = find_steady_regions(features, wav_file, render_task["stationary_candidates"])
+
+    return rendered_files, stationary_regions
+
+def _needs_audio(render_task: RenderTask) -> bool:
+    """Returns whether rendering the task reads its source wav, segments with a written wav to reuse do not."""
+    if render_task["wav_source_names"] is None:
+        return len(render_task["seg_info_list"]) > 0
+    return any(wav_source_name is None for wav_source_name in render_task["wav_source_names"])
+
+def _plan_wav_group_worker(oto_list: list[OtoInfo], ignore_vcv: bool, normalize: bool,
+                           refine: bool) -> tuple[list[SegmentInfo], dict[str, int]]:
+    return plan_wav_group(oto_list, _worker_lang_tool, ignore_vcv, normalize, refine), get_profiler().pop_counters()
+
+def _render_wav_group_worker(render_task: RenderTask, output_dir: Optional[str]) -> tuple[dict[str, list[str]], list[StationaryRegion],
+                                                                                           Optional[list], dict[str, int]]:
+    if output_dir is None:
+        # Only the main process writes to the archive
+        memory_output = MemoryOutput()
+        rendered_files, stationary_regions = render_wav_group(render_task, memory_output, _worker_audio_cache, _worker_lang_tool)
+        return rendered_files, stationary_regions, memory_output.operations, get_profiler().pop_counters()
+
+    rendered_files, stationary_regions = render_wav_group(render_task, DirectoryOutput(output_dir), _worker_audio_cache,
+                                                          _worker_lang_tool)
+    return rendered_files, stationary_regions, None, get_profiler().pop_counters()
+
+def render_wav_groups(render_list: list[RenderTask], output: OutputWriter, audio_cache: AudioCache, lang_tool: BaseLanguageTool,
+                      executor: Optional[ProcessPoolExecutor] = None,
+                      on_rendered: Optional[Callable[[dict[str, list[str]]], None]] = None,
+                      on_stationary: Optional[Callable[[WavInfo, list[StationaryRegion]], None]] = None):
+    if executor is None:
+        # The reader thread reads the next wavs and the writer threads write the files while a wav is cut,
+        # a group is only recorded once its files are written
+        queued_output = QueuedOutput(output, WRITER_THREADS, WRITE_QUEUE_SIZE)
+        try:
+            for task_index, render_task in enumerate(render_list):
+                for next_task in render_list[task_index + 1:task_index + 1 + READ_AHEAD_WAVS]:
+                    if _needs_audio(next_task):
+                        audio_cache.prefetch(next_task["wav_info"].wav_file)
+
+                rendered_files, stationary_regions = render_wav_group(render_task, queued_output, audio_cache, lang_tool)
+                if on_rendered is not None:
+                    queued_output.defer(on_rendered, rendered_files)
+                if on_stationary is not None and render_task["stationary_candidates"]:
+                    on_stationary(render_task["wav_info"], stationary_regions)
+        finally:
+            queued_output.finish()
+        return
+
+    output_dir = output.output_dir if isinstance(output, DirectoryOutput) else None
+
+    # Schedule the largest files first to keep the pool balanced
+    render_list = sorted(render_list, key=lambda x: x["wav_info"].nframes * x["wav_info"].nchannels * x["wav_info"].sampwidth,
+                         reverse=True)
+    futures = {executor.submit(_render_wav_group_worker, render_task, output_dir): render_task for render_task in render_list}
+    for future in as_completed(futures):
+        rendered_files, stationary_regions, operations, counters = future.result()
+        get_profiler().merge_counters(counters)
+        if operations is not None:
+            replay_operations(output, operations)
+        if on_rendered is not None:
+            on_rendered(rendered_files)
+        if on_stationary is not None and futures[future]["stationary_candidates"]:
+            on_stationary(futures[future]["wav_info"], stationary_regions)
+
+class ManifestRecorder:
+    """Checks segments against the build manifest and records them once they are rendered."""
+
+    def __init__(self, build_manifest: Optional[BuildManifest]) -> None:
+        self.build_manifest = build_manifest
+        self.segment_hash_map: dict[str, str] = {}
+        self.stationary_hash_map: dict[str, str] = {}
+
+    def is_up_to_date(self, seg_info: SegmentInfo, wav_info: WavInfo, extra: str = "", force: bool = False) -> bool:
+        if self.build_manifest is None:
+            return False
+        file_name = get_segment_file_name(seg_info)
+        self.segment_hash_map[file_name] = self.build_manifest.get_segment_hash(seg_info, wav_info, extra)
+        if force:
+            self.build_manifest.produced.add(file_name)
+            return False
+        return self.build_manifest.is_up_to_date(file_name, self.segment_hash_map[file_name])
+
+    def on_rendered(self, rendered_files: dict[str, list[str]]):
+        if self.build_manifest is None:
+            return
+        for file_name, files in rendered_files.items():
+            self.build_manifest.record(file_name, self.segment_hash_map.pop(file_name), files)
+        self.build_manifest.flush()
+
+    def get_stationary_candidates(self, oto_list: list[OtoInfo], seg_info_list: list[SegmentInfo],
+                                  selector: StationarySelector) -> Optional[list[StationaryCandidate]]:
+        """Returns the stationary candidates of a wav which have to be analyzed.
+
+        If the wav and its candidates did not change, the regions found by the last run are added to selector instead."""
+        candidates = get_stationary_candidates(oto_list, seg_info_list)
+        if len(candidates) == 0:
+            return None
+        if self.build_manifest is None:
+            return candidates
+
+        wav_info = oto_list[0].wav_info
+        stationary_hash = self.build_manifest.get_stationary_hash(wav_info, [STATIONARY_PARAMS, candidates])
+        regions = self.build_manifest.get_stationary_regions(wav_info.wav_file, stationary_hash)
+        if regions is None:
+            self.stationary_hash_map[wav_info.wav_file] = stationary_hash
+            return candidates
+
+        selector.add(regions)
+        return None
+
+    def on_stationary(self, wav_info: WavInfo, regions: list[StationaryRegion]):
+        if self.build_manifest is not None:
+            self.build_manifest.record_stationary_regions(wav_info.wav_file, self.stationary_hash_map.pop(wav_info.wav_file),
+                                                          regions)
+
+    def finish(self):
+        if self.build_manifest is not None:
+            self.build_manifest.remove_stale()
+            self.build_manifest.save()
+            logger.info("%d segments are up to date." % self.build_manifest.skipped)
+
+def plan_alternative_tasks(alternative_phoneme_map: dict[str, Optional[str]], art_map: dict[str, ArticulationMapItem],
+                           wav_info_map: dict[str, WavInfo], rendered_segments: dict[str, SegmentInfo],
+                           recorder: ManifestRecorder) -> list[RenderTask]:
+    """Builds the segments of the missing articulations from their substitutes, grouped by source wav."""
+    profiler = get_profiler()
+    profiler.count("articulations_missing", len(alternative_phoneme_map))
+
+    alternative_map: dict[str, RenderTask] = {}
+    for missing_phoneme, alt_phoneme in alternative_phoneme_map.items():
         if alt_phoneme:
+            profiler.count("alternatives_resolved")
             logger.info("Alternative Articulations for %s: %s" % (missing_phoneme, alt_phoneme))
 
             alt_phoneme_list = missing_phoneme.split(" ")
-            
+
             alternative_info = art_map[alt_phoneme]
             new_seg_info: SegmentInfo = alternative_info["seg_info"].set_phonemes(alt_phoneme_list)
-            
-            generate_articulation_files(alternative_info["wav_file"], new_seg_info, output_dir)
+
+            alt_wav_file = alternative_info["wav_file"]
+            if recorder.is_up_to_date(new_seg_info, wav_info_map[alt_wav_file], missing_phoneme):
+                continue
+
+            # The substitute has the same crop window, reuse its written wav
+            alt_file_name = get_segment_file_name(alternative_info["seg_info"])
+            wav_source_name = None
+            if rendered_segments.get(alt_file_name) is alternative_info["seg_info"]:
+                wav_source_name = alt_file_name + ".wav"
+
+            if alt_wav_file not in alternative_map:
+                alternative_map[alt_wav_file] = {"wav_info": wav_info_map[alt_wav_file], "seg_info_list": [], "wav_source_names": [],
+                                                 "stationary_candidates": None}
+            alternative_map[alt_wav_file]["seg_info_list"].append(new_seg_info)
+            alternative_map[alt_wav_file]["wav_source_names"].append(wav_source_name)
         else:
+            profiler.count("alternatives_unresolved")
             logger.info("Warning: Could not find alternative phoneme for %s, skip this line." % missing_phoneme)
 
+    return list(alternative_map.values())
+
+def plan_articulation_from_oto(oto_group_list: list[list[OtoInfo]], lang_tool: BaseLanguageTool, ignore_vcv: bool,
+                               recorder: ManifestRecorder, executor: Optional[ProcessPoolExecutor] = None,
+                               normalize: bool = False, refine: bool = False, selector: Optional[StationarySelector] = None
+                               ) -> tuple[list[RenderTask], list[RenderTask], dict[str, Optional[str]]]:
+    """Plans the segments of every wav group, audio is only read with refine.
+
+    With normalize the boundaries are planned in frames of the normalized wavs. With a selector the vowel regions of
+    every wav which changed are added to its render task as stationary candidates, also if its segments are up to date,
+    the regions of the other wavs are taken from the manifest.
+    Returns the render tasks of the oto segments and of the missing articulations, and the substitute
+    chosen for each missing articulation. Segments which are up to date in the manifest are left out."""
+    art_map: dict[str, ArticulationMapItem] = {}
+    wav_info_map: dict[str, WavInfo] = {oto_list[0].wav_file: oto_list[0].wav_info for oto_list in oto_group_list}
+    profiler = get_profiler()
+
+    with profiler.stage("plan"):
+        if executor is not None:
+            seg_info_groups = []
+            for seg_info_list, counters in executor.map(_plan_wav_group_worker, oto_group_list, repeat(ignore_vcv),
+                                                          repeat(normalize), repeat(refine)):
+                seg_info_groups.append(seg_info_list)
+                profiler.merge_counters(counters)
+        else:
+            seg_info_groups = [plan_wav_group(oto_list, lang_tool, ignore_vcv, normalize, refine) for oto_list in oto_group_list]
+
+        # Merge in oto order, a later segment overwrites an earlier one with the same file name
+        render_index: dict[str, tuple[int, int]] = {}
+        for group_index, seg_info_list in enumerate(seg_info_groups):
+            wav_file_resolved = oto_group_list[group_index][0].wav_file
+            for seg_index, seg_info in enumerate(seg_info_list):
+                render_index[get_segment_file_name(seg_info)] = (group_index, seg_index)
+
+                art_map[" ".join(seg_info.art_seg.phonemes)] = {
+                    "seg_info": seg_info,
+                    "wav_file": wav_file_resolved
+                }
+
+        render_set = set(render_index.values())
+        rendered_segments: dict[str, SegmentInfo] = {
+            file_name: seg_info_groups[group_index][seg_index] for file_name, (group_index, seg_index) in render_index.items()
+        }
+        render_list: list[RenderTask] = []
+        for group_index, seg_info_list in enumerate(seg_info_groups):
+            wav_info = oto_group_list[group_index][0].wav_info
+            stationary_candidates = (recorder.get_stationary_candidates(oto_group_list[group_index], seg_info_list, selector)
+                                     if selector is not None else None)
+            seg_info_list = [seg_info for seg_index, seg_info in enumerate(seg_info_list)
+                             if (group_index, seg_index) in render_set and not recorder.is_up_to_date(seg_info, wav_info)]
+            if len(seg_info_list) > 0 or stationary_candidates:
+                render_list.append({"wav_info": wav_info, "seg_info_list": seg_info_list, "wav_source_names": None,
+                                    "stationary_candidates": stationary_candidates})
+
+    with profiler.stage("alternatives"):
+        missing_phoneme_list = lang_tool.get_missing_list(art_map.keys())
+
+        logger.info("Missing Articulations: " + ", ".join(missing_phoneme_list))
+
+        # Resolve all alternatives in one pass and group them by source wav
+        alternative_phoneme_map = lang_tool.resolve_alternatives(missing_phoneme_list, art_map.keys())
+        alternative_list = plan_alternative_tasks(alternative_phoneme_map, art_map, wav_info_map, rendered_segments, recorder)
+
+    return render_list, alternative_list, alternative_phoneme_map
+
+def plan_stationary_tasks(selector: StationarySelector, lang_tool: BaseLanguageTool, recorder: ManifestRecorder,
+                          normalize: bool = False) -> list[RenderTask]:
+    """Plans a stationary segment of each phoneme of vowel_map from the steadiest region of its sound.
+
+    Phonemes cut from the same region share one wav. Stationaries which are up to date in the manifest are left out."""
+    task_map: dict[str, RenderTask] = {}
+    sound_wav_names: dict[str, str] = {}
+    for phoneme, region in selector.get_regions(lang_tool):
+        wav_info = probe_wav(region["wav_file"])
+        if wav_info is None:
+            continue
+
+        boundaries = quantize_boundaries([(region["start"], region["end"])], get_output_rate(wav_info, normalize))[0]
+        seg_info = SegmentInfo(region["source_line"], region["start"], region["end"], False,
+                               (PhonemeSpan(phoneme, region["start"], region["end"]),),
+                               ArticulationSegmentInfo(STATIONARY_TYPE, (phoneme,), boundaries))
+        file_name = get_segment_file_name(seg_info)
+        wav_source_name = sound_wav_names.get(region["sound"])
+        if wav_source_name is None:
+            sound_wav_names[region["sound"]] = file_name + ".wav"
+
+        if recorder.is_up_to_date(seg_info, wav_info, "%.3f %.3f" % (region["start"], region["end"])):
+            continue
+
+        if wav_info.wav_file not in task_map:
+            task_map[wav_info.wav_file] = {"wav_info": wav_info, "seg_info_list": [], "wav_source_names": [],
+                                           "stationary_candidates": None}
+        task_map[wav_info.wav_file]["seg_info_list"].append(seg_info)
+        task_map[wav_info.wav_file]["wav_source_names"].append(wav_source_name)
+
+    return list(task_map.values())
+
+def generate_articulation_from_oto(oto_dict: dict[str, list[OtoInfo]], lang_tool: BaseLanguageTool, ignore_vcv: bool,
+                                   output: Union[OutputWriter, str], audio_cache: Optional[AudioCache] = None, jobs: int = 1,
+                                   build_manifest: Optional[BuildManifest] = None,
+                                   executor: Optional[ProcessPoolExecutor] = None, refine: bool = False,
+                                   stationary: bool = False) -> dict[str, Optional[str]]:
+    """Converts an oto.ini dictionary to a .seg file.
+
+    output is an OutputWriter or an output dir. If build_manifest is given, segments whose inputs
+    did not change since the last run are skipped. A running executor from create_executor can be
+    shared by several calls, otherwise one with jobs workers is started. With refine the boundaries
+    are moved to the acoustic events of the source wavs. With stationary a stationary of each vowel and
+    syllabic nasal is cut from the steadiest C-V, V-V or R-V region while the wavs are rendered.
+    Returns the substitute chosen for each missing articulation."""
+    if isinstance(output, str):
+        output = DirectoryOutput(output)
+
+    if audio_cache is None:
+        audio_cache = AudioCache(DEFAULT_AUDIO_CACHE_SIZE * 1024 * 1024)
+
+    oto_group_list = [oto_list for oto_list in oto_dict.values() if len(oto_list) > 0]
+
+    recorder = ManifestRecorder(build_manifest)
+
+    profiler = get_profiler()
+    own_executor = executor is None
+    if own_executor:
+        executor = create_executor(jobs, lang_tool, audio_cache)
+
+    try:
+        selector = StationarySelector()
+        render_list, alternative_list, alternative_phoneme_map = plan_articulation_from_oto(oto_group_list, lang_tool, ignore_vcv,
+                                                                                            recorder, executor, audio_cache.normalize,
+                                                                                            refine, selector if stationary else None)
+
+        def on_stationary(wav_info: WavInfo, regions: list[StationaryRegion]):
+            recorder.on_stationary(wav_info, regions)
+            selector.add(regions)
+
+        with profiler.stage("render"):
+            render_wav_groups(render_list, output, audio_cache, lang_tool, executor, recorder.on_rendered, on_stationary)
+
+            # Generate missing phoneme files
+            render_wav_groups(alternative_list, output, audio_cache, lang_tool, executor, recorder.on_rendered)
+
+        if stationary:
+            with profiler.stage("stationary"):
+                stationary_list = plan_stationary_tasks(selector, lang_tool, recorder, audio_cache.normalize)
+                render_wav_groups(stationary_list, output, audio_cache, lang_tool, executor, recorder.on_rendered)
+    finally:
+        if own_executor and executor is not None:
+            executor.shutdown()
+
+    with profiler.stage("manifest"):
+        recorder.finish()
+
+    if executor is None:
+        logger.debug("Audio cache: %d hits, %d misses" % (audio_cache.hits, audio_cache.misses))
+
+    return alternative_phoneme_map
+
+def write_segment_plan(plan_file: str, oto_dict: dict[str, list[OtoInfo]], oto_file: str, settings: dict,
+                       lang_tool: BaseLanguageTool, ignore_vcv: bool, normalize: bool = False, refine: bool = False,
+                       read_warnings: Optional[list[str]] = None):
+    """Plans every segment of an oto.ini dictionary and writes the plan as json, no audio is read unless refine is set.
+
+    The warnings logged while planning are stored in the plan, after read_warnings (the warnings of read_oto)."""
+    oto_group_list = [oto_list for oto_list in oto_dict.values() if len(oto_list) > 0]
+
+    warning_collector = WarningCollector()
+    warning_collector.messages.extend(read_warnings or [])
+    logger.addHandler(warning_collector)
+    try:
+        render_list, alternative_list, alternative_phoneme_map = plan_articulation_from_oto(
+            oto_group_list, lang_tool, ignore_vcv, ManifestRecorder(None), normalize=normalize, refine=refine)
+    finally:
+        logger.removeHandler(warning_collector)
+
+    wav_files: dict[str, dict] = {}
+    segments: list[PlannedSegment] = []
+    for render_task in chain(render_list, alternative_list):
+        wav_info = render_task["wav_info"]
+        wav_file = path.abspath(wav_info.wav_file)
+        wav_files[wav_file] = wav_info_to_dict(wav_info)
+
+        wav_source_names = render_task["wav_source_names"]
+        for i, seg_info in enumerate(render_task["seg_info_list"]):
+            substitute = None
+            if wav_source_names is not None:
+                substitute = alternative_phoneme_map[" ".join(seg_info.art_seg.phonemes)]
+            segments.append(segment_to_dict(seg_info, get_segment_file_name(seg_info), wav_file,
+                                            get_segment_window(seg_info, get_output_rate(wav_info, normalize)), substitute,
+                                            wav_source_names[i] if wav_source_names is not None else None))
+
+    write_plan(plan_file, {
+        "plan_version": PLAN_VERSION,
+        "tool_version": TOOL_VERSION,
+        "oto_file": path.abspath(oto_file),
+        "settings": settings,
+        "wav_files": wav_files,
+        "segments": segments,
+        "missing": list(alternative_phoneme_map.keys()),
+        "alternatives": alternative_phoneme_map,
+        "warnings": warning_collector.messages,
+    })
+    logger.info("%d segments of %d wav files planned, %d warnings." % (len(segments), len(wav_files), len(warning_collector.messages)))
+
+def load_render_tasks(plan: SegmentPlan, recorder: ManifestRecorder) -> tuple[list[RenderTask], list[RenderTask]]:
+    """Groups the segments of a plan into render tasks of the oto segments and of the missing articulations.
+
+    Segments which are up to date in the manifest are left out, as are wav files whose sample rate
+    changed since the plan was written."""
+    render_list: list[RenderTask] = []
+    alternative_list: list[RenderTask] = []
+    wav_info_map: dict[str, Optional[WavInfo]] = {}
+
+    for segment in plan["segments"]:
+        wav_file = segment["wav_file"]
+        if wav_file not in wav_info_map:
+            wav_info = probe_wav(wav_file)
+            planned_info = wav_info_from_dict(wav_file, plan["wav_files"][wav_file])
+            if wav_info is None:
+                logger.warning(f"Could not find wav file {wav_file}, skip its segments.")
+            elif wav_info.framerate != planned_info.framerate:
+                logger.warning(f"Sample rate of {wav_file} changed since it was planned, skip its segments.")
+                wav_info = None
+            elif wav_info.size != planned_info.size or wav_info.mtime != planned_info.mtime:
+                logger.warning(f"{wav_file} changed since it was planned.")
+            wav_info_map[wav_file] = wav_info
+
+        wav_info = wav_info_map[wav_file]
+        if wav_info is None:
+            continue
+
+        seg_info = segment_from_dict(segment)
+        is_alternative = segment["substitute"] is not None
+        extra = " ".join(seg_info.art_seg.phonemes) if is_alternative else ""
+        if recorder.is_up_to_date(seg_info, wav_info, extra):
+            continue
+
+        task_list = alternative_list if is_alternative else render_list
+        if len(task_list) == 0 or task_list[-1]["wav_info"] is not wav_info:
+            task_list.append({"wav_info": wav_info, "seg_info_list": [], "wav_source_names": [] if is_alternative else None,
+                              "stationary_candidates": None})
+        task_list[-1]["seg_info_list"].append(seg_info)
+        if is_alternative:
+            task_list[-1]["wav_source_names"].append(segment["wav_source"])
+
+    return render_list, alternative_list
+
+def generate_articulation_from_plan(plan: SegmentPlan, lang_tool: BaseLanguageTool, output: Union[OutputWriter, str],
+                                    audio_cache: Optional[AudioCache] = None, jobs: int = 1,
+                                    build_manifest: Optional[BuildManifest] = None):
+    """Renders the segments of a plan written by write_segment_plan."""
+    if isinstance(output, str):
+        output = DirectoryOutput(output)
+
+    if audio_cache is None:
+        audio_cache = AudioCache(DEFAULT_AUDIO_CACHE_SIZE * 1024 * 1024)
+
+    recorder = ManifestRecorder(build_manifest)
+
+    profiler = get_profiler()
+    with profiler.stage("plan"):
+        render_list, alternative_list = load_render_tasks(plan, recorder)
+
+    executor = create_executor(jobs, lang_tool, audio_cache)
+    try:
+        with profiler.stage("render"):
+            render_wav_groups(render_list, output, audio_cache, lang_tool, executor, recorder.on_rendered)
+            render_wav_groups(alternative_list, output, audio_cache, lang_tool, executor, recorder.on_rendered)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    with profiler.stage("manifest"):
+        recorder.finish()
+
+STREAM_TASKS_PER_JOB = 4
+
+def get_entry_segment_names(entry_type: str, phonemes: Sequence[str], ignore_vcv: bool) -> list[str]:
+    """Returns the file names of the segments generate_articulation_segment_info plans for an oto entry."""
+    if entry_type == "rcv":
+        segments = [("rc", ("Sil", phonemes[0]))]
+        if not ignore_vcv:
+            segments.append(("rcv", ("Sil", phonemes[0], phonemes[1])))
+    elif entry_type == "vcv":
+        segments = [("vc", phonemes[0:2]), ("cv", phonemes[1:3])]
+        if not ignore_vcv:
+            segments.append(("vcv", phonemes[0:3]))
+    elif entry_type == "rv" or entry_type == "rc":
+        segments = [(entry_type, ("Sil", phonemes[0]))]
+    elif entry_type == "vr" or entry_type == "cr":
+        segments = [(entry_type, (phonemes[0], "Sil"))]
+    elif entry_type in ("vv", "cc", "cv", "vc"):
+        segments = [(entry_type, phonemes[0:2])]
+    else:
+        return []
+    return [art_type + "_" + "_".join(escape_xsampa(phoneme) for phoneme in seg_phonemes) for art_type, seg_phonemes in segments]
+
+def scan_segment_producers(oto_file: str, oto_encoding: str, lang_tool: BaseLanguageTool, ignore_vcv: bool) -> dict[str, int]:
+    """Maps each segment file name to the index of the last oto line producing it.
+
+    Only the aliases are parsed, no wav file is read. Lines which iter_oto_groups drops are left out,
+    their warnings are logged when the groups are read."""
+    oto_path = path.dirname(oto_file)
+    wav_exists: dict[str, bool] = {}
+    producers: dict[str, int] = {}
+    group_wav_file: Optional[str] = None
+    seen_wav_files: set[str] = set()
+    split_wav_files: set[str] = set()
+
+    with open(oto_file, "r", encoding=oto_encoding) as f:
+        for line_index, line in enumerate(f):
+            line = line.strip()
+            if line == "" or line.startswith("#") or line.startswith(";"):
+                continue
+
+            wav_file = line.split("=", 1)[0]
+            if wav_file != group_wav_file:
+                if wav_file in seen_wav_files:
+                    split_wav_files.add(wav_file)
+                seen_wav_files.add(wav_file)
+                group_wav_file = wav_file
+
+            try:
+                wav_file, oto_params = line.split("=")
+                alias, offset, consonant, cutoff, preutterance, overlap = oto_params.split(",")
+                for value in (offset, consonant, cutoff, preutterance, overlap):
+                    float(value)
+                oto_entry = OtoInfo()
+                oto_entry.alias = alias
+                entry_phoneme_info = lang_tool.get_oto_entry_phoneme_info(oto_entry)
+            except Exception:
+                continue
+
+            if wav_file not in wav_exists:
+                wav_exists[wav_file] = path.isfile(path.join(oto_path, wav_file))
+            if not wav_exists[wav_file]:
+                continue
+
+            for file_name in get_entry_segment_names(entry_phoneme_info.type, entry_phoneme_info.phoneme_list, ignore_vcv):
+                producers[file_name] = line_index
+
+    if len(split_wav_files) > 0:
+        # Without --stream all lines of a wav are planned together
+        logger.warning("Lines of %d wav files are not consecutive (%s), a segment planned by several of their groups "
+                       "may be cut from another line than without --stream." % (
+                           len(split_wav_files), ", ".join(sorted(split_wav_files)[:3])))
+    return producers
+
+def generate_articulation_from_oto_stream(oto_file: str, oto_encoding: str, lang_tool: BaseLanguageTool, ignore_vcv: bool,
+                                          output: Union[OutputWriter, str], audio_cache: Optional[AudioCache] = None, jobs: int = 1,
+                                          build_manifest: Optional[BuildManifest] = None, refine: bool = False,
+                                          stationary: bool = False):
+    """Plans and renders each wav group as soon as its lines are read from the oto.ini file.
+
+    Only the position of the segment behind each articulation and file name is kept, the groups
+    which provide alternatives are read and planned again once the missing articulations are known.
+    The stationaries are cut once all groups were rendered."""
+    if isinstance(output, str):
+        output = DirectoryOutput(output)
+
+    if audio_cache is None:
+        audio_cache = AudioCache(DEFAULT_AUDIO_CACHE_SIZE * 1024 * 1024)
+
+    recorder = ManifestRecorder(build_manifest)
+    selector = StationarySelector()
+
+    # Articulation / segment file name -> (group index, segment index) of the last segment providing it
+    art_index: dict[str, tuple[int, int]] = {}
+    render_index: dict[str, tuple[int, int]] = {}
+    # Segments left to a later group which writes the same file name
+    skipped_index: dict[str, tuple[int, int]] = {}
+
+    profiler = get_profiler()
+    executor = create_executor(jobs, lang_tool, audio_cache)
+
+    # Rendered groups in flight, consumed in submission order
+    pending: deque[tuple[Future, RenderTask, list[str]]] = deque()
+    pending_names: Counter[str] = Counter()
+    output_dir = output.output_dir if isinstance(output, DirectoryOutput) else None
+
+    # Without workers a group is rendered once the next one is planned, while the reader thread reads its wav
+    queued_output = QueuedOutput(output, WRITER_THREADS, WRITE_QUEUE_SIZE) if executor is None else None
+    next_task: Optional[tuple[RenderTask, list[str]]] = None
+
+    def add_stationary_regions(render_task: RenderTask, regions: list[StationaryRegion]):
+        if render_task["stationary_candidates"]:
+            recorder.on_stationary(render_task["wav_info"], regions)
+            selector.add(regions)
+
+    def record_written(rendered_files: dict[str, list[str]], file_names: list[str]):
+        recorder.on_rendered(rendered_files)
+        pending_names.subtract(file_names)
+
+    def render_next():
+        nonlocal next_task
+        if next_task is None:
+            return
+        render_task, file_names = next_task
+        rendered_files, stationary_regions = render_wav_group(render_task, queued_output, audio_cache, lang_tool)
+        queued_output.defer(record_written, rendered_files, file_names)
+        add_stationary_regions(render_task, stationary_regions)
+        next_task = None
+
+    def consume_oldest():
+        future, render_task, file_names = pending.popleft()
+        rendered_files, stationary_regions, operations, counters = future.result()
+        profiler.merge_counters(counters)
+        if operations is not None:
+            replay_operations(output, operations)
+        recorder.on_rendered(rendered_files)
+        add_stationary_regions(render_task, stationary_regions)
+        pending_names.subtract(file_names)
+
+    def wait_for(file_names: list[str]):
+        # A later segment with the same file name must be written after the earlier one
+        if executor is None:
+            if any(pending_names[name] > 0 for name in file_names):
+                render_next()
+                queued_output.flush()
+            return
+        while pending and (len(pending) >= jobs * STREAM_TASKS_PER_JOB or any(pending_names[name] > 0 for name in file_names)):
+            consume_oldest()
+
+    def submit(render_task: RenderTask, file_names: list[str]):
+        nonlocal next_task
+        if executor is None:
+            if _needs_audio(render_task):
+                audio_cache.prefetch(render_task["wav_info"].wav_file)
+            render_next()
+            next_task = (render_task, file_names)
+            pending_names.update(file_names)
+            return
+
+        pending.append((executor.submit(_render_wav_group_worker, render_task, output_dir), render_task, file_names))
+        pending_names.update(file_names)
+
+    def replan_groups(group_indices: Collection[int]) -> Iterator[tuple[int, WavInfo, list[SegmentInfo]]]:
+        for group_index, oto_list in enumerate(iter_oto_groups(oto_file, oto_encoding)):
+            if group_index not in group_indices:
+                continue
+
+            wav_info = oto_list[0].wav_info
+            # Not plan_wav_group, the group was already logged and counted in the first pass
+            refiner = get_segment_refiner(wav_info, lang_tool) if refine else None
+            yield group_index, wav_info, generate_articulation_segment_info(oto_list, lang_tool, ignore_vcv, wav_info.length,
+                                                                            get_output_rate(wav_info, audio_cache.normalize),
+                                                                            refiner)[0]
+
+    try:
+        with profiler.stage("read_oto"):
+            producers = scan_segment_producers(oto_file, oto_encoding, lang_tool, ignore_vcv)
+
+        oto_groups = profiler.iterate("read_oto", iter_oto_groups(oto_file, oto_encoding))
+        for group_index, oto_list in enumerate(oto_groups):
+            with profiler.stage("plan"):
+                wav_info = oto_list[0].wav_info
+                seg_info_list = plan_wav_group(oto_list, lang_tool, ignore_vcv, audio_cache.normalize, refine)
+                file_names = [get_segment_file_name(seg_info) for seg_info in seg_info_list]
+
+            with profiler.stage("render"):
+                wait_for(file_names)
+
+            with profiler.stage("plan"):
+                # The lines of a group are consecutive, a later line belongs to a later group
+                last_line_index = max(oto_info.index for oto_info in oto_list)
+                render_list: list[SegmentInfo] = []
+                render_names: list[str] = []
+                for seg_index, seg_info in enumerate(seg_info_list):
+                    file_name = file_names[seg_index]
+                    art_index[" ".join(seg_info.art_seg.phonemes)] = (group_index, seg_index)
+
+                    # The manifest only knows the last writer of a file, the earlier ones are not rendered
+                    if producers.get(file_name, -1) > last_line_index:
+                        skipped_index[file_name] = (group_index, seg_index)
+                        continue
+
+                    # The scan missed that an earlier group wrote this file in this run
+                    overwrites = file_name in render_index
+                    render_index[file_name] = (group_index, seg_index)
+
+                    if not recorder.is_up_to_date(seg_info, wav_info, force=overwrites):
+                        render_list.append(seg_info)
+                        render_names.append(file_name)
+
+                stationary_candidates = (recorder.get_stationary_candidates(oto_list, seg_info_list, selector) if stationary
+                                         else None)
+
+            if len(render_list) > 0 or stationary_candidates:
+                with profiler.stage("render"):
+                    submit({"wav_info": wav_info, "seg_info_list": render_list, "wav_source_names": None,
+                            "stationary_candidates": stationary_candidates}, render_names)
+
+        with profiler.stage("render"):
+            while pending:
+                consume_oldest()
+            if queued_output is not None:
+                render_next()
+                queued_output.flush()  # The alternatives may link the written wavs
+
+            # The group expected to write these files did not plan them, cut them from the last group which did
+            fallback_groups: dict[int, list[int]] = {}
+            for file_name, (group_index, seg_index) in skipped_index.items():
+                if file_name not in render_index:
+                    render_index[file_name] = (group_index, seg_index)
+                    fallback_groups.setdefault(group_index, []).append(seg_index)
+
+            fallback_list: list[RenderTask] = []
+            if len(fallback_groups) > 0:
+                for group_index, wav_info, seg_info_list in replan_groups(fallback_groups):
+                    render_list = [seg_info_list[seg_index] for seg_index in fallback_groups[group_index]
+                                   if not recorder.is_up_to_date(seg_info_list[seg_index], wav_info)]
+                    if len(render_list) > 0:
+                        fallback_list.append({"wav_info": wav_info, "seg_info_list": render_list, "wav_source_names": None,
+                                              "stationary_candidates": None})
+            render_wav_groups(fallback_list, output, audio_cache, lang_tool, executor, recorder.on_rendered)
+
+        with profiler.stage("alternatives"):
+            missing_phoneme_list = lang_tool.get_missing_list(art_index.keys())
+
+            logger.info("Missing Articulations: " + ", ".join(missing_phoneme_list))
+
+            alternative_phoneme_map = lang_tool.resolve_alternatives(missing_phoneme_list, art_index.keys())
+
+            # Plan the groups of the substitutes again
+            source_groups: dict[int, list[str]] = {}
+            for alt_phoneme in set(alternative_phoneme_map.values()):
+                if alt_phoneme:
+                    source_groups.setdefault(art_index[alt_phoneme][0], []).append(alt_phoneme)
+
+            art_map: dict[str, ArticulationMapItem] = {}
+            wav_info_map: dict[str, WavInfo] = {}
+            rendered_segments: dict[str, SegmentInfo] = {}
+            if len(source_groups) > 0:
+                for group_index, wav_info, seg_info_list in replan_groups(source_groups):
+                    wav_info_map[wav_info.wav_file] = wav_info
+                    for alt_phoneme in source_groups[group_index]:
+                        seg_index = art_index[alt_phoneme][1]
+                        seg_info = seg_info_list[seg_index]
+                        art_map[alt_phoneme] = {"seg_info": seg_info, "wav_file": wav_info.wav_file}
+
+                        file_name = get_segment_file_name(seg_info)
+                        if render_index.get(file_name) == (group_index, seg_index):
+                            rendered_segments[file_name] = seg_info
+
+            alternative_list = plan_alternative_tasks(alternative_phoneme_map, art_map, wav_info_map, rendered_segments, recorder)
+
+        with profiler.stage("render"):
+            render_wav_groups(alternative_list, output, audio_cache, lang_tool, executor, recorder.on_rendered)
+
+        if stationary:
+            with profiler.stage("stationary"):
+                stationary_list = plan_stationary_tasks(selector, lang_tool, recorder, audio_cache.normalize)
+                render_wav_groups(stationary_list, output, audio_cache, lang_tool, executor, recorder.on_rendered)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if queued_output is not None:
+            queued_output.finish()
+
+    with profiler.stage("manifest"):
+        recorder.finish()
+
+    if executor is None:
+        logger.debug("Audio cache: %d hits, %d misses" % (audio_cache.hits, audio_cache.misses))
+
+def qc_wav_group(oto_list: list[OtoInfo], lang_tool: BaseLanguageTool, min_length: float) -> list[QcIssue]:
+    """Checks the oto entries of a wav, their planned segments and the recording behind them."""
+    wav_info = oto_list[0].wav_info
+    issues = check_oto_params(oto_list, wav_info)
+
+    entry_infos: list[Optional[OtoEntryPhonemeInfo]] = []
+    for oto_item in oto_list:
+        try:
+            entry_infos.append(lang_tool.get_oto_entry_phoneme_info(oto_item))
+        except WarningException as e:
+            entry_infos.append(None)
+            issues.append(make_issue("error", "alias", 0, oto_item, str(e)))
+
+    seg_info_list = generate_articulation_segment_info(oto_list, lang_tool, False, wav_info.length, wav_info.framerate)[0]
+    windows = [get_segment_window(seg_info, wav_info.framerate) for seg_info in seg_info_list]
+    issues.extend(check_segments(seg_info_list, {oto_item.line: oto_item for oto_item in oto_list}, windows, wav_info, min_length))
+
+    try:
+        features = get_wav_features(wav_info)
+    except (WarningException, OSError) as e:
+        issue = make_issue("error", "unreadable", 0, oto_list[0], str(e))
+        issue["alias"] = ""
+        issues.append(issue)
+    else:
+        issues.extend(check_audio(oto_list, entry_infos, lang_tool, features))
+
+    get_profiler().count("oto_entries", len(oto_list))
+    return issues
+
+def _qc_wav_group_worker(oto_list: list[OtoInfo], min_length: float) -> tuple[list[QcIssue], dict[str, int]]:
+    return qc_wav_group(oto_list, _worker_lang_tool, min_length), get_profiler().pop_counters()
+
+def find_oto_files(paths: list[str]) -> list[str]:
+    """Returns the given oto.ini files and every oto.ini below the given dirs."""
+    oto_files: list[str] = []
+    for oto_path in paths:
+        if not path.isdir(oto_path):
+            oto_files.append(oto_path)
+            continue
+
+        for dir_path, dir_names, file_names in os.walk(oto_path):
+            dir_names.sort()
+            oto_files.extend(path.join(dir_path, file_name) for file_name in sorted(file_names) if file_name.lower() == "oto.ini")
+
+    return oto_files
+
+def run_qc(argv: list[str]):
+    """oto2seg.py qc: checks every entry of one or more oto.ini files and writes a csv report."""
+    arg_parser = ArgumentParser(prog="oto2seg.py qc", formatter_class=SmartFormatter,
+                                description="Check oto entries and recordings for problems, without writing segments.")
+
+    arg_parser.add_argument("oto_files", help="oto.ini files, or voicebank dirs to check every oto.ini below them", nargs="+")
+    arg_parser.add_argument("-o", "--report", help="csv report file. default: oto2seg_qc.csv", default=DEFAULT_QC_REPORT)
+
+    arg_parser.add_argument("--oto-encoding", help="oto.ini encoding. default: shift-jis (also ASCII)", default="shift-jis")
+    arg_parser.add_argument("--parser", help="R|oto parser for different languages. default: jpn_common. available parsers:\n"
+                            "    " + "\n    ".join(get_lang_list()), default="jpn_common")
+    arg_parser.add_argument("--min-length", help="shortest phoneme span in ms. default: %d" % DEFAULT_MIN_LENGTH, type=float,
+                            default=DEFAULT_MIN_LENGTH)
+    arg_parser.add_argument("--sort", help="order of the report. default: severity", choices=QC_SORT_KEYS, default="severity")
+    arg_parser.add_argument("--feature-cache", help="read and keep the wav features in this dir, a checked bank is checked again "
+                            "in seconds", default=None, metavar="DIR")
+    arg_parser.add_argument("-j", "--jobs", help="number of worker processes used to analyze wav files. default: 1", type=int,
+                            default=1)
+
+    args = arg_parser.parse_args(argv)
+
+    if import_numpy() is None:
+        arg_parser.error("qc needs NumPy")
+    if args.feature_cache is not None:
+        set_feature_cache(FeatureCache(args.feature_cache))
+
+    lang_tool = get_lang_tool(args.parser)
+    oto_group_list: list[list[OtoInfo]] = []
+    issues: list[QcIssue] = []
+
+    # Lines which read_oto skips are reported too
+    warning_collector = WarningCollector()
+    logger.addHandler(warning_collector)
+    try:
+        for oto_file in find_oto_files(args.oto_files):
+            oto_dict = read_oto(oto_file, encoding=args.oto_encoding)
+            oto_group_list.extend(oto_list for oto_list in oto_dict.values() if len(oto_list) > 0)
+    finally:
+        logger.removeHandler(warning_collector)
+    for message in warning_collector.messages:
+        issues.append(make_issue("error", "parse", 0, None, message))
+
+    executor = create_executor(args.jobs, lang_tool, AudioCache(0))
+    try:
+        if executor is not None:
+            for group_issues, counters in executor.map(_qc_wav_group_worker, oto_group_list, repeat(args.min_length)):
+                issues.extend(group_issues)
+                get_profiler().merge_counters(counters)
+        else:
+            for oto_list in oto_group_list:
+                issues.extend(qc_wav_group(oto_list, lang_tool, args.min_length))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    write_qc_report(args.report, sort_issues(issues, args.sort))
+    logger.info("QC:\n" + format_qc_summary(issues, sum(len(oto_list) for oto_list in oto_group_list)))
+    logger.info("QC report written to %s" % args.report)
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "qc":
+        run_qc(sys.argv[2:])
+        sys.exit(0)
+
     arg_parser = ArgumentParser(formatter_class=SmartFormatter)
 
-    arg_parser.add_argument("oto_file", help="oto.ini file")
-    arg_parser.add_argument("output_dir", help="output articulation dir")
+    arg_parser.add_argument("oto_file", help="oto.ini file, or the plan file with --render-plan")
+    arg_parser.add_argument("output_dir", help="output articulation dir, the zip file with --output-archive, "
+                            "or the plan file with --plan-only")
 
     arg_parser.add_argument("--oto-encoding", help="oto.ini encoding. default: shift-jis (also ASCII)", default="shift-jis")
     arg_parser.add_argument("--parser", help="R|oto parser for different languages. default: jpn_common. available parsers:\n"
                             "    " + "\n    ".join(get_lang_list()), default="jpn_common")
     
     arg_parser.add_argument("--ignore-vcv", help="do not generate VCV segments", default=False, action="store_true")
+    arg_parser.add_argument("--audio-cache-size", help="memory limit of decoded wav cache in MiB. default: %d" % DEFAULT_AUDIO_CACHE_SIZE,
+                            type=int, default=DEFAULT_AUDIO_CACHE_SIZE)
+    arg_parser.add_argument("--full-rebuild", help="generate every segment, even if its inputs did not change since the last run",
+                            default=False, action="store_true")
+    arg_parser.add_argument("--output-archive", help="write every file into one uncompressed zip archive instead of the output dir, "
+                            "use extract_archive.py to unpack it", default=False, action="store_true")
+    arg_parser.add_argument("--stream", help="render each wav file as soon as its oto lines are read, "
+                            "keeps the memory usage flat for large banks", default=False, action="store_true")
+    arg_parser.add_argument("--normalize", help="convert the segments to 44.1 kHz 16-bit mono as DBTool expects, "
+                            "needs NumPy", default=False, action="store_true")
+    arg_parser.add_argument("--refine", help="move consonant centers, plosive bursts and silence edges to the nearest "
+                            "acoustic event of the wav, needs NumPy", default=False, action="store_true")
+    arg_parser.add_argument("--stationary", help="also cut a stationary of each vowel and syllabic nasal from the steadiest "
+                            "C-V, V-V or R-V region of the bank, needs NumPy", default=False, action="store_true")
+    arg_parser.add_argument("--feature-cache", help="keep the wav features of --refine in this dir, they are reused "
+                            "while the wav files do not change. prune it with feature_cache.py", default=None, metavar="DIR")
+    arg_parser.add_argument("--plan-only", help="only plan the segments without reading any audio (except with --refine), "
+                            "and write the plan as json to output_dir", default=False, action="store_true")
+    arg_parser.add_argument("--render-plan", help="render the segments of a plan written by --plan-only, "
+                            "oto_file is the plan file", default=False, action="store_true")
+    arg_parser.add_argument("-j", "--jobs", help="number of worker processes used to render wav files. default: 1", type=int, default=1)
+    arg_parser.add_argument("--profile", help="log the time and peak memory of each stage and write a json report. "
+                            "default report: %s" % DEFAULT_PROFILE_REPORT, nargs="?", const=DEFAULT_PROFILE_REPORT, default=None,
+                            metavar="REPORT")
+    arg_parser.add_argument("--cprofile-stage", help="also run cProfile on one stage of the main process "
+                            "(read_oto, plan, render, alternatives, stationary, manifest), the stats are written next to the report",
+                            default=None, metavar="STAGE")
 
     args = arg_parser.parse_args()
 
@@ -458,11 +1348,106 @@ if __name__ == "__main__":
     oto_encoding: str = args.oto_encoding
 
     ignore_vcv: bool = args.ignore_vcv
-    
+    audio_cache_size: int = args.audio_cache_size
+    jobs: int = args.jobs
+    full_rebuild: bool = args.full_rebuild
+    normalize: bool = args.normalize
+    refine: bool = args.refine
+    stationary: bool = args.stationary
+    output_archive: bool = args.output_archive
+    stream: bool = args.stream
+    plan_only: bool = args.plan_only
+    render_plan: bool = args.render_plan
+    profile_report: Optional[str] = args.profile
+    cprofile_stage: Optional[str] = args.cprofile_stage
+
+    if stationary and (plan_only or render_plan):
+        arg_parser.error("--stationary analyzes the audio while rendering, it cannot be combined with --plan-only or --render-plan")
+
+    if cprofile_stage is not None and profile_report is None:
+        profile_report = DEFAULT_PROFILE_REPORT
+    if profile_report is not None:
+        set_profiler(RunProfiler(cprofile_stage))
+    profiler = get_profiler()
+
+    if args.feature_cache is not None:
+        set_feature_cache(FeatureCache(args.feature_cache))
+
+    plan = None
+    if render_plan:
+        # The plan keeps the settings it was made with
+        plan = read_plan(oto_file)
+        parser_id = plan["settings"]["parser"]
+        ignore_vcv = plan["settings"]["ignore_vcv"]
+        normalize = plan["settings"].get("normalize", False)
+        refine = bool(plan["settings"].get("refine", False))
+        stream = False
+    elif plan_only:
+        stream = False  # Alternatives are planned from the whole oto.ini
+
     lang_tool = get_lang_tool(parser_id)
-    oto_dict = read_oto(oto_file, encoding=oto_encoding)
+    # The plan also lists the lines which read_oto skips
+    read_warning_collector = WarningCollector()
+    if plan_only:
+        logger.addHandler(read_warning_collector)
+    try:
+        with profiler.stage("read_oto"):
+            oto_dict = read_oto(oto_file, encoding=oto_encoding) if not stream and plan is None else None
+    finally:
+        logger.removeHandler(read_warning_collector)
+
+    audio_cache = AudioCache(audio_cache_size * 1024 * 1024, normalize)
+
+    settings = {"parser": parser_id, "ignore_vcv": ignore_vcv}
+    if normalize:
+        settings["normalize"] = True
+    if refine:
+        # Refined boundaries change with the features and the search, the segments are rendered again when they do
+        settings["refine"] = plan["settings"]["refine"] if plan is not None else REFINE_PARAMS
+
+    def generate(output: Union[OutputWriter, str], build_manifest: Optional[BuildManifest] = None):
+        if plan is not None:
+            generate_articulation_from_plan(plan, lang_tool, output, audio_cache, jobs, build_manifest)
+        elif stream:
+            generate_articulation_from_oto_stream(oto_file, oto_encoding, lang_tool, ignore_vcv, output, audio_cache, jobs,
+                                                  build_manifest, refine, stationary)
+        else:
+            generate_articulation_from_oto(oto_dict, lang_tool, ignore_vcv, output, audio_cache, jobs, build_manifest,
+                                           refine=refine, stationary=stationary)
+
+    if plan_only:
+        plan_dir = path.dirname(path.abspath(output_dir))
+        if not path.exists(plan_dir):
+            os.makedirs(plan_dir)
+
+        write_segment_plan(output_dir, oto_dict, oto_file, settings, lang_tool, ignore_vcv, normalize, refine,
+                           read_warning_collector.messages)
+    elif output_archive:
+        # The archive is written from scratch, there is no manifest to compare with
+        archive_dir = path.dirname(path.abspath(output_dir))
+        if not path.exists(archive_dir):
+            os.makedirs(archive_dir)
+
+        output = ArchiveOutput(output_dir)
+        try:
+            generate(output)
+        finally:
+            output.close()
+    else:
+        if not path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        build_manifest = BuildManifest(output_dir, settings, force=full_rebuild)
+
+        generate(output_dir, build_manifest)
 
-    if not path.exists(output_dir):
-        os.makedirs(output_dir)
+    if profiler.enabled:
+        report = profiler.get_report()
+        logger.info("Profile:\n" + profiler.format_summary(report))
+        profiler.write_report(profile_report, report)
+        logger.info("Profile report written to %s" % profile_report)
 
-    generate_articulation_from_oto(oto_dict, lang_tool, ignore_vcv, output_dir)
\ No newline at end of file
+        if cprofile_stage is not None:
+            cprofile_file = "%s.%s.prof" % (path.splitext(profile_report)[0], cprofile_stage)
+            profiler.dump_cprofile(cprofile_file)
+            logger.info("cProfile stats of %s written to %s" % (cprofile_stage, cprofile_file))
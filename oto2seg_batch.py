@@ -0,0 +1,170 @@
+from __future__ import annotations
+from argparse import ArgumentParser
+import os
+from os import path
+from typing import Optional, TypedDict
+
+from audio import AudioCache
+from feature_cache import FeatureCache, set_feature_cache
+from functions import BaseLanguageTool, SmartFormatter, WarningException, logger, read_oto
+from manifest import BuildManifest
+from oto2seg import DEFAULT_AUDIO_CACHE_SIZE, create_executor, generate_articulation_from_oto, get_lang_list, get_lang_tool
+from refine import REFINE_PARAMS
+
+OTO_FILE_NAME = "oto.ini"
+
+
+class VoicebankJob(TypedDict):
+    name: str
+    oto_file: str
+    output_dir: str
+
+
+class CoverageSummary(TypedDict):
+    name: str
+    oto_entries: int
+    articulations: int  # Articulations in the inventory of the language tool
+    covered: int
+    substituted: int
+    unresolved: list[str]
+    error: Optional[str]
+
+
+def find_voicebanks(root_dir: str, output_root: str) -> list[VoicebankJob]:
+    """Finds every oto.ini below root_dir, each one is written to the same relative dir below output_root."""
+    job_list: list[VoicebankJob] = []
+    for dir_path, dir_names, file_names in os.walk(root_dir):
+        dir_names.sort()
+        for file_name in file_names:
+            if file_name.lower() == OTO_FILE_NAME:
+                rel_dir = path.relpath(dir_path, root_dir)
+                job_list.append({
+                    "name": rel_dir if rel_dir != "." else path.basename(path.abspath(root_dir)),
+                    "oto_file": path.join(dir_path, file_name),
+                    "output_dir": path.normpath(path.join(output_root, rel_dir)),
+                })
+
+    return job_list
+
+
+def convert_voicebank(job: VoicebankJob, lang_tool: BaseLanguageTool, settings: dict, oto_encoding: str, ignore_vcv: bool,
+                      audio_cache: AudioCache, executor, full_rebuild: bool = False, refine: bool = False,
+                      stationary: bool = False) -> CoverageSummary:
+    summary: CoverageSummary = {
+        "name": job["name"],
+        "oto_entries": 0,
+        "articulations": len(lang_tool.cvvc_list),
+        "covered": 0,
+        "substituted": 0,
+        "unresolved": [],
+        "error": None,
+    }
+
+    try:
+        oto_dict = read_oto(job["oto_file"], encoding=oto_encoding)
+        summary["oto_entries"] = sum(len(oto_list) for oto_list in oto_dict.values())
+
+        if not path.exists(job["output_dir"]):
+            os.makedirs(job["output_dir"])
+        build_manifest = BuildManifest(job["output_dir"], settings, force=full_rebuild)
+
+        alternative_phoneme_map = generate_articulation_from_oto(oto_dict, lang_tool, ignore_vcv, job["output_dir"], audio_cache,
+                                                                 build_manifest=build_manifest, executor=executor, refine=refine,
+                                                                 stationary=stationary)
+    except (WarningException, OSError, UnicodeDecodeError) as e:
+        logger.error(f"Failed to convert {job['oto_file']}: {e}")
+        summary["error"] = str(e)
+        return summary
+
+    summary["covered"] = summary["articulations"] - len(alternative_phoneme_map)
+    summary["substituted"] = sum(1 for alt_phoneme in alternative_phoneme_map.values() if alt_phoneme)
+    summary["unresolved"] = [missing for missing, alt_phoneme in alternative_phoneme_map.items() if not alt_phoneme]
+
+    return summary
+
+
+def format_coverage_summary(summary_list: list[CoverageSummary]) -> str:
+    name_width = max([len("voicebank")] + [len(summary["name"]) for summary in summary_list])
+    lines = ["%-*s %8s %9s %9s %11s %10s" % (name_width, "voicebank", "entries", "covered", "coverage", "substituted", "unresolved")]
+    for summary in summary_list:
+        if summary["error"] is not None:
+            lines.append("%-*s failed: %s" % (name_width, summary["name"], summary["error"]))
+            continue
+        lines.append("%-*s %8d %9d %8.1f%% %11d %10d" % (
+            name_width, summary["name"], summary["oto_entries"], summary["covered"],
+            summary["covered"] / summary["articulations"] * 100 if summary["articulations"] > 0 else 0.0,
+            summary["substituted"], len(summary["unresolved"])))
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(formatter_class=SmartFormatter,
+                                description="Convert every oto.ini of a voicebank with several pitch folders in one process.")
+
+    arg_parser.add_argument("root_dir", help="voicebank dir, every oto.ini below it is converted", nargs="?", default=None)
+    arg_parser.add_argument("-o", "--output-root", help="output dir of root_dir, each pitch is written to the same relative dir")
+    arg_parser.add_argument("--pair", help="convert this oto.ini to this output dir, can be given several times", nargs=2,
+                            action="append", default=[], metavar=("OTO_FILE", "OUTPUT_DIR"))
+
+    arg_parser.add_argument("--oto-encoding", help="oto.ini encoding. default: shift-jis (also ASCII)", default="shift-jis")
+    arg_parser.add_argument("--parser", help="R|oto parser for different languages. default: jpn_common. available parsers:\n"
+                            "    " + "\n    ".join(get_lang_list()), default="jpn_common")
+    arg_parser.add_argument("--ignore-vcv", help="do not generate VCV segments", default=False, action="store_true")
+    arg_parser.add_argument("--audio-cache-size", help="memory limit of decoded wav cache in MiB. default: %d" % DEFAULT_AUDIO_CACHE_SIZE,
+                            type=int, default=DEFAULT_AUDIO_CACHE_SIZE)
+    arg_parser.add_argument("--normalize", help="convert the segments to 44.1 kHz 16-bit mono as DBTool expects, needs NumPy",
+                            default=False, action="store_true")
+    arg_parser.add_argument("--refine", help="move consonant centers, plosive bursts and silence edges to the nearest "
+                            "acoustic event of the wav, needs NumPy", default=False, action="store_true")
+    arg_parser.add_argument("--stationary", help="also cut a stationary of each vowel and syllabic nasal of each voicebank, "
+                            "needs NumPy", default=False, action="store_true")
+    arg_parser.add_argument("--feature-cache", help="keep the wav features of --refine in this dir, shared by all voicebanks",
+                            default=None, metavar="DIR")
+    arg_parser.add_argument("--full-rebuild", help="generate every segment, even if its inputs did not change since the last run",
+                            default=False, action="store_true")
+    arg_parser.add_argument("-j", "--jobs", help="number of worker processes shared by all voicebanks. default: 1", type=int, default=1)
+
+    args = arg_parser.parse_args()
+
+    if args.root_dir is None and len(args.pair) == 0:
+        arg_parser.error("give a root_dir or at least one --pair")
+    if args.root_dir is not None and args.output_root is None:
+        arg_parser.error("root_dir needs --output-root")
+
+    parser_id: str = args.parser
+    oto_encoding: str = args.oto_encoding
+    ignore_vcv: bool = args.ignore_vcv
+    jobs: int = args.jobs
+
+    job_list: list[VoicebankJob] = []
+    if args.root_dir is not None:
+        job_list.extend(find_voicebanks(args.root_dir, args.output_root))
+    for oto_file, output_dir in args.pair:
+        job_list.append({"name": path.basename(path.dirname(path.abspath(oto_file))), "oto_file": oto_file, "output_dir": output_dir})
+
+    logger.info("%d voicebanks found." % len(job_list))
+
+    # One language tool and one pool for all voicebanks, the workers are only started once
+    lang_tool = get_lang_tool(parser_id)
+    if args.feature_cache is not None:
+        set_feature_cache(FeatureCache(args.feature_cache))
+    audio_cache = AudioCache(args.audio_cache_size * 1024 * 1024, args.normalize)
+    settings = {"parser": parser_id, "ignore_vcv": ignore_vcv}
+    if args.normalize:
+        settings["normalize"] = True
+    if args.refine:
+        settings["refine"] = REFINE_PARAMS
+
+    summary_list: list[CoverageSummary] = []
+    executor = create_executor(jobs, lang_tool, audio_cache)
+    try:
+        for job in job_list:
+            logger.info(f"Converting {job['oto_file']} to {job['output_dir']}...")
+            summary_list.append(convert_voicebank(job, lang_tool, settings, oto_encoding, ignore_vcv, audio_cache, executor,
+                                                  args.full_rebuild, args.refine, args.stationary))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    logger.info("Coverage:\n" + format_coverage_summary(summary_list))
@@ -0,0 +1,255 @@
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import io
+import json
+import os
+from os import path
+import shutil
+import threading
+from typing import Callable, Optional, Union
+import zipfile
+import zlib
+
+from audio import WavData, write_wav, write_wav_to
+from functions import link_or_copy_file, logger
+from profiler import get_profiler
+
+ARCHIVE_INDEX_NAME = "index.json"
+
+
+class OutputWriter:
+    """Destination of the generated segment files."""
+    thread_safe = False  # Files may be written by several threads at once
+
+    def write_text(self, name: str, content: str):
+        raise NotImplementedError()
+
+    def write_wav(self, name: str, wav_data: WavData, frames):
+        raise NotImplementedError()
+
+    def link_file(self, src_name: str, dst_name: str):
+        """Writes dst_name with the content of the already written src_name."""
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def count_written(self, n_bytes: int):
+        profiler = get_profiler()
+        profiler.count("files_written")
+        profiler.count("bytes_written", n_bytes)
+
+
+class DirectoryOutput(OutputWriter):
+    thread_safe = True
+
+    def __init__(self, output_dir: str) -> None:
+        self.output_dir = output_dir
+
+    def write_text(self, name: str, content: str):
+        with open(path.join(self.output_dir, name), "w", encoding="utf-8") as f:
+            f.write(content)
+            self.count_written(f.tell())
+
+    def write_wav(self, name: str, wav_data: WavData, frames):
+        self.count_written(write_wav(path.join(self.output_dir, name), wav_data, frames))
+
+    def link_file(self, src_name: str, dst_name: str):
+        method = link_or_copy_file(path.join(self.output_dir, src_name), path.join(self.output_dir, dst_name))
+        get_profiler().count("files_" + method)
+
+
+class MemoryOutput(OutputWriter):
+    """Collects the written files of a worker process, to be replayed into the archive by the main process."""
+
+    def __init__(self) -> None:
+        self.operations: list[tuple[str, str, Union[bytes, str]]] = []
+
+    def write_text(self, name: str, content: str):
+        self.operations.append(("text", name, content))
+
+    def write_wav(self, name: str, wav_data: WavData, frames):
+        with io.BytesIO() as f:
+            write_wav_to(f, wav_data, frames)
+            self.operations.append(("data", name, f.getvalue()))
+
+    def link_file(self, src_name: str, dst_name: str):
+        self.operations.append(("link", dst_name, src_name))
+
+
+def replay_operations(output: ArchiveOutput, operations: list[tuple[str, str, Union[bytes, str]]]):
+    """Writes the operations collected by a MemoryOutput."""
+    for operation, name, value in operations:
+        if operation == "text":
+            output.write_text(name, value)
+        elif operation == "data":
+            output.write_data(name, value)
+        else:
+            output.link_file(value, name)
+
+
+class ArchiveOutput(OutputWriter):
+    """Streams every generated file into one uncompressed zip archive.
+
+    The archive ends with index.json, which lists the members of each segment."""
+
+    def __init__(self, archive_file: str) -> None:
+        self.archive_file = archive_file
+        self.zip_file = zipfile.ZipFile(archive_file, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+        self.index: dict[str, list[str]] = {}
+
+    def _add_to_index(self, name: str):
+        segment_name = path.splitext(name)[0]
+        if segment_name not in self.index:
+            self.index[segment_name] = []
+        self.index[segment_name].append(name)
+
+    def write_text(self, name: str, content: str):
+        # Same line endings as a file written in text mode
+        self.write_data(name, content.replace("\n", os.linesep).encode("utf-8"))
+
+    def write_data(self, name: str, data: bytes):
+        self.zip_file.writestr(name, data)
+        self._add_to_index(name)
+        self.count_written(len(data))
+
+    def write_wav(self, name: str, wav_data: WavData, frames):
+        with self.zip_file.open(name, "w", force_zip64=True) as f:
+            self.count_written(write_wav_to(f, wav_data, frames))
+        self._add_to_index(name)
+
+    def link_file(self, src_name: str, dst_name: str):
+        # Zip has no links, the member is read back and stored again
+        self.write_data(dst_name, self.zip_file.read(src_name))
+
+    def close(self):
+        self.zip_file.writestr(ARCHIVE_INDEX_NAME, json.dumps(self.index, ensure_ascii=False))
+        self.zip_file.close()
+
+
+class QueuedOutput(OutputWriter):
+    """Writes the files of another OutputWriter in writer threads, so the next segments are cut while the disk is busy.
+
+    At most max_pending writes are queued, a further write blocks until one is done. Writes of the same file
+    keep their order and a link waits for its source. A callback given to defer runs in the calling thread
+    once every write issued before it is done."""
+
+    def __init__(self, output: OutputWriter, threads: int, max_pending: int) -> None:
+        self.output = output
+        self.executor = ThreadPoolExecutor(max_workers=threads if output.thread_safe else 1, thread_name_prefix="oto2seg-writer")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.last_writes: dict[str, Future] = {}
+        self.unconfirmed: list[Future] = []  # Writes issued since the last defer
+        self.deferred: deque[tuple[list[Future], Callable, tuple]] = deque()
+
+    @staticmethod
+    def _run(wait_for: list[Future], function: Callable, args: tuple):
+        for future in wait_for:
+            future.result()  # Earlier writes were submitted first, so they are running or done
+        function(*args)
+
+    def _submit(self, name: str, function: Callable, args: tuple, source_name: Optional[str] = None):
+        self.slots.acquire()
+        wait_for = [self.last_writes[key] for key in (name, source_name) if key in self.last_writes]
+        future = self.executor.submit(self._run, wait_for, function, args)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.last_writes[name] = future
+        self.unconfirmed.append(future)
+        self.run_deferred()
+
+    def write_text(self, name: str, content: str):
+        self._submit(name, self.output.write_text, (name, content))
+
+    def write_wav(self, name: str, wav_data: WavData, frames):
+        self._submit(name, self.output.write_wav, (name, wav_data, frames))
+
+    def link_file(self, src_name: str, dst_name: str):
+        self._submit(dst_name, self.output.link_file, (src_name, dst_name), src_name)
+
+    def defer(self, callback: Callable, *args):
+        self.deferred.append((self.unconfirmed, callback, args))
+        self.unconfirmed = []
+        self.run_deferred()
+
+    def run_deferred(self, wait: bool = False):
+        """Runs the deferred callbacks whose writes are done, in the order they were deferred.
+
+        A failed write is raised here and its callback is dropped."""
+        while self.deferred:
+            futures, callback, args = self.deferred[0]
+            if not wait and not all(future.done() for future in futures):
+                return
+            self.deferred.popleft()
+            for future in futures:
+                future.result()
+            callback(*args)
+
+    def flush(self):
+        """Waits for every queued write and runs the remaining callbacks."""
+        self.run_deferred(wait=True)
+        for future in self.unconfirmed:
+            future.result()
+        self.unconfirmed = []
+        self.last_writes.clear()
+
+    def finish(self):
+        """Flushes and stops the writer threads, the wrapped output is left open for its owner."""
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown()
+
+
+def _is_same_file(zip_info: zipfile.ZipInfo, dest_file: str) -> bool:
+    if not path.isfile(dest_file) or path.getsize(dest_file) != zip_info.file_size:
+        return False
+
+    crc = 0
+    with open(dest_file, "rb") as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+
+    return crc == zip_info.CRC
+
+
+def extract_archive(archive_file: str, dest_dir: str, segment_names: list[str] = None) -> tuple[int, int]:
+    """Extracts the members of an output archive which differ from the files in dest_dir.
+
+    If segment_names is given, only these segments are looked up in the index and extracted.
+    Returns the number of extracted and unchanged files."""
+    extracted = 0
+    unchanged = 0
+
+    if not path.exists(dest_dir):
+        os.makedirs(dest_dir)
+
+    with zipfile.ZipFile(archive_file, "r") as zip_file:
+        if segment_names is not None:
+            index: dict[str, list[str]] = json.loads(zip_file.read(ARCHIVE_INDEX_NAME))
+            member_names = []
+            for segment_name in segment_names:
+                if segment_name not in index:
+                    logger.warning(f"Segment {segment_name} is not in {archive_file}, skip it.")
+                    continue
+                member_names.extend(index[segment_name])
+        else:
+            member_names = [name for name in zip_file.namelist() if name != ARCHIVE_INDEX_NAME]
+
+        for name in member_names:
+            zip_info = zip_file.getinfo(name)
+            dest_file = path.join(dest_dir, name)
+            if _is_same_file(zip_info, dest_file):
+                unchanged += 1
+                continue
+
+            if path.lexists(dest_file):
+                os.remove(dest_file)  # Might be a hardlink to another segment
+            with zip_file.open(zip_info, "r") as src, open(dest_file, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            extracted += 1
+
+    return extracted, unchanged
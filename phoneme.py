@@ -25,6 +25,8 @@ consonant_list = ["n", "N", "N'", "J", "m", "m'", "p\\", "p\\'", "s", "S", "h",
 unvoiced_consonant_list = ["p\\", "p\\'", "s", "S", "h", "C", "tS", "p", "p'", "t", "t'", "k", "k'"]
 plosive_consonant_list = ["p", "p'", "t", "t'", "k", "k'", "b", "b'", "d", "d'", "g", "g'"]
 
+unvoiced_marker_set = frozenset(["Sil", "Asp", "?"])  # Unvoiced symbols which are not consonants of a language
+
 vc_list = []
 for vowel in vowel_list:
     for consonant in consonant_list:
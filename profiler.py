@@ -0,0 +1,235 @@
+from __future__ import annotations
+from collections import Counter
+from contextlib import contextmanager
+import cProfile
+import json
+import sys
+import threading
+import time
+from typing import Iterable, Iterator, Optional, TypedDict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from functions import TOOL_VERSION
+
+
+class StageStats(TypedDict):
+    seconds: float
+    calls: int
+    peak_rss: Optional[int]  # Peak RSS of the process in bytes while the stage ran, None where it cannot be reset
+
+
+def get_peak_rss(who: int = 0) -> Optional[int]:
+    """Returns the peak RSS in bytes of this process, or of its largest finished child process with who=1."""
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if who == 1 else resource.RUSAGE_SELF)
+    if sys.platform == "darwin":
+        return usage.ru_maxrss
+    return usage.ru_maxrss * 1024
+
+
+def reset_peak_rss() -> bool:
+    """Resets the peak RSS of this process to its current RSS, returns False where this is not supported (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss_since_reset() -> Optional[int]:
+    """Returns the peak RSS in bytes of this process since the last reset_peak_rss call."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class RunProfiler:
+    """Times the pipeline stages and collects counters of a run.
+
+    Stages can be entered many times, their times add up. Worker processes have their own
+    profiler, their counters are sent back with each result and merged by the main process.
+    Counters may also be counted by the reader and writer threads."""
+    enabled = True
+
+    def __init__(self, cprofile_stage: Optional[str] = None) -> None:
+        self.stages: dict[str, StageStats] = {}
+        self.counters: Counter[str] = Counter()
+        self.cprofile_stage = cprofile_stage
+        self.cprofile: Optional[cProfile.Profile] = cProfile.Profile() if cprofile_stage is not None else None
+        self.start_time = time.perf_counter()
+        self._active_stages: set[str] = set()
+        self._counter_lock = threading.Lock()
+        # Peak RSS of each active stage, the peak of the process is reset when a stage starts
+        # and kept in _process_peak, as the reset also clears ru_maxrss
+        self._stage_peaks: dict[str, int] = {}
+        self._process_peak = get_peak_rss() or 0
+        self._stage_peaks_supported = self.enabled and reset_peak_rss()
+
+    def _update_stage_peaks(self):
+        peak_rss = get_peak_rss_since_reset()
+        if peak_rss is not None:
+            self._process_peak = max(self._process_peak, peak_rss)
+            for stage_name, stage_peak in self._stage_peaks.items():
+                self._stage_peaks[stage_name] = max(stage_peak, peak_rss)
+
+    def get_peak_rss(self) -> Optional[int]:
+        """Returns the peak RSS in bytes of this process since it started."""
+        peak_rss = get_peak_rss()
+        if peak_rss is None:
+            return None
+        return max(peak_rss, self._process_peak)
+
+    @contextmanager
+    def stage(self, stage_name: str):
+        if stage_name in self._active_stages:  # Nested in itself, counted by the outer one
+            yield
+            return
+
+        stats = self.stages.get(stage_name)
+        if stats is None:
+            stats = self.stages[stage_name] = {"seconds": 0.0, "calls": 0, "peak_rss": None}
+
+        use_cprofile = self.cprofile is not None and stage_name == self.cprofile_stage
+        self._active_stages.add(stage_name)
+        if self._stage_peaks_supported:
+            # The outer stages keep the peak reached so far
+            self._update_stage_peaks()
+            self._stage_peaks[stage_name] = 0
+            reset_peak_rss()
+        if use_cprofile:
+            self.cprofile.enable()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats["seconds"] += time.perf_counter() - start_time
+            if use_cprofile:
+                self.cprofile.disable()
+            self._active_stages.discard(stage_name)
+            stats["calls"] += 1
+            if self._stage_peaks_supported:
+                self._update_stage_peaks()
+                stats["peak_rss"] = max(stats["peak_rss"] or 0, self._stage_peaks.pop(stage_name))
+
+    def iterate(self, stage_name: str, iterable: Iterable) -> Iterator:
+        """Yields the items of iterable, the time spent producing them is added to the stage."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(stage_name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, counter_name: str, n: int = 1):
+        with self._counter_lock:
+            self.counters[counter_name] += n
+
+    def pop_counters(self) -> dict[str, int]:
+        with self._counter_lock:
+            counters = dict(self.counters)
+            self.counters.clear()
+        return counters
+
+    def merge_counters(self, counters: Optional[dict[str, int]]):
+        if counters:
+            with self._counter_lock:
+                self.counters.update(counters)
+
+    def get_cache_stats(self) -> dict[str, dict[str, float]]:
+        """Hit rates of the caches counted with <name>_cache_hits and <name>_cache_misses, workers included."""
+        caches = {}
+        for counter_name in sorted(self.counters):
+            for suffix in ("_cache_hits", "_cache_misses"):
+                if counter_name.endswith(suffix) and counter_name[:-len(suffix)] not in caches:
+                    cache_name = counter_name[:-len(suffix)]
+                    hits = self.counters[cache_name + "_cache_hits"]
+                    misses = self.counters[cache_name + "_cache_misses"]
+                    caches[cache_name] = {"hits": hits, "misses": misses,
+                                          "hit_rate": hits / (hits + misses) if hits + misses > 0 else 0.0}
+        return caches
+
+    def get_report(self) -> dict:
+        return {
+            "tool_version": TOOL_VERSION,
+            "total_seconds": time.perf_counter() - self.start_time,
+            "peak_rss": self.get_peak_rss(),
+            "peak_rss_workers": get_peak_rss(1),
+            "stages": self.stages,
+            "counters": dict(sorted(self.counters.items())),
+            "caches": self.get_cache_stats(),
+        }
+
+    def format_summary(self, report: dict) -> str:
+        lines = ["%-16s %10s %8s %12s" % ("stage", "seconds", "calls", "peak RSS")]
+        for stage_name, stats in report["stages"].items():
+            lines.append("%-16s %10.3f %8d %12s" % (stage_name, stats["seconds"], stats["calls"], format_bytes(stats["peak_rss"])))
+        lines.append("%-16s %10.3f" % ("total", report["total_seconds"]))
+        if report["peak_rss_workers"]:
+            lines.append("peak RSS of the largest child process: %s" % format_bytes(report["peak_rss_workers"]))
+
+        lines.append("")
+        for counter_name, value in report["counters"].items():
+            lines.append("%-28s %12d" % (counter_name, value))
+
+        for cache_name, stats in report["caches"].items():
+            lines.append("%-28s %12s" % (cache_name + " cache hit rate", "%.1f%%" % (stats["hit_rate"] * 100)))
+
+        return "\n".join(lines)
+
+    def write_report(self, report_file: str, report: dict):
+        with open(report_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    def dump_cprofile(self, dump_file: str):
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(dump_file)
+
+
+class NullProfiler(RunProfiler):
+    """Profiler used when profiling is off, it records nothing."""
+    enabled = False
+
+    def __init__(self) -> None:
+        super().__init__()
+
+    @contextmanager
+    def stage(self, stage_name: str):
+        yield
+
+    def iterate(self, stage_name: str, iterable: Iterable) -> Iterator:
+        return iter(iterable)
+
+    def count(self, counter_name: str, n: int = 1):
+        pass
+
+
+def format_bytes(size: Optional[int]) -> str:
+    if size is None:
+        return "-"
+    return "%.1f MiB" % (size / 1024 / 1024)
+
+
+_profiler: RunProfiler = NullProfiler()
+
+
+def get_profiler() -> RunProfiler:
+    return _profiler
+
+
+def set_profiler(profiler: RunProfiler):
+    global _profiler
+    _profiler = profiler
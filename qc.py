@@ -0,0 +1,242 @@
+from __future__ import annotations
+import csv
+from collections import Counter
+from typing import Optional, Sequence, TypedDict
+
+from functions import BaseLanguageTool, OtoEntryPhonemeInfo, OtoInfo, SegmentInfo, WavInfo, import_numpy
+from refine import ONSET_THRESHOLD, WavFeatures
+
+QC_SEVERITIES = ("error", "warning")
+QC_SORT_KEYS = ("severity", "check", "value", "wav_file", "alias")
+QC_REPORT_FIELDS = ("severity", "check", "value", "wav_file", "alias", "message")
+
+DEFAULT_MIN_LENGTH = 10  # ms, shortest phoneme span
+CLIP_LEVEL = 0.99  # Frame peak counted as clipped, also catches 8-bit full scale
+DC_OFFSET_LIMIT = 0.01  # Mean sample value, about -40 dBFS
+VOWEL_SILENCE_LIMIT = 0.25  # Part of the vowel region below the onset threshold
+VOWEL_UNVOICED_LIMIT = 0.5  # Part of the sounding vowel region without F0, e.g. whispered
+SIL_PADDING = 20  # ms of Sil before onsets and after releases, as planned by generate_articulation_segment_info
+
+# Vowel region of each entry type
+VOWEL_REGION_TYPES = {"rv", "cv", "vv", "rcv", "vcv"}  # preutterance to consonant
+VOWEL_END_TYPES = {"vc", "vr"}  # offset to preutterance
+
+
+class QcIssue(TypedDict):
+    severity: str  # error or warning
+    check: str
+    value: float  # Size of the problem in the unit of the check, larger is worse
+    wav_file: str
+    alias: str
+    message: str
+
+
+def make_issue(severity: str, check: str, value: float, oto_item: Optional[OtoInfo], message: str) -> QcIssue:
+    return {
+        "severity": severity,
+        "check": check,
+        "value": round(float(value), 3),
+        "wav_file": oto_item.wav_file if oto_item is not None else "",
+        "alias": oto_item.alias if oto_item is not None else "",
+        "message": message,
+    }
+
+
+def _get_raw_params(oto_item: OtoInfo) -> list[float]:
+    """Returns offset, consonant, cutoff, preutterance and overlap as written in the oto line."""
+    return [float(value) for value in oto_item.line.split("=", 1)[1].split(",")[1:6]]
+
+
+def check_oto_params(oto_list: list[OtoInfo], wav_info: WavInfo) -> list[QcIssue]:
+    """Checks the parameters of the entries of a wav: values clamped to 0 by read_oto, boundaries out of order
+    and positions past the end of the file."""
+    np = import_numpy()
+    raw = np.array([_get_raw_params(oto_item) for oto_item in oto_list], dtype=np.float64).reshape(-1, 5)
+    raw_offset, raw_consonant, raw_cutoff, raw_preutterance, raw_overlap = raw.T
+    offset = np.array([oto_item.offset for oto_item in oto_list])
+    consonant = np.array([oto_item.consonant for oto_item in oto_list])
+    cutoff = np.array([oto_item.cutoff for oto_item in oto_list])
+    preutterance = np.array([oto_item.preutterance for oto_item in oto_list])
+    overlap = np.array([oto_item.overlap for oto_item in oto_list])
+
+    issues: list[QcIssue] = []
+    absolute = np.stack([raw_offset, raw_offset + raw_consonant, raw_offset + raw_preutterance, raw_offset + raw_overlap])
+    for i in np.flatnonzero(np.any(absolute < 0, axis=0)):
+        issues.append(make_issue("error", "negative_param", -absolute[:, i].min(), oto_list[i],
+                                 "offset %.1f, consonant %.1f, preutterance %.1f, overlap %.1f ms from the start of the wav, "
+                                 "negative values are moved to 0" % tuple(absolute[:, i])))
+
+    # Expected order: overlap and offset <= preutterance <= consonant <= cutoff
+    order_error = np.stack([offset - preutterance, overlap - preutterance, preutterance - consonant, consonant - cutoff])
+    for i in np.flatnonzero(np.any(order_error > 0, axis=0)):
+        issues.append(make_issue("error", "non_monotonic", order_error[:, i].max(), oto_list[i],
+                                 "offset %.1f, overlap %.1f, preutterance %.1f, consonant %.1f, cutoff %.1f ms are out of order"
+                                 % (offset[i], overlap[i], preutterance[i], consonant[i], cutoff[i])))
+
+    # A negative cutoff is a length from the offset
+    end = np.where(raw_cutoff < 0, raw_offset - raw_cutoff, np.maximum(consonant, preutterance))
+    for i in np.flatnonzero(end > wav_info.length):
+        issues.append(make_issue("error", "past_end", end[i] - wav_info.length, oto_list[i],
+                                 "entry ends at %.1f ms, the wav is %.1f ms long" % (end[i], wav_info.length)))
+
+    return issues
+
+
+def check_segments(seg_info_list: list[SegmentInfo], oto_map: dict[str, OtoInfo], windows: Sequence[tuple[int, int]],
+                   wav_info: WavInfo, min_length: float) -> list[QcIssue]:
+    """Checks the planned segments of a wav: phoneme spans shorter than min_length and crop windows
+    outside of the wav, which are filled with silence."""
+    np = import_numpy()
+    issues: list[QcIssue] = []
+
+    for seg_info in seg_info_list:
+        oto_item = oto_map.get(seg_info.source_line)
+        lengths = np.array([span.end - span.start for span in seg_info.phoneme_list])
+        for i in np.flatnonzero(lengths < min_length):
+            span = seg_info.phoneme_list[i]
+            issues.append(make_issue("warning", "short_span", min_length - lengths[i], oto_item,
+                                     "%s of %s segment %s is %.1f ms long" % (
+                                         span.name, seg_info.art_seg.type, " ".join(seg_info.art_seg.phonemes), lengths[i])))
+
+    if len(windows) > 0:
+        window_array = np.array(windows, dtype=np.int64).reshape(-1, 2)
+        outside = np.maximum(-window_array[:, 0], 0) + np.maximum(window_array[:, 1] - wav_info.nframes, 0)
+        for i in np.flatnonzero(outside > 0):
+            seg_info = seg_info_list[i]
+            issues.append(make_issue("warning", "window_outside", outside[i] / wav_info.framerate * 1000,
+                                     oto_map.get(seg_info.source_line),
+                                     "crop window of %s segment %s runs %.1f ms off the wav" % (
+                                         seg_info.art_seg.type, " ".join(seg_info.art_seg.phonemes),
+                                         outside[i] / wav_info.framerate * 1000)))
+
+    return issues
+
+
+def _get_frame_ranges(features: WavFeatures, start: "np.ndarray", end: "np.ndarray") -> tuple["np.ndarray", "np.ndarray"]:
+    np = import_numpy()
+    n_frames = len(features)
+    first = np.clip(np.round((start - features.frame_length / 2) / features.hop), 0, n_frames).astype(np.int64)
+    last = np.clip(np.round((end - features.frame_length / 2) / features.hop) + 1, first, n_frames).astype(np.int64)
+    return first, last
+
+
+def _get_sil_edge(oto_item: OtoInfo, entry_info: OtoEntryPhonemeInfo, lang_tool: BaseLanguageTool) -> Optional[tuple[float, bool]]:
+    """Returns the onset after the Sil padding of an entry or the release before it, and whether it is an onset."""
+    if entry_info.type == "rcv":
+        return oto_item.offset, True
+    elif entry_info.type == "rc":
+        return (oto_item.consonant if lang_tool.is_plosive_consonant(entry_info.phoneme_list[0]) else oto_item.offset), True
+    elif entry_info.type == "rv":
+        return oto_item.preutterance, True
+    elif entry_info.type == "vr" or entry_info.type == "cr":
+        return oto_item.preutterance, False
+    return None
+
+
+def check_audio(oto_list: list[OtoInfo], entry_infos: list[Optional[OtoEntryPhonemeInfo]], lang_tool: BaseLanguageTool,
+                features: WavFeatures) -> list[QcIssue]:
+    """Checks the recording behind each entry with the frame features of the wav: clipping and DC offset
+    between offset and cutoff, silence and missing F0 in the vowel region and sound in the Sil padding of onsets and releases.
+
+    Every region is summed with prefix sums, so a wav with many entries costs about the same as one."""
+    np = import_numpy()
+    issues: list[QcIssue] = []
+    if len(oto_list) == 0 or len(features) == 0:
+        return issues
+
+    threshold = features.noise_floor + ONSET_THRESHOLD
+    zero = np.zeros(1)
+    clipped_sum = np.concatenate([zero, np.cumsum(features.peak >= CLIP_LEVEL)])
+    silent_sum = np.concatenate([zero, np.cumsum(features.energy < threshold)])
+    unvoiced_sum = np.concatenate([zero, np.cumsum((features.energy >= threshold) & (features.f0 == 0))])
+    dc_sum = np.concatenate([zero, np.cumsum(features.dc, dtype=np.float64)])
+    energy_sum = np.concatenate([zero, np.cumsum(features.energy, dtype=np.float64)])
+
+    offset = np.array([oto_item.offset for oto_item in oto_list])
+    cutoff = np.array([oto_item.cutoff for oto_item in oto_list])
+    preutterance = np.array([oto_item.preutterance for oto_item in oto_list])
+    consonant = np.array([oto_item.consonant for oto_item in oto_list])
+
+    first, last = _get_frame_ranges(features, offset, cutoff)
+    count = np.maximum(last - first, 1)
+    clipped = clipped_sum[last] - clipped_sum[first]
+    for i in np.flatnonzero(clipped > 0):
+        issues.append(make_issue("warning", "clipping", clipped[i] * features.hop, oto_list[i],
+                                 "%.1f ms of the entry are at full scale" % (clipped[i] * features.hop)))
+
+    dc = (dc_sum[last] - dc_sum[first]) / count
+    for i in np.flatnonzero(np.abs(dc) > DC_OFFSET_LIMIT):
+        issues.append(make_issue("warning", "dc_offset", abs(dc[i]), oto_list[i],
+                                 "mean sample value is %.3f of full scale" % dc[i]))
+
+    # Vowel region, the entries without one get an empty range
+    entry_types = [entry_info.type if entry_info is not None else None for entry_info in entry_infos]
+    is_vowel_region = np.array([entry_type in VOWEL_REGION_TYPES for entry_type in entry_types])
+    is_vowel_end = np.array([entry_type in VOWEL_END_TYPES for entry_type in entry_types])
+    vowel_start = np.where(is_vowel_region, preutterance, np.where(is_vowel_end, offset, 0))
+    vowel_end = np.where(is_vowel_region, consonant, np.where(is_vowel_end, preutterance, 0))
+    first, last = _get_frame_ranges(features, vowel_start, vowel_end)
+    silent_part = np.where(last > first, (silent_sum[last] - silent_sum[first]) / np.maximum(last - first, 1), 0)
+    for i in np.flatnonzero(silent_part > VOWEL_SILENCE_LIMIT):
+        issues.append(make_issue("warning", "vowel_silence", silent_part[i] * 100, oto_list[i],
+                                 "%.0f%% of the vowel region (%.1f - %.1f ms) is silent" % (
+                                     silent_part[i] * 100, vowel_start[i], vowel_end[i])))
+
+    sounding = (last - first) - (silent_sum[last] - silent_sum[first])
+    unvoiced_part = np.where(sounding > 0, (unvoiced_sum[last] - unvoiced_sum[first]) / np.maximum(sounding, 1), 0)
+    for i in np.flatnonzero(unvoiced_part > VOWEL_UNVOICED_LIMIT):
+        issues.append(make_issue("warning", "vowel_unvoiced", unvoiced_part[i] * 100, oto_list[i],
+                                 "%.0f%% of the vowel region (%.1f - %.1f ms) has no pitch" % (
+                                     unvoiced_part[i] * 100, vowel_start[i], vowel_end[i])))
+
+    # Sil padding before an onset or after a release
+    sil_edges = [_get_sil_edge(oto_item, entry_info, lang_tool) if entry_info is not None else None
+                 for oto_item, entry_info in zip(oto_list, entry_infos)]
+    has_edge = np.array([sil_edge is not None for sil_edge in sil_edges])
+    edge = np.array([sil_edge[0] if sil_edge is not None else 0 for sil_edge in sil_edges])
+    is_onset = np.array([sil_edge is not None and sil_edge[1] for sil_edge in sil_edges])
+    sil_start = np.where(is_onset, edge - SIL_PADDING, edge)
+    first, last = _get_frame_ranges(features, sil_start, sil_start + SIL_PADDING)
+    sil_energy = np.where(has_edge & (last > first), (energy_sum[last] - energy_sum[first]) / np.maximum(last - first, 1),
+                          -np.inf)
+    for i in np.flatnonzero(sil_energy > threshold):
+        issues.append(make_issue("warning", "onset_energy" if is_onset[i] else "release_energy",
+                                 sil_energy[i] - features.noise_floor, oto_list[i],
+                                 "Sil padding %s %.1f ms is %.1f dB above the noise floor" % (
+                                     "before" if is_onset[i] else "after", edge[i], sil_energy[i] - features.noise_floor)))
+
+    return issues
+
+
+def sort_issues(issues: list[QcIssue], sort_key: str = "severity") -> list[QcIssue]:
+    def get_key(issue: QcIssue):
+        severity = QC_SEVERITIES.index(issue["severity"])
+        entry = (issue["wav_file"], issue["alias"])
+        if sort_key == "severity":
+            return (severity, issue["check"]) + entry
+        elif sort_key == "check":
+            return (issue["check"], -issue["value"]) + entry
+        elif sort_key == "value":
+            return (-issue["value"],) + entry
+        elif sort_key == "wav_file":
+            return entry + (severity, issue["check"])
+        return (issue["alias"], issue["wav_file"], severity, issue["check"])
+
+    return sorted(issues, key=get_key)
+
+
+def write_qc_report(report_file: str, issues: list[QcIssue]):
+    """Writes the issues as csv, which spreadsheets can sort and filter by any column."""
+    with open(report_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, QC_REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(issues)
+
+
+def format_qc_summary(issues: list[QcIssue], n_entries: int) -> str:
+    check_counts = Counter((issue["severity"], issue["check"]) for issue in issues)
+    lines = ["%d entries checked, %d issues" % (n_entries, len(issues))]
+    for (severity, check), count in sorted(check_counts.items(), key=lambda item: (QC_SEVERITIES.index(item[0][0]), item[0][1])):
+        lines.append("%-8s %-16s %6d" % (severity, check, count))
+
+    return "\n".join(lines)
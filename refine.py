@@ -0,0 +1,272 @@
+from __future__ import annotations
+from typing import Optional
+
+from audio import WavData, decode_mono
+from functions import BaseLanguageTool, WarningException, import_numpy
+from profiler import get_profiler
+
+FEATURE_VERSION = 3  # Increase when the features are computed differently
+FEATURE_FRAME_LENGTH = 10  # ms
+FEATURE_HOP = 2.5  # ms
+FEATURE_CHUNK_FRAMES = 4096  # Feature frames computed at once
+F0_FRAME_LENGTH = 40  # ms, two periods of 50 Hz, centered on the feature frame
+F0_MIN = 60  # Hz
+F0_MAX = 800  # Hz
+F0_VOICED_LEVEL = 0.5  # Autocorrelation peak below which a frame has no F0
+F0_SAMPLE_RATE = 8000  # Hz, the wav is decimated by whole factors to about this rate before the F0 is searched
+F0_HOP_FRAMES = 4  # Feature frames sharing one F0 frame
+F0_CHUNK_FRAMES = 512  # F0 frames computed at once, their spectra are larger
+FEATURE_PARAMS = {"version": FEATURE_VERSION, "frame_length": FEATURE_FRAME_LENGTH, "hop": FEATURE_HOP,
+                  "f0_frame_length": F0_FRAME_LENGTH, "f0_min": F0_MIN, "f0_max": F0_MAX, "f0_voiced_level": F0_VOICED_LEVEL,
+                  "f0_sample_rate": F0_SAMPLE_RATE, "f0_hop_frames": F0_HOP_FRAMES}
+
+REFINE_VERSION = 1  # Increase when the boundaries are searched differently
+REFINE_SEARCH_WINDOW = 30  # ms on each side of the oto position
+ONSET_THRESHOLD = 15  # dB above the noise floor of the wav
+NOISE_FLOOR_PERCENTILE = 10
+DISTANCE_PENALTY = 0.5  # Score lost by an event at the edge of the search window
+# Stored in the build manifest settings, refined segments are rendered again when any of them changes
+REFINE_PARAMS = {"version": REFINE_VERSION, "search_window": REFINE_SEARCH_WINDOW, "onset_threshold": ONSET_THRESHOLD,
+                 "noise_floor_percentile": NOISE_FLOOR_PERCENTILE, "distance_penalty": DISTANCE_PENALTY,
+                 "features": FEATURE_PARAMS}
+
+
+class WavFeatures:
+    """Short-time energy (dB), zero-crossing rate, spectral flux, peak level, mean (DC), rough F0 and voicing of a wav,
+    one value per hop."""
+    hop: float  # ms
+    frame_length: float  # ms
+    energy: "np.ndarray"
+    zcr: "np.ndarray"
+    flux: "np.ndarray"
+    peak: "np.ndarray"
+    dc: "np.ndarray"
+    f0: "np.ndarray"  # Hz, 0 where the frame is not voiced
+    voicing: "np.ndarray"  # Normalized autocorrelation peak of the F0 frame
+    noise_floor: float  # dB
+
+    def __len__(self) -> int:
+        return len(self.energy)
+
+    def get_frame(self, time: float) -> int:
+        """Returns the frame whose center is closest to time (ms)."""
+        return int(round((time - self.frame_length / 2) / self.hop))
+
+    def get_time(self, frame: float) -> float:
+        return frame * self.hop + self.frame_length / 2
+
+
+def _compute_f0(wav_data: WavData, features: WavFeatures, frame_size: int, hop_size: int):
+    """Fills the F0 and voicing of the feature frames from the autocorrelation of a longer frame.
+
+    The F0 is rough: it is found in the wav decimated to about F0_SAMPLE_RATE, and one F0 frame
+    centered on F0_HOP_FRAMES feature frames is shared by them."""
+    np = import_numpy()
+    n_frames = len(features)
+    decimation = max(wav_data.framerate // F0_SAMPLE_RATE, 1)
+    sample_rate = wav_data.framerate / decimation
+    f0_size = int(round(F0_FRAME_LENGTH / 1000 * sample_rate))
+    f0_hop = hop_size * F0_HOP_FRAMES  # Source samples
+    min_lag = max(int(sample_rate / F0_MAX), 1)
+    max_lag = max(min(int(sample_rate / F0_MIN), f0_size - 2), min_lag)
+    fft_size = 1 << int(np.ceil(np.log2(f0_size + max_lag + 1)))  # Zero padded against wrap-around of the searched lags
+    window = np.hanning(f0_size).astype(np.float32)
+    # Source samples from the start of the first feature frame of a group to the start of its F0 frame
+    frame_offset = frame_size // 2 + hop_size * (F0_HOP_FRAMES - 1) // 2 - f0_size * decimation // 2
+
+    n_f0_frames = -(-n_frames // F0_HOP_FRAMES)
+    for chunk_start in range(0, n_f0_frames, F0_CHUNK_FRAMES):
+        chunk_end = min(chunk_start + F0_CHUNK_FRAMES, n_f0_frames)
+        # The F0 frames reach past the file at its edges, the missing samples are silence
+        sample_start = chunk_start * f0_hop + frame_offset
+        sample_end = (chunk_end - 1) * f0_hop + frame_offset + f0_size * decimation
+        samples = np.zeros(sample_end - sample_start, dtype=np.float32)
+        read_start = max(sample_start, 0)
+        read_end = min(sample_end, wav_data.nframes)
+        if read_end > read_start:
+            samples[read_start - sample_start:read_end - sample_start] = decode_mono(
+                wav_data.frames[read_start:read_end], wav_data.nchannels, wav_data.sampwidth)
+        if decimation > 1:
+            samples = samples[:len(samples) // decimation * decimation].reshape(-1, decimation).mean(axis=1)
+        # The F0 hop is not a whole number of decimated samples, each frame starts at its nearest one
+        frame_starts = np.round(np.arange(chunk_end - chunk_start) * (f0_hop / decimation)).astype(np.int64)
+        frames = samples[np.minimum(frame_starts, len(samples) - f0_size)[:, None] + np.arange(f0_size)].astype(np.float64)
+        frames -= frames.mean(axis=1, keepdims=True)
+
+        spectrum = np.fft.rfft(frames * window, fft_size, axis=1)
+        autocorrelation = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2, fft_size, axis=1)
+        rows = np.arange(len(frames))
+        best_lag = np.argmax(autocorrelation[:, min_lag:max_lag + 1], axis=1) + min_lag
+        peak = autocorrelation[rows, best_lag]
+        voicing = np.clip(peak / np.maximum(autocorrelation[:, 0], 1e-10), 0, 1)
+
+        # Parabolic interpolation of the peak, the lags of the decimated wav are too coarse for a pitch in semitones
+        before = autocorrelation[rows, best_lag - 1]
+        after = autocorrelation[rows, best_lag + 1]
+        curvature = before - 2 * peak + after
+        shift = np.where(curvature < 0, 0.5 * (before - after) / np.where(curvature < 0, curvature, -1), 0)
+        f0 = np.where(voicing >= F0_VOICED_LEVEL, sample_rate / (best_lag + np.clip(shift, -0.5, 0.5)), 0)
+
+        first = chunk_start * F0_HOP_FRAMES
+        last = min(chunk_end * F0_HOP_FRAMES, n_frames)
+        features.voicing[first:last] = np.repeat(voicing, F0_HOP_FRAMES)[:last - first]
+        features.f0[first:last] = np.repeat(f0, F0_HOP_FRAMES)[:last - first]
+
+
+def compute_wav_features(wav_data: WavData) -> WavFeatures:
+    """Computes the features of every frame of a wav, the wav is decoded in chunks."""
+    np = import_numpy()
+    if np is None:
+        raise WarningException("Refining boundaries needs NumPy")
+
+    frame_size = max(int(round(FEATURE_FRAME_LENGTH / 1000 * wav_data.framerate)), 2)
+    hop_size = max(int(round(FEATURE_HOP / 1000 * wav_data.framerate)), 1)
+    n_frames = max((wav_data.nframes - frame_size) // hop_size + 1, 0)
+
+    features = WavFeatures()
+    features.hop = hop_size / wav_data.framerate * 1000
+    features.frame_length = frame_size / wav_data.framerate * 1000
+    features.energy = np.empty(n_frames, dtype=np.float32)
+    features.zcr = np.empty(n_frames, dtype=np.float32)
+    features.flux = np.zeros(n_frames, dtype=np.float32)
+    features.peak = np.empty(n_frames, dtype=np.float32)
+    features.dc = np.empty(n_frames, dtype=np.float32)
+    features.f0 = np.empty(n_frames, dtype=np.float32)
+    features.voicing = np.empty(n_frames, dtype=np.float32)
+
+    window = np.hanning(frame_size).astype(np.float32)
+    previous_spectrum = None
+    for chunk_start in range(0, n_frames, FEATURE_CHUNK_FRAMES):
+        chunk_end = min(chunk_start + FEATURE_CHUNK_FRAMES, n_frames)
+        sample_start = chunk_start * hop_size
+        sample_end = (chunk_end - 1) * hop_size + frame_size
+        samples = decode_mono(wav_data.frames[sample_start:sample_end], wav_data.nchannels, wav_data.sampwidth)
+        frames = np.lib.stride_tricks.sliding_window_view(samples, frame_size)[::hop_size]
+
+        features.energy[chunk_start:chunk_end] = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+        features.zcr[chunk_start:chunk_end] = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+        features.peak[chunk_start:chunk_end] = np.max(np.abs(frames), axis=1)
+        features.dc[chunk_start:chunk_end] = np.mean(frames, axis=1)
+
+        # Positive change of the log spectrum, it peaks at bursts and other onsets
+        spectrum = np.log1p(np.abs(np.fft.rfft(frames * window, axis=1)) * 100)
+        if previous_spectrum is not None:
+            spectrum_diff = np.diff(np.concatenate([previous_spectrum, spectrum]), axis=0)
+            features.flux[chunk_start:chunk_end] = np.mean(np.maximum(spectrum_diff, 0), axis=1)
+        elif chunk_end - chunk_start > 1:
+            features.flux[chunk_start + 1:chunk_end] = np.mean(np.maximum(np.diff(spectrum, axis=0), 0), axis=1)
+        previous_spectrum = spectrum[-1:]
+
+    _compute_f0(wav_data, features, frame_size, hop_size)
+
+    features.noise_floor = -100.0
+    if n_frames > 0:
+        noise_floor, loud_level = np.percentile(features.energy, [NOISE_FLOOR_PERCENTILE, 100 - NOISE_FLOOR_PERCENTILE])
+        # A wav without pauses has no noise floor, every frame is then sound
+        features.noise_floor = float(noise_floor if loud_level - noise_floor >= ONSET_THRESHOLD
+                                     else features.energy.min() - ONSET_THRESHOLD)
+    get_profiler().count("wav_files_analyzed")
+
+    return features
+
+
+class SegmentRefiner:
+    """Moves boundaries guessed from the oto parameters to the nearest acoustic event.
+
+    Every search is limited to REFINE_SEARCH_WINDOW around the guess and to the given bounds,
+    if no event is found there the guess is kept."""
+
+    def __init__(self, features: WavFeatures, lang_tool: BaseLanguageTool) -> None:
+        self.features = features
+        self.lang_tool = lang_tool
+        self.threshold = features.noise_floor + ONSET_THRESHOLD
+
+    def _get_search_range(self, guess: float, lower: Optional[float], upper: Optional[float]) -> tuple[int, int]:
+        start = guess - REFINE_SEARCH_WINDOW if lower is None else max(guess - REFINE_SEARCH_WINDOW, lower)
+        end = guess + REFINE_SEARCH_WINDOW if upper is None else min(guess + REFINE_SEARCH_WINDOW, upper)
+        return max(self.features.get_frame(start), 1), min(self.features.get_frame(end) + 1, len(self.features))
+
+    @staticmethod
+    def _clamp(time: float, lower: Optional[float], upper: Optional[float]) -> float:
+        # Frame times may be half a hop outside of the bounds
+        if lower is not None:
+            time = max(time, lower)
+        if upper is not None:
+            time = min(time, upper)
+        return time
+
+    def _pick_peak(self, score: "np.ndarray", first_frame: int, guess: float) -> Optional[float]:
+        """Returns the time of the local maximum of score with the best score after the distance penalty."""
+        np = import_numpy()
+        if len(score) < 3:
+            return None
+
+        is_peak = np.zeros(len(score), dtype=bool)
+        is_peak[1:-1] = (score[1:-1] >= score[:-2]) & (score[1:-1] > score[2:])
+        peaks = np.flatnonzero(is_peak)
+        if len(peaks) == 0:
+            return None
+
+        score_range = float(score.max() - score.min())
+        if score_range <= 0:
+            return None
+
+        times = self.features.get_time(peaks + first_frame)
+        rank = (score[peaks] - score.min()) / score_range - DISTANCE_PENALTY * np.abs(times - guess) / REFINE_SEARCH_WINDOW
+        return float(times[np.argmax(rank)])
+
+    def _pick_crossing(self, rising: bool, guess: float, lower: Optional[float], upper: Optional[float]) -> float:
+        np = import_numpy()
+        first_frame, last_frame = self._get_search_range(guess, lower, upper)
+        if last_frame <= first_frame:
+            return guess
+
+        energy = self.features.energy[first_frame - 1:last_frame]
+        above = energy >= self.threshold
+        crossings = np.flatnonzero(above[1:] & ~above[:-1] if rising else above[:-1] & ~above[1:])
+        if len(crossings) == 0:
+            return guess
+
+        # Halfway between the frames on both sides of the threshold
+        times = self.features.get_time(crossings + first_frame - 0.5)
+        return self._clamp(float(times[np.argmin(np.abs(times - guess))]), lower, upper)
+
+    def sound_onset(self, guess: float, lower: Optional[float] = None, upper: Optional[float] = None) -> float:
+        """Edge between Sil and the following sound."""
+        return self._pick_crossing(True, guess, lower, upper)
+
+    def sound_offset(self, guess: float, lower: Optional[float] = None, upper: Optional[float] = None) -> float:
+        """Edge between a sound and the following Sil."""
+        return self._pick_crossing(False, guess, lower, upper)
+
+    def burst_onset(self, guess: float, lower: Optional[float] = None, upper: Optional[float] = None) -> float:
+        """Release of a plosive, where the spectral flux and the energy rise the most."""
+        np = import_numpy()
+        first_frame, last_frame = self._get_search_range(guess, lower, upper)
+        if last_frame - first_frame < 3:
+            return guess
+
+        flux = self.features.flux[first_frame:last_frame]
+        energy_rise = np.maximum(np.diff(self.features.energy[first_frame - 1:last_frame]), 0)
+        score = flux / (flux.max() + 1e-6) + energy_rise / (energy_rise.max() + 1e-6)
+
+        time = self._pick_peak(score, first_frame, guess)
+        return guess if time is None else self._clamp(time, lower, upper)
+
+    def consonant_center(self, consonant: str, guess: float, lower: float, upper: float) -> float:
+        """Center of a consonant: the burst of a plosive, the strongest frication of an unvoiced consonant,
+        and the energy dip of other consonants."""
+        if self.lang_tool.is_plosive_consonant(consonant):
+            return self.burst_onset(guess, lower, upper)
+
+        first_frame, last_frame = self._get_search_range(guess, lower, upper)
+        if last_frame - first_frame < 3:
+            return guess
+
+        if self.lang_tool.is_unvoiced_consonant(consonant):
+            score = self.features.zcr[first_frame:last_frame]
+        else:
+            score = -self.features.energy[first_frame:last_frame]
+
+        time = self._pick_peak(score, first_frame, guess)
+        return guess if time is None else self._clamp(time, lower, upper)
@@ -0,0 +1,100 @@
+from __future__ import annotations
+import json
+import logging
+from typing import Optional, TypedDict
+
+from functions import TOOL_VERSION, ArticulationSegmentInfo, PhonemeSpan, SegmentInfo, WarningException, WavInfo
+
+PLAN_VERSION = 1
+
+
+class PlannedSegment(TypedDict):
+    file_name: str
+    wav_file: str
+    crop_window: list[int]  # Frames of the source wav
+    substitute: Optional[str]  # Articulation whose timing is reused, for missing articulations
+    wav_source: Optional[str]  # Already written segment wav with the same crop window
+    source_line: str
+    wav_offset: float
+    wav_cutoff: float
+    auto_item: bool
+    phonemes: list[tuple[str, float, float]]
+    type: str
+    boundaries: list[int]  # Frames of the source wav
+
+
+class SegmentPlan(TypedDict):
+    plan_version: int
+    tool_version: str
+    oto_file: str
+    settings: dict
+    wav_files: dict[str, dict]
+    segments: list[PlannedSegment]
+    missing: list[str]
+    alternatives: dict[str, Optional[str]]
+    warnings: list[str]
+
+
+def segment_to_dict(seg_info: SegmentInfo, file_name: str, wav_file: str, crop_window: tuple[int, int],
+                    substitute: Optional[str] = None, wav_source: Optional[str] = None) -> PlannedSegment:
+    return {
+        "file_name": file_name,
+        "wav_file": wav_file,
+        "crop_window": list(crop_window),
+        "substitute": substitute,
+        "wav_source": wav_source,
+        "source_line": seg_info.source_line,
+        "wav_offset": seg_info.wav_offset,
+        "wav_cutoff": seg_info.wav_cutoff,
+        "auto_item": seg_info.auto_item,
+        "phonemes": [tuple(span) for span in seg_info.phoneme_list],
+        "type": seg_info.art_seg.type,
+        "boundaries": list(seg_info.art_seg.boundaries),
+    }
+
+
+def segment_from_dict(segment: PlannedSegment) -> SegmentInfo:
+    phoneme_list = tuple(PhonemeSpan(name, start, end) for name, start, end in segment["phonemes"])
+    art_seg = ArticulationSegmentInfo(segment["type"], tuple(span.name for span in phoneme_list), tuple(segment["boundaries"]))
+    return SegmentInfo(segment["source_line"], segment["wav_offset"], segment["wav_cutoff"], segment["auto_item"],
+                       phoneme_list, art_seg)
+
+
+def wav_info_to_dict(wav_info: WavInfo) -> dict:
+    return {key: getattr(wav_info, key) for key in WavInfo.__annotations__ if key != "wav_file"}
+
+
+def wav_info_from_dict(wav_file: str, wav_info_dict: dict) -> WavInfo:
+    wav_info = WavInfo()
+    wav_info.wav_file = wav_file
+    for key, value in wav_info_dict.items():
+        setattr(wav_info, key, value)
+    return wav_info
+
+
+def write_plan(plan_file: str, plan: SegmentPlan):
+    with open(plan_file, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False, indent=1)
+
+
+def read_plan(plan_file: str) -> SegmentPlan:
+    with open(plan_file, "r", encoding="utf-8") as f:
+        plan: SegmentPlan = json.load(f)
+
+    if plan.get("plan_version") != PLAN_VERSION:
+        raise WarningException(f"{plan_file} is not a segment plan of version {PLAN_VERSION}")
+    if plan["tool_version"] != TOOL_VERSION:
+        raise WarningException(f"{plan_file} was written by version {plan['tool_version']}, plan the oto.ini again")
+
+    return plan
+
+
+class WarningCollector(logging.Handler):
+    """Keeps the messages of the warnings logged while it is attached."""
+
+    def __init__(self) -> None:
+        super().__init__(logging.WARNING)
+        self.messages: list[str] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.messages.append(record.getMessage())
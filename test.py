@@ -4,11 +4,8 @@ from phoneme import *
 
 oto_aliases = ["- u", "- う", "- da", "- d", "- だ", "a d", "a n", "n a", "n d", "i n", "a -", "u -", "n -", "にゃ"]
 
-for alias in oto_aliases:
-    oto_item = OtoInfo()
-    oto_item.alias = alias
+lang_tool = JapaneseLanguageTool()
+alias_columns = lang_tool.classify_many(oto_aliases)
 
-    lang_tool = JapaneseLanguageTool()
-    phoneme_info = lang_tool.get_oto_entry_phoneme_info(oto_item)
-
-    print("%s: %s" % (alias, phoneme_info.type))
\ No newline at end of file
+for alias, alias_type, error in zip(alias_columns["alias"], alias_columns["type"], alias_columns["error"]):
+    print("%s: %s" % (alias, alias_type if alias_type is not None else error))